@@ -17,9 +17,66 @@ default, so this property will always equal the Last Modified Date property.
 Enable the Last Accessed Date property in the registry to receive accurate
 results.
 """
+import csv
+import fnmatch
+import gzip
+import io
+import json
 import os
+import re
 import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from heapq import nlargest, nsmallest
+from collections import deque, namedtuple
 from datetime import datetime, timedelta
+from operator import attrgetter
+
+try:
+    import pwd  # For report owner names, not available on Windows
+except ImportError:
+    pwd = None
+
+
+# One record per file, filled from a single stat during the scan.
+# e.g. FileRecord(path='docs/foo.txt', size=1024, mtime=1436284573.1, ...)
+# uid is the owner's user id, or None where it is not known.
+FileRecord = namedtuple('FileRecord', ['path', 'size', 'mtime', 'atime',
+                                       'ctime', 'uid'], defaults=(None,))
+
+# Files older than days, and their total size, for one aging threshold.
+AgingBucket = namedtuple('AgingBucket', ['days', 'count', 'bytes'])
+
+# A directory's stale files and bytes, including all its subdirectories.
+RollupEntry = namedtuple('RollupEntry', ['path', 'files', 'bytes'])
+
+# What top_files() can rank by.
+TOP_ORDERS = ('oldest', 'largest')
+
+# Default thresholds of aging_report(), in days.
+AGING_THRESHOLDS = (30, 90, 365, 1825)
+
+# Columns, and their titles, that write_report() can write.
+REPORT_COLUMNS = ('date', 'path', 'size', 'mtime', 'atime', 'ctime', 'owner')
+REPORT_HEADERS = {'date': 'Year-Month-Date',
+                  'path': 'Full file path',
+                  'size': 'Size (bytes)',
+                  'mtime': 'Last modified',
+                  'atime': 'Last accessed',
+                  'ctime': 'Changed',
+                  'owner': 'Owner'}
+
+# Formats that write_report() can write.
+REPORT_FORMATS = ('txt', 'csv', 'jsonl')
+
+# NumPy is optional, it is imported the first time ScanStore needs it.
+_numpy = False
+
+# How ScanStore packs paths into bytes, the same way os.fsencode() does.
+_FS_ENCODING = sys.getfilesystemencoding()
+_FS_ERRORS = sys.getfilesystemencodeerrors()
 
 
 def get_time(file_name, mod='m'):
@@ -48,90 +105,1184 @@ def get_time(file_name, mod='m'):
         return datetime.fromtimestamp(t)
 
 
+def _timestamp(item, flag='m'):
+    """
+    Return the epoch seconds of item's last accessed or modified time.
+
+    :param item: A FileRecord, or a filename which will be stat'ed.
+    :param flag: Optional. Default 'm' for last modified, 'a' for last
+                 accessed.
+    :returns: a float of seconds since the epoch.
+    """
+    if isinstance(item, FileRecord):
+        return item.atime if flag == 'a' else item.mtime
+    return get_time(item, flag).timestamp()
+
+
+def _path(item):
+    """Return the filename of item, which is a FileRecord or a filename."""
+    if isinstance(item, FileRecord):
+        return item.path
+    return item
+
+
+class Blacklist(object):
+    """
+    A compiled set of blacklist patterns, checked against every file and
+    directory name during a scan. A blacklisted directory is pruned, so
+    nothing below it is ever listed.
+
+    Each pattern is one of:
+
+    * An exact name, e.g. "backup". Matches a file or directory of that
+      name anywhere in the tree, with a set lookup.
+    * A glob, e.g. "*.bak" or "snapshot-*". Matches names with fnmatch
+      rules. A glob containing a path separator, e.g. "*/tmp/*", is matched
+      against the full path instead.
+    * A path, e.g. "archive/2010" or "/srv/share/old". Matches that one
+      file or directory. Relative paths are anchored at the directory the
+      scan starts from.
+
+    Blank lines and lines starting with '#' are ignored.
+    """
+
+    def __init__(self, patterns=()):
+        """
+        Compile patterns.
+
+        :param patterns: Optional. An iterable of pattern strings.
+        """
+        self.patterns = []
+        self.names = set()
+        self.paths = []
+        name_globs = []
+        path_globs = []
+
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            self.patterns.append(pattern)
+
+            is_path = os.sep in pattern or (os.altsep and
+                                            os.altsep in pattern)
+            if any(c in pattern for c in '*?['):
+                (path_globs if is_path else name_globs).append(pattern)
+            elif is_path:
+                self.paths.append(os.path.normpath(pattern))
+            else:
+                self.names.add(pattern)
+
+        # One alternation per kind, so each name is matched in a single call
+        self._name_re = self._compile(name_globs)
+        self._path_re = self._compile(path_globs)
+
+    @staticmethod
+    def _compile(globs):
+        """Return a compiled regex matching any of globs, or None."""
+        if not globs:
+            return None
+        return re.compile('|'.join(fnmatch.translate(g) for g in globs))
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __repr__(self):
+        return 'Blacklist({!r})'.format(self.patterns)
+
+    def bind(self, top):
+        """
+        Return a matcher for a scan starting at the directory top.
+
+        :param top: The normalized directory the scan starts from.
+        :returns: a tuple of (names, other). names is a set of exact names
+                  to skip. other is None, or a callable taking an entry's
+                  name and path and returning True if it should be skipped.
+        """
+        # Anchor path patterns at top, spelled the way scandir builds paths
+        paths = set()
+        abs_top = os.path.abspath(top)
+        for p in self.paths:
+            if os.path.isabs(p):
+                p = os.path.relpath(p, abs_top)
+                if p == os.pardir or p.startswith(os.pardir + os.sep):
+                    continue  # Outside this scan
+            paths.add(os.path.join(top, p))
+
+        name_re = self._name_re
+        path_re = self._path_re
+        if not (paths or name_re or path_re):
+            return self.names, None
+
+        def other(name, path):
+            return ((name_re is not None and name_re.match(name) is not None)
+                    or path in paths
+                    or (path_re is not None and
+                        path_re.match(path) is not None))
+
+        return self.names, other
+
+
 def get_blacklist(blacklist_path):
     """
-    Return a list from given path of file contents.
+    Return a Blacklist compiled from given path of file contents, one
+    pattern per line.
 
-    :returns: a list of folders/filenames
+    :returns: a Blacklist of folder/filename patterns
+    :raises IOError: if the file can not be found or read.
     """
+    # If no file given, just return empty blacklist.
+    if not blacklist_path:
+        return Blacklist()
+
     if not os.path.isfile(blacklist_path):
         raise IOError('Given blacklist_path file cannot be found.')
 
-    # If empty, just return empty list.
-    if not blacklist_path:
-        return []
     try:
         with open(blacklist_path, 'r') as bl:
             content = bl.read()
-        return content.split('\n')
+        return Blacklist(content.split('\n'))
     except IOError:
         raise IOError("Error reading from blacklist file.")
 
 
-def get_file_paths(directory='.', blacklist=None, get_hidden=False):
+def _as_blacklist(blacklist):
+    """Return blacklist as a Blacklist, compiling it if it is a list."""
+    if isinstance(blacklist, Blacklist):
+        return blacklist
+    return Blacklist(blacklist or ())
+
+
+class ScanStats(object):
+    """
+    Counters and per phase wall times of a scan, to find out where the time
+    of a slow scan goes. Pass one as the stats argument of
+    iter_file_records() or iter_file_paths() and it is updated as each
+    directory is listed. Without one, nothing is counted or timed.
+
+    Counters:
+
+    * dirs: directories listed.
+    * entries: files and subdirectories found, after skipping hidden and
+      blacklisted names.
+    * stat_calls: files stat'ed.
+    * errors: directories that could not be listed and files that could
+      not be stat'ed.
+    * bytes: total size of the files stat'ed.
+
+    phases maps a phase name, e.g. 'walk', 'blacklist', 'filter' or
+    'write', to the seconds spent in it, less the time of any phase nested
+    inside it, so the phases add up to the elapsed time. With more than one
+    worker thread blacklist matching is only timed as part of 'walk'.
+
+    governor is the ScanGovernor of the scan, if it has one, whose live
+    operation rate and concurrency are reported with the counters.
+
+    Override directory() or error() in a subclass to pass the numbers on,
+    e.g. to a monitoring system.
+    """
+
+    def __init__(self):
+        self.governor = None
+        self.dirs = 0
+        self.entries = 0
+        self.stat_calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.phases = {}
+        self.start = time.perf_counter()
+        self._charged = 0.0  # Seconds added to any phase so far
+        self._lock = threading.Lock()  # Walker threads update this too
+
+    def directory(self, root, files, subdirs, with_stat=True):
+        """
+        Count a directory once it is listed. Called from the walker
+        threads.
+
+        :param root: The directory listed.
+        :param files: The list of FileRecords, or filenames, found in it.
+        :param subdirs: The list of subdirectories found in it.
+        :param with_stat: True if files are FileRecords.
+        """
+        with self._lock:
+            self.dirs += 1
+            self.entries += len(files) + len(subdirs)
+            if with_stat:
+                self.stat_calls += len(files)
+                self.bytes += sum(f.size for f in files)
+
+    def error(self, path, error):
+        """
+        Count an OSError which made the scan skip path. Called from the
+        walker threads.
+
+        :param path: The directory or file skipped.
+        :param error: The OSError raised.
+        """
+        with self._lock:
+            self.errors += 1
+
+    def add_time(self, name, elapsed, charged):
+        """
+        Add the time of one run of a phase.
+
+        :param name: Name of the phase.
+        :param elapsed: Wall seconds the run took.
+        :param charged: The value of _charged when the run started, so the
+                        time of phases nested inside it is left out.
+        """
+        with self._lock:
+            own = elapsed - (self._charged - charged)
+            self.phases[name] = self.phases.get(name, 0.0) + own
+            self._charged += own
+
+    def phase(self, name):
+        """
+        Return a context manager timing its block as the phase name, e.g.
+
+            with stats.phase('write'):
+                write_report(matches, name)
+        """
+        return _Phase(self, name)
+
+    def timed(self, items, name):
+        """
+        Yield the items of the iterable items, timing the work of producing
+        each as the phase name. Use it to time one stage of a streaming
+        pipeline, the stages it reads from are timed by their own phases.
+        """
+        clock = time.perf_counter
+        it = iter(items)
+        while True:
+            charged = self._charged
+            start = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(name, clock() - start, charged)
+                return
+            self.add_time(name, clock() - start, charged)
+            yield item
+
+    def elapsed(self):
+        """Return the seconds since this was created."""
+        return time.perf_counter() - self.start
+
+    def throughput(self):
+        """Return a line of the scan's counts and rates so far."""
+        elapsed = max(self.elapsed(), 1e-9)
+        line = ("{} dirs, {} files, {} errors in {:.1f}s: {:.0f} files/sec, "
+                "{:.1f} MB/sec stat'ed".format(
+                    self.dirs, self.stat_calls, self.errors, elapsed,
+                    self.stat_calls / elapsed, self.bytes / elapsed / 1e6))
+        if self.governor is not None:
+            line += "; " + self.governor.status()
+        return line
+
+    def summary(self):
+        """Return a list of lines summarizing the counters and phases."""
+        elapsed = max(self.elapsed(), 1e-9)
+        lines = ["Directories: {}  Entries: {}  Stats: {}  Errors: {}  "
+                 "Bytes: {}".format(self.dirs, self.entries, self.stat_calls,
+                                    self.errors, self.bytes)]
+        for name, seconds in sorted(self.phases.items(),
+                                    key=lambda item: -item[1]):
+            lines.append("  {:<10} {:9.3f}s {:5.1f}%".format(
+                name, seconds, 100 * seconds / elapsed))
+        lines.append("  {:<10} {:9.3f}s".format("total", elapsed))
+        if self.governor is not None:
+            lines.append("Governor: " + self.governor.status())
+        return lines
+
+
+class _Phase(object):
+    """Context manager of ScanStats.phase()."""
+
+    __slots__ = ('stats', 'name', 'charged', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.charged = self.stats._charged
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.name, time.perf_counter() - self.start,
+                            self.charged)
+
+
+def _timed_matcher(other, stats):
+    """Return the Blacklist.bind() callable other, timed as 'blacklist'."""
+    clock = time.perf_counter
+
+    def timed(name, path):
+        charged = stats._charged
+        start = clock()
+        try:
+            return other(name, path)
+        finally:
+            stats.add_time('blacklist', clock() - start, charged)
+    return timed
+
+
+class ScanGovernor(object):
+    """
+    Limits how hard a scan works a file server, so it can run during
+    business hours. Pass one as the governor argument of
+    iter_file_records() or iter_file_paths().
+
+    Every directory listing and stat takes a token from a bucket refilled
+    at rate tokens per second, holding at most burst, so the scan makes at
+    most rate operations per second on average. A thread with no token
+    waits for one.
+
+    With target_latency set, the number of directories listed at once is
+    adjusted to the server: every ADJUST_INTERVAL seconds the mean time of
+    an operation is measured, and if it is above target_latency the
+    concurrency is cut by a quarter, otherwise it grows by one, up to the
+    walk's workers.
+
+    The live operation rate, mean latency and concurrency are in status(),
+    and in the ScanStats of the scan.
+    """
+
+    # Seconds between measurements of the latency and rate.
+    ADJUST_INTERVAL = 0.5
+
+    def __init__(self, rate=None, burst=None, target_latency=None):
+        """
+        :param rate: Optional. Most operations per second. Default None
+                     does not limit the rate.
+        :param burst: Optional. Most operations made at once after a pause.
+                      Defaults to a tenth of a second's worth of rate.
+        :param target_latency: Optional. Seconds an operation should take.
+                               Default None keeps the concurrency at the
+                               walk's workers.
+        :raises ValueError: if rate or burst is not positive.
+        """
+        if rate is not None and rate <= 0:
+            raise ValueError('rate must be positive')
+        if burst is not None and burst <= 0:
+            raise ValueError('burst must be positive')
+        self.rate = rate
+        if burst is None and rate is not None:
+            burst = max(1.0, rate / 10.0)
+        self.burst = burst
+        self.target_latency = target_latency
+        self.max_workers = 1
+        self.limit = 1  # Directories listed at once
+        self.ops = 0  # Operations so far
+        self.ops_rate = 0.0  # Operations per second, last measured
+        self.latency = 0.0  # Mean seconds per operation, last measured
+        self._cond = threading.Condition()
+        self._tokens = self.burst or 0
+        self._stamp = time.monotonic()
+        self._started = self._stamp
+        self._active = 0
+        self._window_start = self._stamp
+        self._window_ops = 0
+        self._window_time = 0.0
+        self._window_mark = 0
+        self._local = threading.local()
+
+    def start(self, workers):
+        """Start governing a walk with up to workers threads."""
+        with self._cond:
+            self.max_workers = workers
+            self.limit = workers
+            self._cond.notify_all()
+
+    def acquire(self):
+        """Take a token for one operation, waiting for it if need be."""
+        with self._cond:
+            self.ops += 1
+            if self.rate is None:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._stamp) * self.rate)
+            self._stamp = now
+            # Reserve the token now, so waiting threads queue in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+            self._local.waited = self.waited() + wait
+
+    def waited(self):
+        """Return the seconds this thread has waited for tokens."""
+        return getattr(self._local, 'waited', 0.0)
+
+    def slot(self):
+        """
+        Return a context manager holding one of the limit slots of
+        directories being listed, waiting for one if need be.
+        """
+        return _GovernorSlot(self)
+
+    def record(self, ops, seconds):
+        """
+        Count ops operations that took seconds, not counting waits for
+        tokens, and adjust the concurrency every ADJUST_INTERVAL.
+        """
+        with self._cond:
+            self._window_ops += ops
+            self._window_time += seconds
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed < self.ADJUST_INTERVAL:
+                return
+            self.ops_rate = (self.ops - self._window_mark) / elapsed
+            self.latency = self._window_time / max(self._window_ops, 1)
+            self._window_start = now
+            self._window_ops = 0
+            self._window_time = 0.0
+            self._window_mark = self.ops
+            if self.target_latency is None:
+                return
+            if self.latency > self.target_latency:
+                self.limit = max(1, self.limit * 3 // 4)  # Back off fast
+            elif self.limit < self.max_workers:
+                self.limit += 1  # Recover slowly
+                self._cond.notify_all()
+
+    def status(self):
+        """Return a line of the live rate, latency and concurrency."""
+        cap = "unlimited" if self.rate is None else \
+            "{:.0f}".format(self.rate)
+        rate, latency = self.ops_rate, self.latency
+        if not rate:  # Too short for a measurement, use the run so far
+            with self._cond:
+                rate = self.ops / max(time.monotonic() - self._started,
+                                      1e-9)
+                latency = self._window_time / max(self._window_ops, 1)
+        return ("{:.0f} ops/sec (cap {}), {:.1f} ms/op, {} of {} "
+                "workers".format(rate, cap, latency * 1000, self.limit,
+                                 self.max_workers))
+
+
+class _GovernorSlot(object):
+    """Context manager of ScanGovernor.slot()."""
+
+    __slots__ = ('governor',)
+
+    def __init__(self, governor):
+        self.governor = governor
+
+    def __enter__(self):
+        governor = self.governor
+        with governor._cond:
+            while governor._active >= governor.limit:
+                governor._cond.wait()
+            governor._active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        governor = self.governor
+        with governor._cond:
+            governor._active -= 1
+            governor._cond.notify()
+
+
+def _scan_directory(root, excluded, get_hidden, strip, with_stat=True,
+                    on_error=None, keep=None, prune=None, throttle=None):
+    """
+    List a single directory with os.scandir().
+
+    :param root: The directory to list.
+    :param excluded: A matcher from Blacklist.bind() of file and/or
+                     directory names to skip.
+    :param get_hidden: If True include hidden files and directories.
+    :param strip: Number of leading characters to strip from each path.
+    :param with_stat: Optional. Default True returns FileRecords, False
+                      returns the filenames without stat'ing them.
+    :param on_error: Optional. A callable taking a path and an OSError,
+                     called for a directory or file that is skipped
+                     because of an error, e.g. ScanStats.error().
+    :param keep: Optional. A callable taking a file's name and path,
+                 returning False to skip the file before it is stat'ed.
+    :param prune: Optional. A callable taking a directory's path,
+                  returning True to skip it and everything below it.
+    :param throttle: Optional. A callable called before listing root and
+                     before each stat, e.g. ScanGovernor.acquire().
+    :returns: a tuple of (files, subdirectories). Both are empty if root
+              could not be listed.
+    """
+    files = []
+    subdirs = []
+    names, other = excluded
+    if throttle is not None:
+        throttle()
+    try:
+        it = os.scandir(root)
+    except OSError as e:  # Same as os.walk(), skip what we can not list
+        if on_error is not None:
+            on_error(root, e)
+        return files, subdirs
+
+    with it:
+        for entry in it:
+            name = entry.name
+            if not get_hidden and name.startswith('.'):
+                continue
+            if name in names:
+                continue
+            if other is not None and other(name, entry.path):
+                continue
+            try:
+                if entry.is_dir():
+                    # Like os.walk(), do not follow symlinked directories
+                    if not entry.is_symlink() and (
+                            prune is None or not prune(entry.path[strip:])):
+                        subdirs.append(entry.path)
+                    continue
+                if keep is not None and not keep(name, entry.path[strip:]):
+                    continue
+                if not with_stat:
+                    files.append(entry.path[strip:])
+                    continue
+                if throttle is not None:
+                    throttle()
+                st = entry.stat()
+            except OSError as e:  # Vanished, or a broken symlink
+                if on_error is not None:
+                    on_error(entry.path, e)
+                continue
+            files.append(FileRecord(entry.path[strip:], st.st_size,
+                                    st.st_mtime, st.st_atime, st.st_ctime,
+                                    st.st_uid))
+    return files, subdirs
+
+
+def _parallel_walk(top, scan, workers):
+    """
+    Walk the tree under top with a work-stealing pool of threads.
+
+    Each thread keeps its own deque of directories to list. It takes work
+    from the end of its own deque and, when that runs dry, steals from the
+    front of another thread's deque, so large subtrees get shared out.
+
+    :param top: The directory to start from.
+    :param scan: A callable taking a directory and returning a tuple of
+                 (files, subdirectories), like _scan_directory().
+    :param workers: The number of threads to use.
+    :returns: a list of everything scan returned as files, in no order.
+    """
+    queues = [deque() for _ in range(workers)]
+    queues[0].append(top)
+    cond = threading.Condition()
+    state = {'pending': 1, 'error': None}  # Directories queued or in progress
+    results = [[] for _ in range(workers)]
+
+    def take(i):
+        """Return a directory from queue i, stealing if it is empty."""
+        try:
+            return queues[i].pop()
+        except IndexError:
+            pass
+        for j in range(1, workers):
+            try:
+                return queues[(i + j) % workers].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def work(i):
+        while True:
+            with cond:
+                if state['error'] is not None:
+                    return
+            root = take(i)
+            if root is None:
+                with cond:
+                    while (state['pending'] and state['error'] is None
+                           and not any(queues)):
+                        cond.wait()
+                    if not state['pending'] or state['error'] is not None:
+                        return
+                continue
+
+            files, subdirs = [], []
+            try:
+                files, subdirs = scan(root)
+            except Exception as e:  # Stop everybody, re-raised below
+                with cond:
+                    if state['error'] is None:
+                        state['error'] = e
+                    for q in queues:
+                        q.clear()
+                    cond.notify_all()
+                return
+            results[i].extend(files)
+
+            with cond:
+                if state['error'] is not None:
+                    # Another thread failed, leave pending alone so no
+                    # thread waits on a count that can never reach zero
+                    cond.notify_all()
+                    return
+                # Queue subdirectories before this one counts as done, so
+                # pending can not drop to zero while work is outstanding
+                queues[i].extend(reversed(subdirs))
+                state['pending'] += len(subdirs) - 1
+                if subdirs or not state['pending']:
+                    cond.notify_all()
+
+    threads = [threading.Thread(target=work, args=(i,), daemon=True)
+               for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if state['error'] is not None:
+        raise state['error']
+    return [f for part in results for f in part]
+
+
+class ScanCheckpoint(object):
+    """
+    Saves the progress of a scan, so a scan that is interrupted can be
+    resumed without walking the directories it already finished.
+
+    Pass one as the checkpoint argument of iter_file_records() or
+    iter_file_paths(). Every file the walk yields is appended to a log,
+    path + '.records', and every interval seconds the log is synced and
+    the pending directories of the walk are saved to path. A walk resumed
+    from the checkpoint first yields the logged files again, then lists
+    only the directories that were still pending, so it yields the same
+    files as a walk that was never interrupted.
+
+    Several directories can be walked one after the other with the same
+    checkpoint, e.g. every root of a command line scan.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, options=None, resume=False, interval=60):
+        """
+        Start a new checkpoint at path, or resume from the one there.
+
+        :param path: Name of the checkpoint file.
+        :param options: Optional. Anything JSON serializable describing
+                        the scan, e.g. its blacklist. Resuming fails if
+                        it differs from the options saved.
+        :param resume: Optional. Default is False, start a new checkpoint
+                       replacing any at path. If True resume from it.
+        :param interval: Optional. Seconds between checkpoints.
+        :raises IOError: if resuming and there is no usable checkpoint at
+                         path, or it was made with other options.
+        """
+        self.path = path
+        self.log_path = path + '.records'
+        self.interval = interval
+        self._last = time.monotonic()
+
+        if not resume:
+            self._state = {'version': self.VERSION, 'options': options,
+                           'roots': {}, 'size': 0}
+            self._log = open(self.log_path, 'w+b')
+            return
+
+        try:
+            with open(path) as f:
+                self._state = json.load(f)
+            self._log = open(self.log_path, 'r+b')
+        except (IOError, ValueError) as e:
+            raise IOError('Can not resume from checkpoint {}: {}'.format(
+                path, e))
+        if self._state.get('version') != self.VERSION:
+            self._log.close()
+            raise IOError('Unknown checkpoint version in {}'.format(path))
+        if self._state['options'] != json.loads(json.dumps(options)):
+            self._log.close()
+            raise IOError('Checkpoint {} is of a scan with other options'
+                          .format(path))
+        # Drop files logged after the last checkpoint, they are listed again
+        self._log.truncate(self._state['size'])
+        self._log.seek(self._state['size'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the log, leaving the checkpoint to resume from."""
+        self._log.close()
+
+    def remove(self):
+        """Close and delete the checkpoint, e.g. once the scan is done."""
+        self.close()
+        for name in (self.path, self.log_path):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    def start(self, top):
+        """
+        Begin walking top.
+
+        :param top: The normalized directory the walk starts from.
+        :returns: a tuple of (the stack of directories to list, an iterable
+                  of the files already yielded under top).
+        """
+        roots = self._state['roots']
+        key = os.path.abspath(top)
+        if key not in roots:
+            roots[key] = {'start': self._log.tell(), 'pending': [top]}
+            return [top], ()
+
+        # Roots are walked in turn, so top's files run up to where the
+        # next root's files start
+        keys = list(roots)
+        n = keys.index(key) + 1
+        start = roots[key]['start']
+        end = roots[keys[n]]['start'] if n < len(keys) else \
+            self._state['size']
+        return list(roots[key]['pending']), self._replay(start, end)
+
+    def _replay(self, start, end):
+        """Yield the files logged between the offsets start and end."""
+        with open(self.log_path, 'rb') as log:
+            log.seek(start)
+            while log.tell() < end:
+                row = json.loads(log.readline())
+                yield FileRecord._make(row) if isinstance(row, list) else row
+
+    def add(self, top, stack, files):
+        """
+        Log the files of a directory just listed, and save a checkpoint if
+        one is due.
+
+        :param top: The directory being walked.
+        :param stack: The directories still to list.
+        :param files: The FileRecords, or filenames, of the directory.
+        """
+        self._log.write(''.join(json.dumps(f) + '\n' for f in files)
+                        .encode('utf-8'))
+        if time.monotonic() - self._last >= self.interval:
+            self.save(top, stack)
+
+    def save(self, top, stack):
+        """
+        Save a checkpoint of the walk of top, with stack the directories
+        still to list. An empty stack marks top as finished.
+        """
+        if self._log.closed:  # A walk left unfinished after close()
+            return
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._state['roots'][os.path.abspath(top)]['pending'] = list(stack)
+        self._state['size'] = self._log.tell()
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(self._state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)  # Atomic, a crash leaves the old one
+        self._last = time.monotonic()
+
+
+def _iter_walk(directory, blacklist, get_hidden, with_stat=True, workers=1,
+               on_directory=None, cancel=None, stats=None, checkpoint=None,
+               keep=None, prune=None, governor=None):
+    """
+    Yield the files found recursively under directory.
+
+    :param directory: Path name of a directory.
+    :param blacklist: A Blacklist, or list of patterns, to exclude.
+    :param get_hidden: If True include hidden files and/or directories.
+    :param with_stat: Optional. Default True yields FileRecords, False
+                      yields normalized filenames.
+    :param workers: Optional. Default 1 walks in this thread, holding only
+                    the pending directories in memory. More than 1 walks
+                    with that many threads, then sorts and yields the
+                    results, so the whole result list is held at once.
+    :param on_directory: Optional. A callable taking a directory's path and
+                         number of files, called after each directory is
+                         listed. With workers it is called from their
+                         threads.
+    :param cancel: Optional. A threading.Event, once set no more
+                   directories are listed and the walk ends early.
+    :param stats: Optional. A ScanStats to count the walk in, timing it as
+                  the 'walk' phase and blacklist matching as 'blacklist'.
+    :param checkpoint: Optional. A ScanCheckpoint to save the progress of
+                       the walk to, or resume it from. Only with 1 worker.
+    :param keep: Optional. A callable taking a file's name and normalized
+                 path, returning False to skip it without a stat.
+    :param prune: Optional. A callable taking a directory's path,
+                  returning True to not descend into it.
+    :param governor: Optional. A ScanGovernor limiting the rate of
+                     listings and stats, and how many workers list at once.
+    :returns: a generator of FileRecords or filenames.
+    :raises ValueError: if checkpoint is given with more than 1 worker.
+    """
+    if checkpoint is not None and workers > 1:
+        raise ValueError('Checkpoints need a walk with 1 worker')
+    top = os.path.normpath(directory)
+    # scandir('.') gives './name' paths, strip that so paths stay normalized
+    strip = len(os.curdir + os.sep) if top == os.curdir else 0
+    excluded = _as_blacklist(blacklist).bind(top)
+    on_error = None
+    if stats is not None:
+        on_error = stats.error
+        if excluded[1] is not None and workers == 1:
+            excluded = (excluded[0], _timed_matcher(excluded[1], stats))
+    throttle = None
+    if governor is not None:
+        governor.start(workers)
+        throttle = governor.acquire
+        if stats is not None:
+            stats.governor = governor
+
+    def scan(root):
+        if cancel is not None and cancel.is_set():
+            return [], []  # Drains the pending directories without listing
+        files, subdirs = _scan_directory(root, excluded, get_hidden, strip,
+                                         with_stat, on_error, keep, prune,
+                                         throttle)
+        if on_directory is not None:
+            on_directory(root, len(files))
+        return files, subdirs
+
+    if governor is not None:
+        scan_ungoverned = scan
+        clock = time.perf_counter
+
+        def scan(root):
+            with governor.slot():
+                waited = governor.waited()
+                start = clock()
+                files, subdirs = scan_ungoverned(root)
+                seconds = clock() - start - (governor.waited() - waited)
+            governor.record(1 + (len(files) if with_stat else 0), seconds)
+            return files, subdirs
+
+    if stats is not None:
+        # Only wrapped when asked for, so an uncounted walk costs nothing
+        scan_uncounted = scan
+
+        def scan(root):
+            if workers > 1:  # Timed as a whole below
+                files, subdirs = scan_uncounted(root)
+            else:
+                with stats.phase('walk'):
+                    files, subdirs = scan_uncounted(root)
+            stats.directory(root, files, subdirs, with_stat)
+            return files, subdirs
+
+    if workers > 1:
+        if stats is not None:
+            with stats.phase('walk'):
+                found = _parallel_walk(top, scan, workers)
+        else:
+            found = _parallel_walk(top, scan, workers)
+        # Threads finish in any order, sort so output is deterministic
+        found.sort(key=attrgetter('path') if with_stat else None)
+        yield from found
+        return
+
+    if checkpoint is not None:
+        stack, done = checkpoint.start(top)
+        yield from done
+        try:
+            while stack:
+                if cancel is not None and cancel.is_set():
+                    break  # Keep the stack, to resume from later
+                # Only popped once listed, so an error leaves it pending
+                files, subdirs = scan(stack[-1])
+                stack.pop()
+                stack.extend(reversed(subdirs))
+                checkpoint.add(top, stack, files)
+                yield from files
+        finally:
+            checkpoint.save(top, stack)
+        return
+
+    stack = [top]
+    while stack:
+        files, subdirs = scan(stack.pop())
+        yield from files
+        # Reverse so subdirectories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+
+def _check_directory(directory):
+    """
+    Raise IOError if directory does not exist.
+
+    :param directory: Path name of a directory.
+    :raises IOError: if given directory parameter does not exist.
+    """
+    # Expand any env vars and get absolute path before checking if dir exists
+    if not os.path.isdir(os.path.abspath(os.path.expanduser(directory))):
+        raise IOError("Path given does not exist.")
+
+
+def iter_file_records(directory='.', blacklist=None, get_hidden=False,
+                      workers=1, on_directory=None, cancel=None, stats=None,
+                      checkpoint=None, governor=None):
+    """
+    Return a generator of FileRecords for every file under directory.
+
+    This is the walk stage of the streaming pipeline. With the default
+    single worker the tree is walked lazily as records are consumed, so
+    memory stays flat however many files there are. See scan_files() for
+    the other parameters.
+
+    :param on_directory: Optional. A callable taking a directory's path and
+                         its number of files, called as each directory is
+                         listed, e.g. to report progress.
+    :param cancel: Optional. A threading.Event which ends the walk early
+                   when it is set, e.g. from another thread.
+    :param stats: Optional. A ScanStats to count and time the walk in.
+                  Default None does no counting at all.
+    :param checkpoint: Optional. A ScanCheckpoint to save progress to, so
+                       an interrupted walk can be resumed, or to resume
+                       from. Needs workers=1.
+    :param governor: Optional. A ScanGovernor capping the listings and
+                     stats per second and adapting how many workers run
+                     at once to the file server's latency.
+    :returns: a generator of FileRecords with normalized paths.
+    :raises IOError: if given directory parameter does not exist.
+    :raises ValueError: if checkpoint is given with more than 1 worker.
+    """
+    if blacklist is None:
+        blacklist = []
+    _check_directory(directory)
+    return _iter_walk(directory, blacklist, get_hidden, workers=workers,
+                      on_directory=on_directory, cancel=cancel, stats=stats,
+                      checkpoint=checkpoint, governor=governor)
+
+
+def iter_file_paths(directory='.', blacklist=None, get_hidden=False,
+                    workers=1, on_directory=None, cancel=None, stats=None,
+                    checkpoint=None, governor=None):
+    """
+    Return a generator of normalized filenames for every file under
+    directory, without stat'ing them. See get_file_paths() and
+    iter_file_records() for the parameters.
+
+    :returns: a generator of full path filenames.
+    :raises IOError: if given directory parameter does not exist.
+    """
+    if blacklist is None:
+        blacklist = []
+    _check_directory(directory)
+    return _iter_walk(directory, blacklist, get_hidden, with_stat=False,
+                      workers=workers, on_directory=on_directory,
+                      cancel=cancel, stats=stats, checkpoint=checkpoint,
+                      governor=governor)
+
+
+def get_file_paths(directory='.', blacklist=None, get_hidden=False,
+                   workers=1):
     """
     Return a recursive list of normalized full path filenames. Exclude
     hidden files and directories, starting from current path.
 
+    A thin wrapper collecting iter_file_paths() into a list.
+
     :param directory: Optional path name of a directory.
                       Defaults to current directory.
-    :param blacklist: Optional list of file and/or directory names to exclude
-                      in the search. Default is None.
+    :param blacklist: Optional Blacklist, or list of file and/or directory
+                      patterns (see Blacklist), to exclude in the search.
+                      Blacklisted directories are not descended into.
+                      Default is None.
     :param get_hidden: Optional. Default is False. If True include hidden files
                        and/or directories in the search.
+    :param workers: Optional. Default is 1. If more than 1, walk with that
+                    many threads listing directories concurrently (see
+                    scan_files()) and return the filenames sorted.
     :returns: a list of full path filenames.
     :raises IOError: if can not access the filesystem.
     :raises IOError: if given directory parameter does not exist.
-    :raises Except: with stack trace on an undefined error and exits. This is
-                    a precaution that should never happen.
     """
-    if blacklist is None:
-        blacklist = []
+    paths = iter_file_paths(directory, blacklist, get_hidden, workers)
 
-    # Expand any env vars and get absolute path before checking if dir exists
-    if not os.path.isdir(os.path.abspath(os.path.expanduser(directory))):
-        raise IOError("Path given does not exist.")
+    # Raise rather than exit, so callers can report, retry or resume
+    try:
+        return list(paths)
+    except OSError as e:
+        raise IOError("Error accessing the filesystem: {}".format(e))
 
-    fullpaths = []
 
-    try:
-        for root, dirnames, filenames in os.walk(directory):
-            skip_current_path = False
+def scan_files(directory='.', blacklist=None, get_hidden=False, workers=1):
+    """
+    Return a list of FileRecords for every file found recursively under
+    directory, using a single os.scandir() traversal. Each file is stat'ed
+    exactly once, so the records can be filtered and reported on without
+    going back to the filesystem.
 
-            # on Windows split path using \ separator
-            # e.g. ['path', 'to', 'foobar']
-            if (sys.platform).find('win') >= 0:
-                split_path = root.split('\\')
-            else:
-                split_path = root.split('/')
+    Blacklisted directories are not descended into. Hidden files and
+    directories are skipped unless get_hidden is True. Directories that can
+    not be listed and files that vanish before they are stat'ed are skipped.
+
+    :param directory: Optional path name of a directory.
+                      Defaults to current directory.
+    :param blacklist: Optional Blacklist, or list of file and/or directory
+                      patterns (see Blacklist), to exclude in the search.
+                      Blacklisted directories are not descended into.
+                      Default is None.
+    :param get_hidden: Optional. Default is False. If True include hidden files
+                       and/or directories in the search.
+    :param workers: Optional. Default is 1. Number of threads listing and
+                    stat'ing directories concurrently, which helps on high
+                    latency network shares. With more than 1 the records
+                    are sorted by path.
+    :returns: a list of FileRecords with normalized paths.
+    :raises IOError: if given directory parameter does not exist.
+    """
+    return list(iter_file_records(directory, blacklist, get_hidden, workers))
 
-            # Skip if matching a pattern in blacklist (defaults to None)
-            for pattern in blacklist:
-                if pattern in split_path:
-                    skip_current_path = True
-                    break
 
-            if skip_current_path:  # go to next folder, stop processing here
-                print('Skipping: {}'.format(root))
-                break
+def _get_numpy():
+    """Return the numpy module, or None if it is not installed."""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as _numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
 
-            for name in filenames:
-                if get_hidden:  # Get hidden files too
-                    fullpaths.append(os.path.join(root, name))
-                else:
-                    if name.startswith('.'):
-                        continue
-                    else:
-                        fullpaths.append(os.path.join(root, name))
-    except IOError:
-        print("Error accessing the filesystem.")
-        sys.exit()
-    except:
-        print("Unexpected error: ", sys.exc_info()[0])
-        sys.exit()
-    else:
-        # Strip extra backslashes, etc. from paths.
-        return [os.path.normpath(p) for p in fullpaths]
+
+class ScanStore(object):
+    """
+    A compact, column oriented container of scan results.
+
+    Paths are encoded once into a single byte buffer indexed by an array of
+    offsets, and size, mtime, atime, ctime and uid are kept in typed arrays,
+    so each file costs about 48 bytes plus its path instead of a FileRecord
+    with six Python objects. Age filtering compares a whole time column
+    against the cutoff at once, with NumPy when it is installed.
+
+    Iterating a ScanStore yields FileRecords, so it can be passed anywhere
+    a list of FileRecords is accepted, e.g. get_cutoff_files(),
+    make_dates_strings() and write_to_file().
+    """
+
+    def __init__(self, records=()):
+        """
+        Create a store holding records.
+
+        :param records: Optional. An iterable of FileRecords, e.g. from
+                        iter_file_records(). It is consumed lazily.
+        """
+        self._paths = bytearray()
+        self._offsets = array('Q', [0])
+        self.size = array('q')
+        self.mtime = array('d')
+        self.atime = array('d')
+        self.ctime = array('d')
+        self.uid = array('q')  # -1 where the uid is None
+        self.extend(records)
+
+    def append(self, record):
+        """Add a FileRecord to the end of the store."""
+        self._paths += record.path.encode(_FS_ENCODING, _FS_ERRORS)
+        self._offsets.append(len(self._paths))
+        self.size.append(record.size)
+        self.mtime.append(record.mtime)
+        self.atime.append(record.atime)
+        self.ctime.append(record.ctime)
+        self.uid.append(-1 if record.uid is None else record.uid)
+
+    def extend(self, records):
+        """Add every FileRecord from the iterable records."""
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return len(self.size)
+
+    def path(self, i):
+        """Return the path of the i'th file."""
+        return self._paths[self._offsets[i]:self._offsets[i + 1]].decode(
+            _FS_ENCODING, _FS_ERRORS)
+
+    def __getitem__(self, i):
+        """Return the i'th file as a FileRecord."""
+        if i < 0:
+            i += len(self)
+        uid = self.uid[i]
+        return FileRecord(self.path(i), self.size[i], self.mtime[i],
+                          self.atime[i], self.ctime[i],
+                          None if uid == -1 else uid)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return '<ScanStore of {} files>'.format(len(self))
+
+    def older_than(self, cutoff, flag='m', use_numpy=None):
+        """
+        Return the indexes of the files older than cutoff.
+
+        :param cutoff: Time in seconds since the epoch.
+        :param flag: Optional. Default 'm' compares last modified times,
+                     'a' compares last accessed times.
+        :param use_numpy: Optional. Default None uses NumPy if installed.
+                          False always uses the pure Python path.
+        :returns: a sequence of indexes in ascending order.
+        """
+        column = self.atime if flag == 'a' else self.mtime
+        np = _get_numpy() if use_numpy is not False else None
+        if np is not None and len(column):
+            times = np.frombuffer(column, dtype=np.float64)
+            return np.flatnonzero(times < cutoff)
+        return [i for i, t in enumerate(column) if t < cutoff]
+
+    def take(self, indexes):
+        """
+        Return a new ScanStore holding only the files at indexes.
+
+        :param indexes: A sequence of indexes, e.g. from older_than().
+        """
+        new = ScanStore()
+        offsets = self._offsets
+        for i in indexes:
+            new._paths += self._paths[offsets[i]:offsets[i + 1]]
+            new._offsets.append(len(new._paths))
+        for name in ('size', 'mtime', 'atime', 'ctime', 'uid'):
+            column = getattr(self, name)
+            getattr(new, name).extend(column[i] for i in indexes)
+        return new
+
+
+def _cutoff_time(days):
+    """Return the epoch seconds of now minus days."""
+    return time.time() - timedelta(days).total_seconds()
+
+
+def iter_cutoff_files(arr, days, flag='m'):
+    """
+    Yield the items of arr that were last modified (or accessed) more than
+    days ago. This is the filter stage of the streaming pipeline.
+
+    :param arr: An iterable of filenames or FileRecords.
+    :param days: Threshold for the number of days.
+    :param flag: Optional. Default 'm' means file attribute last modified.
+                 Also accepts 'a' for file attribute last accessed.
+    :returns: a generator of the items from arr older than the cutoff.
+    """
+    # Epoch seconds of now - delta, compared against the stat times
+    cutoff = _cutoff_time(days)
+
+    for f in arr:
+        if _timestamp(f, flag) < cutoff:
+            yield f
 
 
 def get_cutoff_files(arr, days, flag='m'):
@@ -139,55 +1290,473 @@ def get_cutoff_files(arr, days, flag='m'):
     Return a list of filenames that meet the criteria of being last modified
     greater than days.
 
-    :param arr: List of absolute path filenames.
+    A thin wrapper collecting iter_cutoff_files() into a list. A ScanStore
+    is filtered a whole column at a time instead.
+
+    :param arr: List of absolute path filenames, or of FileRecords from
+                scan_files(), or a ScanStore. FileRecords and ScanStores are
+                compared without touching the filesystem.
     :param days: Threshold for the number of days.
     :param flag: Optional. Default 'm' means file attribute last modified.
                  Also accepts 'a' for file attribute last accessed.
-    :returns: a list of filenames.
+    :returns: a list of the items from arr that are older than the cutoff,
+              or a ScanStore if arr is a ScanStore.
     """
-    # Get Datetime object of now to calculate delta.
-    now = datetime.now()
-    # e.g. datetime.datetime(2015, 7, 7, 11, 56, 13, 137000)
-    cutoff = now - timedelta(days)  # Datetime obj - delta
-
-    cutoff_list = []
+    if isinstance(arr, ScanStore):
+        return arr.take(arr.older_than(_cutoff_time(days), flag))
 
-    if flag == 'a':
-        for f in arr:
-            a_time = get_time(f, 'a')
-            if a_time < cutoff:
-                cutoff_list.append(f)
-    else:
-        # Get modified date as Datetime object
-        for f in arr:
-            m_time = get_time(f)
-            if m_time < cutoff:
-                cutoff_list.append(f)
+    cutoff_list = list(iter_cutoff_files(arr, days, flag))
     del (arr)  # Don't wait for garbage collection, we don't need it
     return cutoff_list
 
 
+def top_files(arr, n, by='oldest', flag='m'):
+    """
+    Return the n oldest, or largest, files of arr, e.g. the 1000 oldest of
+    a 50 million file scan, keeping only n files in memory as arr streams
+    past, in a bounded heap. Files that tie are ordered by path, so the
+    result does not depend on the order of arr.
+
+        top_files(iter_cutoff_files(iter_file_records(path), 365), 500,
+                  'largest')
+
+    :param arr: An iterable of FileRecords, e.g. from iter_cutoff_files(),
+                or a ScanStore.
+    :param n: Number of files to return.
+    :param by: Optional. One of TOP_ORDERS, default 'oldest' by the time
+               flag, or 'largest' by size.
+    :param flag: Optional. Default 'm' ranks by last modified time, 'a' by
+                 last accessed.
+    :returns: a list of up to n FileRecords, oldest or largest first.
+    :raises ValueError: if by is not known or n is negative.
+    """
+    if by not in TOP_ORDERS:
+        raise ValueError('Unknown top order: {}'.format(by))
+    if n < 0:
+        raise ValueError('n must not be negative')
+    if by == 'largest':
+        key = lambda rec: (-rec.size, rec.path)
+    else:
+        times = attrgetter('atime' if flag == 'a' else 'mtime')
+        key = lambda rec: (times(rec), rec.path)
+    return nsmallest(n, arr, key=key)
+
+
+def _scan_shard(root, top, patterns, get_hidden, cutoff, flag):
+    """
+    Scan the subtree root of a sharded scan, in a worker process.
+
+    :param root: The directory to scan.
+    :param top: The directory the whole scan started from, for anchoring
+                blacklist paths and stripping './'.
+    :param patterns: A list of blacklist patterns.
+    :param get_hidden: If True include hidden files and/or directories.
+    :param cutoff: Keep only files older than these epoch seconds, or None
+                   to keep them all.
+    :param flag: 'm' to compare last modified times, 'a' last accessed.
+    :returns: a tuple of (ScanStore of the files kept, directories listed,
+              files found).
+    """
+    strip = len(os.curdir + os.sep) if top == os.curdir else 0
+    excluded = Blacklist(patterns).bind(top)
+    store = ScanStore()
+    dirs = files = 0
+
+    stack = [root]
+    while stack:
+        found, subdirs = _scan_directory(stack.pop(), excluded, get_hidden,
+                                         strip)
+        dirs += 1
+        files += len(found)
+        for rec in found:
+            if cutoff is None or _timestamp(rec, flag) < cutoff:
+                store.append(rec)
+        stack.extend(reversed(subdirs))
+    # A ScanStore pickles as a few arrays, cheap to send to the parent
+    return store, dirs, files
+
+
+def iter_sharded_records(directories, blacklist=None, get_hidden=False,
+                         processes=None, days=None, flag='m', on_shard=None):
+    """
+    Yield FileRecords for every file under directories, scanned by a pool
+    of processes so the per-file Python work uses every core.
+
+    The top levels of each directory are listed here until there are about
+    four subtrees per process. Each subtree is then scanned, and filtered
+    by days, in a worker process, which sends back its matches as a
+    compact ScanStore. Results are yielded as each subtree finishes, so
+    their order varies between runs.
+
+    On Windows, and wherever processes are started with 'spawn', call this
+    from under an if __name__ == '__main__' guard.
+
+    :param directories: A path name of a directory, or a list of them.
+    :param blacklist: Optional Blacklist, or list of patterns, to exclude.
+    :param get_hidden: Optional. Default is False. If True include hidden
+                       files and/or directories in the search.
+    :param processes: Optional. Number of worker processes, defaults to the
+                      number of CPUs.
+    :param days: Optional. If given only yield files older than this many
+                 days, as get_cutoff_files() would.
+    :param flag: Optional. Default 'm' compares last modified times with
+                 days, 'a' last accessed.
+    :param on_shard: Optional. A callable taking a directory's path, the
+                     number of directories listed and the number of files
+                     found, called as each piece of the scan finishes.
+    :returns: a generator of FileRecords.
+    :raises IOError: if a directory does not exist.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if isinstance(directories, str):
+        directories = [directories]
+    for directory in directories:
+        _check_directory(directory)
+
+    blacklist = _as_blacklist(blacklist)
+    cutoff = None if days is None else _cutoff_time(days)
+    processes = processes or os.cpu_count() or 1
+
+    pool = ProcessPoolExecutor(processes)
+    futures = set()
+    try:
+        for directory in directories:
+            top = os.path.normpath(directory)
+            strip = len(os.curdir + os.sep) if top == os.curdir else 0
+            excluded = blacklist.bind(top)
+
+            # Split the tree into enough subtrees to keep every process busy
+            level = [top]
+            while level and len(level) < processes * 4:
+                next_level = []
+                for root in level:
+                    found, subdirs = _scan_directory(root, excluded,
+                                                     get_hidden, strip)
+                    if on_shard is not None:
+                        on_shard(root, 1, len(found))
+                    for rec in found:
+                        if cutoff is None or _timestamp(rec, flag) < cutoff:
+                            yield rec
+                    next_level.extend(subdirs)
+                level = next_level
+
+            for root in level:
+                futures.add(pool.submit(_scan_shard, root, top,
+                                        blacklist.patterns, get_hidden,
+                                        cutoff, flag))
+
+        for future in as_completed(futures):
+            futures.discard(future)  # Let its results be freed once yielded
+            store, dirs, files = future.result()
+            if on_shard is not None:
+                on_shard(None, dirs, files)
+            yield from store
+    finally:
+        for future in futures:  # Stopped early, skip subtrees not started
+            future.cancel()
+        pool.shutdown()
+
+
+def aging_report(arr, thresholds=AGING_THRESHOLDS, flag='m'):
+    """
+    Return the number of files, and their total bytes, older than each of
+    thresholds, from a single pass over arr.
+
+    Each file's time is placed in a histogram bin with a binary search over
+    the sorted cutoffs, then the bins are summed into "older than" totals,
+    so arr can be a generator straight from the walk:
+
+        aging_report(iter_file_records(path), (30, 90, 365))
+
+    :param arr: An iterable of FileRecords, or a ScanStore.
+    :param thresholds: Optional. An iterable of ages in days. Defaults to
+                       AGING_THRESHOLDS.
+    :param flag: Optional. Default 'm' means file attribute last modified.
+                 Also accepts 'a' for file attribute last accessed.
+    :returns: a list of AgingBuckets, sorted by days.
+    """
+    days = sorted(set(thresholds))
+    # Ascending epoch seconds, i.e. the largest threshold first
+    cutoffs = [_cutoff_time(d) for d in reversed(days)]
+    counts = [0] * (len(cutoffs) + 1)
+    sizes = [0] * (len(cutoffs) + 1)
+
+    if isinstance(arr, ScanStore):  # Read the columns, skip FileRecords
+        pairs = zip(arr.atime if flag == 'a' else arr.mtime, arr.size)
+    else:
+        pairs = ((_timestamp(f, flag), f.size) for f in arr)
+
+    for t, size in pairs:
+        # Bin i holds files older than cutoffs[i:], but not cutoffs[:i]
+        i = bisect_right(cutoffs, t)
+        counts[i] += 1
+        sizes[i] += size
+
+    buckets = []
+    count = total = 0
+    for i, d in enumerate(reversed(days)):
+        count += counts[i]
+        total += sizes[i]
+        buckets.append(AgingBucket(d, count, total))
+    buckets.reverse()
+    return buckets
+
+
+def _date_string(item, flag='m'):
+    """Return item's last modified or accessed date, e.g., "2010-05-20"."""
+    return datetime.fromtimestamp(_timestamp(item, flag)).strftime("%Y-%m-%d")
+
+
 def make_dates_strings(arr, flag='m'):
     """
     Return a list of formatted strings representing the last modified times
     of each filename found in arr.
 
-    :param arr: List of files to filter.
+    :param arr: List of files or FileRecords, or a ScanStore.
     :param flag: Optional. Default 'm' is file last modified attribute.
                  Also accepts 'a' for file last accessed attribute.
     :returns: a list of formatted strings, e.g., "2010-05-20".
     """
-    if flag == 'a':
-        return [get_time(f, 'a').strftime("%Y-%m-%d") for f in arr]
+    return [_date_string(f, flag) for f in arr]
+
+
+class _ReportFormatter(object):
+    """
+    Turns FileRecords into report rows, one value per column.
+
+    Local times are cached by quarter hour, which time zone offsets and
+    daylight saving changes all line up with, so most rows skip the
+    localtime() and strftime() calls. Owner names are cached by uid.
+    """
+
+    def __init__(self, columns, flag='m', raw_times=False):
+        """
+        :param columns: A sequence of names from REPORT_COLUMNS.
+        :param flag: Optional. Whether the 'date' column is last modified
+                     ('m') or last accessed ('a').
+        :param raw_times: Optional. Default False formats the mtime, atime
+                          and ctime columns as local date and time strings.
+                          True leaves them as epoch seconds.
+        """
+        unknown = set(columns).difference(REPORT_COLUMNS)
+        if unknown:
+            raise ValueError('Unknown report columns: {}'.format(
+                ', '.join(sorted(unknown))))
+        self.columns = tuple(columns)
+        self.flag = flag
+        self._dates = {}
+        self._owners = {}
+        time_value = attrgetter if raw_times else self._time_getter
+        getters = {'date': self.date,
+                   'path': _path,
+                   'size': attrgetter('size'),
+                   'mtime': time_value('mtime'),
+                   'atime': time_value('atime'),
+                   'ctime': time_value('ctime'),
+                   'owner': self.owner}
+        self._getters = [getters[c] for c in self.columns]
+
+    def _slot(self, t):
+        """
+        Return a tuple of (date string, hour, minute) of the local time at
+        the start of the quarter hour holding t, and t's offset in seconds
+        from that start.
+        """
+        key = t // 900
+        try:
+            slot = self._dates[key]
+        except KeyError:
+            if len(self._dates) > 100000:
+                self._dates.clear()
+            lt = time.localtime(key * 900)
+            slot = self._dates[key] = (time.strftime("%Y-%m-%d", lt),
+                                       lt.tm_hour, lt.tm_min)
+        return slot, int(t - key * 900)
+
+    def date(self, item):
+        """Return item's date string, e.g., "2010-05-20"."""
+        return self._slot(_timestamp(item, self.flag))[0][0]
+
+    def _time_getter(self, name):
+        """
+        Return a getter formatting the time attribute name, e.g.,
+        "2010-05-20 13:45:10".
+        """
+        def get(item):
+            (day, hour, minute), offset = self._slot(getattr(item, name))
+            minutes, seconds = divmod(offset, 60)
+            return '%s %02d:%02d:%02d' % (day, hour, minute + minutes,
+                                          seconds)
+        return get
+
+    def owner(self, item):
+        """Return the user name owning item, or its uid if not known."""
+        uid = item.uid
+        try:
+            return self._owners[uid]
+        except KeyError:
+            pass
+        if uid is None:
+            name = ''
+        elif pwd is None:
+            name = str(uid)
+        else:
+            try:
+                name = pwd.getpwuid(uid).pw_name
+            except KeyError:  # No such user any more
+                name = str(uid)
+        self._owners[uid] = name
+        return name
+
+    def header(self):
+        """Return the column titles."""
+        return [REPORT_HEADERS[c] for c in self.columns]
+
+    def row(self, item):
+        """Return a list of the column values of item."""
+        return [get(item) for get in self._getters]
+
+
+def _csv_writer(out, style):
+    """Return a csv writer on out for style 'csv' or 'txt'."""
+    return csv.writer(out, delimiter=',' if style == 'csv' else '\t',
+                      lineterminator='\n')
+
+
+def _iter_csv_lines(header, rows, style):
+    """
+    Yield header, then each of the iterable rows, as a newline terminated
+    line of a report in style 'csv' or 'txt', quoted as needed.
+    """
+    buf = io.StringIO()
+    writer = _csv_writer(buf, style)
+    writer.writerow(header)
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        yield buf.getvalue()
+
+
+def _iter_jsonl(arr, flag, columns):
+    """Yield a JSON object line per file, with epoch seconds for times."""
+    formatter = _ReportFormatter(columns, flag, raw_times=True)
+    encode = json.JSONEncoder().encode
+    keys = formatter.columns
+    for f in arr:
+        yield encode(dict(zip(keys, formatter.row(f)))) + '\n'
+
+
+def write_report(arr, name, style='csv', flag='m', columns=('date', 'path'),
+                 compress=False, buffer_size=1 << 20):
+    """
+    Write a scan report of arr to the file name, streaming rows from arr
+    through a large write buffer. Only arr is read, the files it describes
+    are never touched, so arr should hold FileRecords or be a ScanStore.
+
+    :param arr: An iterable of FileRecords, or a ScanStore. Plain filenames
+                work for the 'date' and 'path' columns but are stat'ed.
+    :param name: Name of the file to write to, used as given, or a binary
+                 file object, e.g. sys.stdout.buffer, which is left open.
+    :param style: Optional. One of REPORT_FORMATS: comma separated values
+                  ('csv', the default), tab separated ('txt') or JSON Lines
+                  ('jsonl').
+    :param flag: Optional. Last modified file attribute for the 'date'
+                 column. Also accepts 'a' for last accessed file attribute.
+    :param columns: Optional. Names from REPORT_COLUMNS, in order. Defaults
+                    to the date and the full path.
+    :param compress: Optional. Default is False. If True gzip the report
+                     as it is written.
+    :param buffer_size: Optional. Bytes buffered between writes to disk.
+    :returns: the number of files written.
+    :raises ValueError: if style or a column is not known.
+    :raises IOError: if write to file fails.
+    """
+    if style not in REPORT_FORMATS:
+        raise ValueError('Unknown report style: {}'.format(style))
+    formatter = _ReportFormatter(columns, flag)  # Check columns up front
+
+    if hasattr(name, 'write'):  # Caller's file, e.g. sys.stdout.buffer
+        return _write_report_to(name, arr, style, formatter, compress,
+                                buffer_size)
+    try:
+        with open(name, 'wb', buffering=buffer_size) as raw:
+            return _write_report_to(raw, arr, style, formatter, compress,
+                                    buffer_size)
+    except IOError:
+        raise IOError('Error writing to file: {}'.format(name))
+
+
+def _write_report_to(raw, arr, style, formatter, compress, buffer_size):
+    """
+    Write the report rows of arr to the binary file raw, leaving it open.
+
+    :returns: the number of files written.
+    """
+    count = [0]
+
+    def counted(items):
+        for f in items:
+            count[0] += 1
+            yield f
+
+    binary = raw
+    if compress:
+        binary = io.BufferedWriter(
+            gzip.GzipFile(filename='', mode='wb', fileobj=raw), buffer_size)
+    # surrogateescape writes undecodable filenames back as bytes
+    out = io.TextIOWrapper(binary, encoding='utf-8', errors='surrogateescape',
+                           newline='')
+    if style == 'jsonl':
+        out.writelines(_iter_jsonl(counted(arr), formatter.flag,
+                                   formatter.columns))
     else:
-        return [get_time(f).strftime("%Y-%m-%d") for f in arr]
+        writer = _csv_writer(out, style)
+        writer.writerow(formatter.header())
+        writer.writerows(map(formatter.row, counted(arr)))
+
+    out.detach()  # Flushes into binary without closing it
+    if compress:
+        binary.close()  # Writes the gzip trailer, raw stays open
+    else:
+        binary.flush()
+    return count[0]
+
+
+def write_lines(lines, name):
+    """
+    Return True if writing every string from the iterable lines to the
+    file name succeeds. This is the write stage of the streaming pipeline.
+
+    :param lines: An iterable of newline terminated strings.
+    :param name: Name of the file to write to.
+    :returns: True if write to file succeeds.
+    :raises IOError: if write to file fails.
+    """
+    try:
+        with open(name, 'w') as f_out:
+            f_out.writelines(lines)
+    except IOError:
+        raise IOError('Error writing to file: {}'.format(name))
+    else:  # Successfully wrote to the file.
+        return True
 
 
 def write_to_file(arr, name='scan_report', style='txt', flag='m'):
     """
     Return True if filenames in 'arr' succeeds in writing to 'name'.
 
-    :param arr: A list of filenames.
+    The rows are formatted and written as they are read from arr, so arr
+    may be a generator, e.g. the whole streaming pipeline:
+
+        write_to_file(iter_cutoff_files(iter_file_records(path), 90))
+
+    See write_report() for more columns and formats.
+
+    :param arr: A list, or any iterable, of filenames or FileRecords, or a
+                ScanStore.
     :param name: Optional. Name of the file to write to.
     :param style: Optional. Write to file as plain text with tabs ('txt') or
                   comma separated values ('csv')
@@ -196,36 +1765,475 @@ def write_to_file(arr, name='scan_report', style='txt', flag='m'):
     :returns: True if write to file succeeds.
     :raises IOError: if write to file fails.
     """
-    # Add .txt or .csv to end  of 'name' param and set proper separator
+    # Add .txt or .csv to end  of 'name' param
     if style == 'csv':
         name += '.csv'
-        separator = ","
     else:
         name += '.txt'
-        separator = '\t'
+        style = 'txt'
 
-    # Get list of strings to write
-    if flag == 'a':
-        file_times = make_dates_strings(arr, 'a')
-    else:
-        file_times = make_dates_strings(arr)
+    write_report(arr, name, style, flag)
+    return True
+
+
+class DirectoryRollup(object):
+    """
+    Stale file counts and bytes per directory, rolled up the tree like du.
+
+    Directories are kept in a parent pointer table: each directory gets an
+    id, created after its parent's, and arrays hold its parent id and the
+    count and bytes of the files directly in it. A file only costs a
+    dirname() and, when its directory changed from the last file's, a dict
+    lookup. finish() then adds every directory into its parent in one
+    pass over the ids in reverse, so no file path is ever split into all
+    of its components. Given the root the files were found under, parents
+    stop there, so the directories above it are not reported.
+
+    Example:
+
+        rollup = DirectoryRollup(path)
+        for rec in iter_cutoff_files(iter_file_records(path), 365):
+            rollup.add(rec)
+        rollup.finish()
+        heaviest = rollup.top(20)
+    """
+
+    def __init__(self, root=None):
+        """
+        :param root: Optional. The directory the files are under, as it was
+                     given to the walk. Default None rolls up to the top of
+                     their paths.
+        """
+        self.root = None if root is None else os.path.normpath(root)
+        self.paths = []
+        self.parent = array('q')
+        self.own_files = array('q')
+        self.own_bytes = array('q')
+        self.total_files = None
+        self.total_bytes = None
+        self._ids = {}
+        self._children = None
+        self._last = (None, -1)  # Directory of the last file added, its id
+
+    def _dir_id(self, path):
+        """Return the id of directory path, adding it and its parents."""
+        i = self._ids.get(path)
+        if i is not None:
+            return i
+        head = os.path.dirname(path)
+        if path == os.curdir or head == path or \
+                os.path.normpath(path) == self.root:  # Top of the tree
+            parent = -1
+        else:
+            parent = self._dir_id(head or os.curdir)
+        i = self._ids[path] = len(self.paths)
+        self.paths.append(path)
+        self.parent.append(parent)
+        self.own_files.append(0)
+        self.own_bytes.append(0)
+        return i
+
+    def add(self, record):
+        """Count the FileRecord record in its directory."""
+        directory = os.path.dirname(record.path) or os.curdir
+        last, i = self._last
+        if directory != last:
+            i = self._dir_id(directory)
+            self._last = (directory, i)
+        self.own_files[i] += 1
+        self.own_bytes[i] += record.size
+
+    def finish(self):
+        """Roll every directory's counts up into all of its parents."""
+        files = array('q', self.own_files)
+        size = array('q', self.own_bytes)
+        parent = self.parent
+        # Children always have larger ids than their parents
+        for i in range(len(parent) - 1, -1, -1):
+            p = parent[i]
+            if p >= 0:
+                files[p] += files[i]
+                size[p] += size[i]
+        self.total_files = files
+        self.total_bytes = size
+        self._children = None
+        return self
+
+    def __len__(self):
+        return len(self.paths)
+
+    def entry(self, i):
+        """Return a RollupEntry of directory id i, after finish()."""
+        return RollupEntry(self.paths[i], self.total_files[i],
+                           self.total_bytes[i])
+
+    def top(self, n=10, by='bytes'):
+        """
+        Return the n directories holding the most stale data, including
+        their subdirectories, after finish().
+
+        :param n: Optional. Number of directories to return.
+        :param by: Optional. Default 'bytes', or 'files' to rank by count.
+        :returns: a list of RollupEntries, heaviest first.
+        """
+        column = self.total_files if by == 'files' else self.total_bytes
+        return [self.entry(i) for i in
+                nlargest(n, range(len(column)), key=column.__getitem__)]
+
+    def roots(self):
+        """Return the ids of the directories without a parent."""
+        return self.children(-1)
+
+    def children(self, i):
+        """Return the ids of the subdirectories of directory id i."""
+        if self._children is None:
+            self._children = {}
+            for child, p in enumerate(self.parent):
+                self._children.setdefault(p, []).append(child)
+        return self._children.get(i, [])
+
+
+def rollup_stale(arr, days, flag='m', root=None):
+    """
+    Return a finished DirectoryRollup of the files in arr older than days,
+    from a single pass, so arr can stream straight from the walk:
+
+        rollup_stale(iter_file_records(path), 365, root=path).top(20)
+
+    :param arr: An iterable of FileRecords, or a ScanStore.
+    :param days: Threshold for the number of days.
+    :param flag: Optional. Default 'm' means file attribute last modified.
+                 Also accepts 'a' for file attribute last accessed.
+    :param root: Optional. The directory arr was found under, see
+                 DirectoryRollup.
+    :returns: a DirectoryRollup.
+    """
+    rollup = DirectoryRollup(root)
+    for rec in iter_cutoff_files(arr, days, flag):
+        rollup.add(rec)
+    return rollup.finish()
+
+
+def iter_rollup_lines(entries, style='txt'):
+    """
+    Yield the lines of a directory rollup report, header first.
+
+    :param entries: An iterable of RollupEntries, e.g. from
+                    DirectoryRollup.top().
+    :param style: Optional. Separate columns with tabs ('txt') or commas
+                  ('csv').
+    :returns: a generator of newline terminated strings.
+    """
+    return _iter_csv_lines(("Directory", "Files", "Bytes"), entries, style)
+
+
+def write_rollup_report(rollup, name='rollup_report', style='txt'):
+    """
+    Return True if every directory of rollup, heaviest first, succeeds in
+    writing to 'name'.
+
+    :param rollup: A finished DirectoryRollup.
+    :param name: Optional. Name of the file to write to.
+    :param style: Optional. Write to file as plain text with tabs ('txt') or
+                  comma separated values ('csv')
+    :returns: True if write to file succeeds.
+    :raises IOError: if write to file fails.
+    """
+    name += '.csv' if style == 'csv' else '.txt'
+    return write_lines(iter_rollup_lines(rollup.top(len(rollup)), style),
+                       name)
+
+
+def iter_aging_lines(buckets, style='txt'):
+    """
+    Yield the lines of an aging report, header first, one line per bucket.
+
+    :param buckets: A list of AgingBuckets from aging_report().
+    :param style: Optional. Separate columns with tabs ('txt') or commas
+                  ('csv').
+    :returns: a generator of newline terminated strings.
+    """
+    return _iter_csv_lines(("Older than (days)", "Files", "Bytes"),
+                           ((b.days, b.count, b.bytes) for b in buckets),
+                           style)
+
+
+def write_aging_report(buckets, name='aging_report', style='txt'):
+    """
+    Return True if the aging report of buckets succeeds in writing to 'name'.
+
+    :param buckets: A list of AgingBuckets from aging_report().
+    :param name: Optional. Name of the file to write to.
+    :param style: Optional. Write to file as plain text with tabs ('txt') or
+                  comma separated values ('csv')
+    :returns: True if write to file succeeds.
+    :raises IOError: if write to file fails.
+    """
+    name += '.csv' if style == 'csv' else '.txt'
+    return write_lines(iter_aging_lines(buckets, style), name)
 
-    # Combine file_times with the full path to the file into a dictionary
-    # e.g., files = {"my/path/to/foo": "2010-05-27", ... }
-    files = {}
-    for p, d in zip(arr, file_times):
-        files[p] = d
+
+# Exit codes of main(), like grep: matches found, no matches, or an error.
+EXIT_OK = 0
+EXIT_NO_MATCHES = 1
+EXIT_ERROR = 2
+EXIT_INTERRUPTED = 130
+
+
+def _parse_args(argv):
+    """Return the parsed command line options of main()."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m records",
+        description=("Find files under one or more directories last "
+                     "modified (or accessed) more than a number of days "
+                     "ago, and write a report of them."))
+    parser.add_argument("roots", nargs="+", metavar="DIR",
+                        help="Directory to scan. Give several to scan them "
+                             "all into one report.")
+    parser.add_argument("-d", "--days", type=int,
+                        help="Report files older than this many days "
+                             "(default: 90, or any age with --where).")
+    parser.add_argument("-l", "--last", choices=("modified", "accessed"),
+                        default="modified",
+                        help="Which file time to compare "
+                             "(default: %(default)s).")
+    parser.add_argument("-b", "--blacklist", metavar="FILE",
+                        help="File of names, globs or paths to skip, one "
+                             "per line.")
+    parser.add_argument("--hidden", action="store_true",
+                        help="Include hidden files and directories.")
+    parser.add_argument("-f", "--format", choices=REPORT_FORMATS,
+                        default="csv",
+                        help="Report format (default: %(default)s).")
+    parser.add_argument("-c", "--columns", default="date,path",
+                        help="Comma separated report columns, from: {} "
+                             "(default: %(default)s).".format(
+                                 ",".join(REPORT_COLUMNS)))
+    parser.add_argument("-o", "--output", default="-", metavar="FILE",
+                        help="File to write the report to, '-' for stdout "
+                             "(default).")
+    parser.add_argument("-z", "--gzip", action="store_true",
+                        help="Gzip the report.")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Threads listing directories concurrently "
+                             "(default: %(default)s).")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="Split the scan across this many processes, "
+                             "for CPU bound local disks (default: "
+                             "%(default)s). Results are then unordered.")
+    parser.add_argument("--top", type=int, metavar="N",
+                        help="Only report the N oldest (or, with --top-by "
+                             "largest, largest) matching files.")
+    parser.add_argument("--top-by", choices=TOP_ORDERS, default="oldest",
+                        help="What --top ranks by (default: %(default)s).")
+    parser.add_argument("-w", "--where", metavar="QUERY",
+                        help="Only report files matching QUERY, e.g. "
+                             "\"size > 100MB and ext in {pst, iso}\". "
+                             "See records_query.py for the fields.")
+    parser.add_argument("--max-ops", type=float, metavar="N",
+                        help="Make at most N directory listings and stats "
+                             "per second, to spare a busy file server.")
+    parser.add_argument("--max-latency", type=float, metavar="MS",
+                        help="List fewer directories at once while an "
+                             "operation takes longer than MS milliseconds, "
+                             "up to --workers.")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Do not print the timing summary to stderr.")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="Save the progress of the scan to FILE every "
+                             "minute, so it can be resumed with --resume. "
+                             "Removed when the scan finishes.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume the scan saved in the --checkpoint "
+                             "FILE, without listing the directories it "
+                             "finished. Use the same options.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Count directories, entries, stats, errors "
+                             "and bytes, time each phase of the scan and "
+                             "print a summary to stderr. Needs "
+                             "--processes 1.")
+    parser.add_argument("--profile-output", metavar="FILE",
+                        help="Also run the scan under cProfile and save "
+                             "the pstats data to FILE. Implies --profile.")
+    args = parser.parse_args(argv)
+
+    args.columns = [c.strip() for c in args.columns.split(",") if c.strip()]
+    unknown = set(args.columns).difference(REPORT_COLUMNS)
+    if unknown:
+        parser.error("unknown columns: {}".format(", ".join(sorted(unknown))))
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint FILE")
+    if args.checkpoint and (args.workers > 1 or args.processes > 1):
+        parser.error("--checkpoint needs --workers 1 and --processes 1")
+    if args.top is not None and args.top < 1:
+        parser.error("--top must be at least 1")
+    if args.max_ops is not None and args.max_ops <= 0:
+        parser.error("--max-ops must be positive")
+    if (args.max_ops or args.max_latency) and args.processes > 1:
+        parser.error("--max-ops and --max-latency need --processes 1")
+    if (args.profile or args.profile_output) and args.processes > 1:
+        # The shards count in their own processes, not in these stats
+        parser.error("--profile and --profile-output need --processes 1")
+    if args.where is not None:
+        if args.processes > 1:
+            parser.error("--where needs --processes 1")
+        import records_query
+        try:
+            args.where = records_query.Query(args.where)
+        except records_query.QueryError as e:
+            parser.error("--where: {}".format(e))
+    elif args.days is None:
+        args.days = 90
+    return args
+
+
+def main(argv=None):
+    """
+    Run a scan from the command line, without any GUI, e.g. from cron:
+
+        python -m records -d 365 -o stale.csv.gz -z /srv/share /srv/home
+
+    The report streams to stdout or a file as files are found, and a
+    timing summary is printed to stderr.
+
+    :param argv: Optional. A list of arguments, defaults to sys.argv[1:].
+    :returns: EXIT_OK if any files matched, EXIT_NO_MATCHES if none did,
+              EXIT_ERROR if a directory or file could not be used, or
+              EXIT_INTERRUPTED on Ctrl-C.
+    """
+    args = _parse_args(argv)
+    flag = 'a' if args.last == "accessed" else 'm'
+    start = time.perf_counter()
+    counts = {'dirs': 0, 'files': 0}
+    stats = None
+    profiler = None
+    checkpoint = None
+    walker = None
+    governor = None
+    if args.profile or args.profile_output:
+        stats = ScanStats()
+    if args.max_ops or args.max_latency:
+        governor = ScanGovernor(args.max_ops, target_latency=(
+            args.max_latency / 1000 if args.max_latency else None))
+    if args.profile_output:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def on_directory(path, files):
+        counts['dirs'] += 1
+        counts['files'] += files
 
     try:
-        with open(name, 'w') as f_out:
-            f_out.write("Year-Month-Date" + separator)  # Header
-            f_out.write("Full file path \n")
-            for f in files:
-                f_out.write(files[f])
-                f_out.write(separator)
-                f_out.write(f)
-                f_out.write('\n')
-    except IOError:
-        raise IOError('Error writing to file: {}'.format(name))
-    else:  # Successfully wrote to the file.
-        return True
+        blacklist = get_blacklist(args.blacklist)
+        for root in args.roots:  # Fail before writing any of the report
+            if not os.path.isdir(root):
+                raise IOError("Path given does not exist: {}".format(root))
+        if args.checkpoint:
+            options = {'roots': [os.path.abspath(r) for r in args.roots],
+                       'blacklist': list(blacklist), 'hidden': args.hidden,
+                       'where': args.where and args.where.text}
+            checkpoint = ScanCheckpoint(args.checkpoint, options,
+                                        args.resume)
+
+        def walk():
+            for root in args.roots:
+                if args.where is not None:
+                    import records_query
+                    yield from records_query.iter_query(
+                        root, args.where, blacklist, args.hidden,
+                        args.workers, on_directory, stats=stats,
+                        checkpoint=checkpoint, governor=governor)
+                else:
+                    yield from iter_file_records(root, blacklist,
+                                                 args.hidden, args.workers,
+                                                 on_directory, stats=stats,
+                                                 checkpoint=checkpoint,
+                                                 governor=governor)
+
+        def on_shard(path, dirs, files):
+            counts['dirs'] += dirs
+            counts['files'] += files
+            if stats is not None:  # Shards are not timed, only counted
+                stats.dirs += dirs
+                stats.stat_calls += files
+
+        if args.processes > 1:
+            # Workers filter by days themselves and send back only matches
+            matches = iter_sharded_records(args.roots, blacklist, args.hidden,
+                                           args.processes, args.days, flag,
+                                           on_shard)
+        else:
+            walker = walk()
+            matches = walker if args.days is None else \
+                iter_cutoff_files(walker, args.days, flag)
+        if stats is not None:
+            matches = stats.timed(matches, 'filter')
+        if args.top is not None:
+            # Only the top files are held, the report is written at the end
+            matches = top_files(matches, args.top, args.top_by, flag)
+        output = sys.stdout.buffer if args.output == "-" else args.output
+        if stats is not None:
+            with stats.phase('write'):
+                matched = write_report(matches, output, args.format, flag,
+                                       args.columns, args.gzip)
+        else:
+            matched = write_report(matches, output, args.format, flag,
+                                   args.columns, args.gzip)
+        if checkpoint is not None:
+            checkpoint.remove()  # Finished, nothing left to resume
+            checkpoint = None
+    except KeyboardInterrupt:
+        print("Interrupted.", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except BrokenPipeError:  # e.g. piped into head, not worth a traceback
+        # Point stdout at devnull so the flush at exit does not fail again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return EXIT_ERROR
+    except IOError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return EXIT_ERROR
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_output)
+        if checkpoint is not None:
+            if walker is not None:
+                walker.close()  # Saves where the walk got to
+            checkpoint.close()
+            print("Progress saved, continue with --resume --checkpoint "
+                  "{}".format(args.checkpoint), file=sys.stderr)
+
+    if stats is not None:
+        print("\n".join(stats.summary()), file=sys.stderr)
+    elif governor is not None and not args.quiet:
+        print("Governor: " + governor.status(), file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    if not args.quiet:
+        criteria = []
+        if args.days is not None:
+            criteria.append("older than {} days".format(args.days))
+        if args.where is not None:
+            criteria.append("matching {}".format(args.where.text))
+        if args.top is not None:
+            criteria.append("the {} {}".format(args.top, args.top_by))
+        print("Scanned {} files in {} directories under {} root(s), {} "
+              "{}, in {:.2f}s ({:.0f} files/sec)".format(
+                  counts['files'], counts['dirs'], len(args.roots), matched,
+                  " and ".join(criteria), elapsed,
+                  counts['files'] / max(elapsed, 1e-9)),
+              file=sys.stderr)
+    return EXIT_OK if matched else EXIT_NO_MATCHES
+
+
+if __name__ == "__main__":
+    # So modules importing records, e.g. records_query for --where, share
+    # this module's FileRecord instead of loading a second copy
+    sys.modules.setdefault('records', sys.modules[__name__])
+    sys.exit(main())
@@ -0,0 +1,603 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:title: records_agent.py
+:author: Craig MacEachern
+
+Scan many file servers at once: an agent runs on each server, scans its
+local disks, and streams the results to one coordinator, which merges them
+into a single report or snapshot. Scanning locally avoids a network round
+trip for every directory listing and stat.
+
+Agents send their FileRecords in batches over TCP, packed and compressed,
+with progress reports in between. An agent only has WINDOW batches in
+flight: the coordinator acknowledges a batch once the records in it have
+been used, so a slow report writer slows the agents down instead of
+filling the coordinator's memory. Example, with the agents on the same
+machine for testing:
+
+    coordinator = Coordinator(port=9000, agents=2)
+    for root in ('/srv/share', '/srv/home'):
+        threading.Thread(target=run_agent,
+                         args=(coordinator.address, [root])).start()
+    records.write_report(coordinator.iter_records(), 'all.csv')
+
+From the command line:
+
+    python records_agent.py coordinate -p 9000 -n 12 -o all.csv
+    python records_agent.py agent -d 365 coordinator-host:9000 /srv/share
+
+Merged paths start with the agent's name, by default its host name, e.g.
+'fs01:/srv/share/report.doc'.
+
+##### KNOWN BUGS/ISSUES ##########
+* Agents are not authenticated and the stream is not encrypted. The
+coordinator listens on localhost unless told otherwise, only open it to
+trusted networks.
+* Agents with the same name are told apart by a '#2', '#3' suffix, in the
+order they connect.
+"""
+import json
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+import zlib
+
+import records
+
+PROTOCOL_VERSION = 1
+
+# Records sent in one batch.
+BATCH_SIZE = 2000
+
+# Batches an agent sends before waiting for them to be acknowledged.
+WINDOW = 8
+
+# Seconds between an agent's progress reports.
+PROGRESS_INTERVAL = 1.0
+
+# Largest frame accepted, a batch is far smaller.
+MAX_FRAME = 64 * 1024 * 1024
+
+# Frame kinds. HELLO, PROGRESS, DONE and ERROR carry JSON, BATCH packed
+# records and ACK nothing.
+HELLO, BATCH, PROGRESS, DONE, ERROR, ACK = range(1, 7)
+
+# kind, length of the body
+_FRAME = struct.Struct('>BI')
+
+# size, mtime, atime, ctime, uid (-1 if not known), length of the path
+_RECORD = struct.Struct('<qdddqI')
+
+
+def _frame(kind, body=b''):
+    """Return the bytes of a frame."""
+    return _FRAME.pack(kind, len(body)) + body
+
+
+def _json_frame(kind, message):
+    return _frame(kind, json.dumps(message).encode('utf-8'))
+
+
+def _pack_batch(batch):
+    """Return a batch of FileRecords packed and compressed."""
+    parts = []
+    for rec in batch:
+        path = rec.path.encode(records._FS_ENCODING, records._FS_ERRORS)
+        parts.append(_RECORD.pack(rec.size, rec.mtime, rec.atime, rec.ctime,
+                                  -1 if rec.uid is None else rec.uid,
+                                  len(path)))
+        parts.append(path)
+    return zlib.compress(b''.join(parts), 1)
+
+
+def _unpack_batch(body, prefix=''):
+    """Yield the FileRecords of a packed batch, their paths after prefix."""
+    data = zlib.decompress(body)
+    pos = 0
+    while pos < len(data):
+        size, mtime, atime, ctime, uid, n = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        path = data[pos:pos + n].decode(records._FS_ENCODING,
+                                        records._FS_ERRORS)
+        pos += n
+        yield records.FileRecord(prefix + path, size, mtime, atime, ctime,
+                                 None if uid < 0 else uid)
+
+
+def _recv_frame(sock, buf):
+    """
+    Return the next (kind, body) frame read from the blocking socket sock,
+    buf a bytearray of data read past the last frame.
+
+    :raises IOError: if the connection closes.
+    """
+    while True:
+        if len(buf) >= _FRAME.size:
+            kind, length = _FRAME.unpack_from(buf)
+            if len(buf) >= _FRAME.size + length:
+                body = bytes(buf[_FRAME.size:_FRAME.size + length])
+                del buf[:_FRAME.size + length]
+                return kind, body
+        data = sock.recv(65536)
+        if not data:
+            raise IOError("Connection closed by the coordinator")
+        buf += data
+
+
+def run_agent(address, roots, name=None, blacklist=None, get_hidden=False,
+              days=None, flag='m', workers=1, batch_size=BATCH_SIZE,
+              window=WINDOW, cancel=None):
+    """
+    Scan roots and stream the FileRecords found to the coordinator at
+    address.
+
+    :param address: The (host, port) of the Coordinator.
+    :param roots: An iterable of directories to scan.
+    :param name: Optional. Name of this agent, used as the prefix of its
+                 paths. Defaults to the host name.
+    :param days: Optional. If given only send files older than this many
+                 days, otherwise every file.
+    :param flag: Optional. Default 'm' to compare last modified times with
+                 days, 'a' last accessed.
+    :param cancel: Optional. A threading.Event, set to stop the scan. The
+                   coordinator is told the scan was cancelled, so the
+                   records sent are not taken for a complete scan.
+    :returns: a dict of counts of the 'dirs', 'files' and 'sent' records,
+              and 'cancelled', True if cancel stopped the scan.
+    :raises IOError: if a root does not exist or the coordinator can not be
+                     reached.
+
+    See records.iter_file_records() for the other parameters.
+    """
+    roots = [os.path.abspath(r) for r in roots]
+    for root in roots:
+        records._check_directory(root)
+    if name is None:
+        name = socket.gethostname()
+    cutoff = None if days is None else records._cutoff_time(days)
+    counts = {'dirs': 0, 'files': 0, 'sent': 0}
+
+    def on_directory(path, files):
+        counts['dirs'] += 1
+        counts['files'] += files
+
+    try:
+        sock = socket.create_connection(address, timeout=30)
+    except OSError as e:
+        raise IOError("Could not connect to the coordinator {}:{}: "
+                      "{}".format(address[0], address[1], e))
+    sock.settimeout(None)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    buf = bytearray()
+    in_flight = [0]
+
+    def send(frame):
+        sock.sendall(frame)
+
+    def wait_for_acks(most):
+        """Block until at most most batches are unacknowledged."""
+        while in_flight[0] > most:
+            kind, body = _recv_frame(sock, buf)
+            if kind == ACK:
+                in_flight[0] -= 1
+            elif kind == ERROR:
+                raise IOError("Coordinator error: {}".format(
+                    json.loads(body.decode('utf-8'))['message']))
+
+    def progress():
+        send(_json_frame(PROGRESS, counts))
+
+    try:
+        send(_json_frame(HELLO, {'version': PROTOCOL_VERSION, 'name': name,
+                                 'host': socket.gethostname(),
+                                 'roots': roots}))
+        batch = []
+        last = time.monotonic()
+        for root in roots:
+            for rec in records.iter_file_records(root, blacklist, get_hidden,
+                                                 workers, on_directory,
+                                                 cancel):
+                if cutoff is None or records._timestamp(rec, flag) < cutoff:
+                    batch.append(rec)
+                if len(batch) >= batch_size:
+                    wait_for_acks(window - 1)
+                    send(_frame(BATCH, _pack_batch(batch)))
+                    in_flight[0] += 1
+                    counts['sent'] += len(batch)
+                    batch = []
+                if time.monotonic() - last >= PROGRESS_INTERVAL:
+                    last = time.monotonic()
+                    progress()
+        if batch:
+            wait_for_acks(window - 1)
+            send(_frame(BATCH, _pack_batch(batch)))
+            in_flight[0] += 1
+            counts['sent'] += len(batch)
+        wait_for_acks(0)
+        counts['cancelled'] = cancel is not None and cancel.is_set()
+        send(_json_frame(DONE, counts))
+    except Exception as e:
+        try:  # Tell the coordinator why this agent is stopping
+            send(_json_frame(ERROR, {'message': str(e)}))
+        except OSError:
+            pass
+        if isinstance(e, OSError):
+            raise IOError("Lost the coordinator: {}".format(e))
+        raise
+    finally:
+        sock.close()
+    return counts
+
+
+class AgentProgress(object):
+    """What one agent has scanned and sent so far."""
+
+    def __init__(self, name, host, roots):
+        self.name = name
+        self.host = host
+        self.roots = roots
+        self.dirs = 0
+        self.files = 0
+        self.received = 0
+        self.batches = 0
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self.start = time.monotonic()
+
+    def __str__(self):
+        if self.error is not None:
+            state = "failed: {}".format(self.error)
+        elif self.cancelled:
+            state = "cancelled, incomplete"
+        else:
+            state = "done" if self.done else "scanning"
+        rate = self.files / max(time.monotonic() - self.start, 1e-9)
+        return ("{}: {} dirs, {} files ({:.0f}/sec), {} received, "
+                "{}".format(self.name, self.dirs, self.files, rate,
+                            self.received, state))
+
+
+class _Connection(object):
+    """The read buffer and progress of one agent's connection."""
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.buf = bytearray()
+        self.progress = None
+
+    def frames(self):
+        """Yield the complete (kind, body) frames read so far."""
+        while len(self.buf) >= _FRAME.size:
+            kind, length = _FRAME.unpack_from(self.buf)
+            if length > MAX_FRAME:
+                raise IOError("Frame too large: {} bytes".format(length))
+            if len(self.buf) < _FRAME.size + length:
+                return
+            body = bytes(self.buf[_FRAME.size:_FRAME.size + length])
+            del self.buf[:_FRAME.size + length]
+            yield kind, body
+
+
+class Coordinator(object):
+    """
+    Listens for agents and merges the records they send. Create it, start
+    the agents, then read the merged records from iter_records().
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, agents=1, prefix=True,
+                 on_progress=None, timeout=None):
+        """
+        Start listening for agents.
+
+        :param host: Optional. Address to listen on, default localhost
+                     only. '' listens on every interface.
+        :param port: Optional. Port to listen on, default 0 picks a free
+                     one, see address.
+        :param agents: Optional. Number of agents to wait for.
+        :param prefix: Optional. Default True starts each path with the
+                       agent's name and ':'.
+        :param on_progress: Optional. A callable taking an AgentProgress,
+                            called whenever an agent reports progress,
+                            finishes or fails.
+        :param timeout: Optional. Seconds to wait without hearing from any
+                        agent before giving up. Default None waits forever.
+        :raises IOError: if the port can not be listened on.
+        """
+        try:
+            self._listener = socket.create_server((host, port))
+        except OSError as e:
+            raise IOError("Could not listen on {}:{}: {}".format(host, port,
+                                                                 e))
+        self._listener.setblocking(False)
+        self.address = self._listener.getsockname()[:2]
+        self.expected = agents
+        self.prefix = prefix
+        self.on_progress = on_progress
+        self.timeout = timeout
+        self.agents = {}  # name: AgentProgress
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop listening."""
+        self._listener.close()
+
+    def _hello(self, conn, body):
+        message = json.loads(body.decode('utf-8'))
+        if message.get('version') != PROTOCOL_VERSION:
+            raise IOError("Agent protocol version {} is not {}".format(
+                message.get('version'), PROTOCOL_VERSION))
+        name = base = message['name']
+        n = 1
+        while name in self.agents:
+            n += 1
+            name = '{}#{}'.format(base, n)
+        conn.progress = AgentProgress(name, message['host'],
+                                      message['roots'])
+        self.agents[name] = conn.progress
+
+    def _report(self, progress):
+        if self.on_progress is not None:
+            self.on_progress(progress)
+
+    def iter_records(self):
+        """
+        Yield the FileRecords of every agent as they arrive, until the
+        expected number of agents have finished or failed. A batch is
+        acknowledged once its records have all been taken, which is what
+        keeps the agents from running ahead. The records of an agent whose
+        scan was cancelled are yielded too, check AgentProgress.cancelled
+        before taking the results as complete.
+
+        :raises IOError: if timeout passes without any agent sending data.
+        """
+        sel = selectors.DefaultSelector()
+        sel.register(self._listener, selectors.EVENT_READ, None)
+        finished = 0
+        try:
+            while finished < self.expected:
+                events = sel.select(self.timeout)
+                if not events:
+                    raise IOError("No agent was heard from for {}s".format(
+                        self.timeout))
+                for key, mask in events:
+                    if key.data is None:
+                        sock, address = self._listener.accept()
+                        sock.setblocking(False)
+                        sel.register(sock, selectors.EVENT_READ,
+                                     _Connection(sock, address))
+                        continue
+                    conn = key.data
+                    error = None
+                    try:
+                        data = conn.sock.recv(1 << 20)
+                    except BlockingIOError:
+                        continue
+                    except OSError as e:
+                        data, error = b'', str(e)
+                    if data:
+                        conn.buf += data
+                        try:
+                            frames = list(conn.frames())
+                        except IOError as e:
+                            frames, error = [], str(e)
+                    else:
+                        frames = []
+                        error = error or "disconnected"
+
+                    ended = False
+                    for kind, body in frames:
+                        try:
+                            ended = yield from self._handle(conn, kind, body)
+                        except (IOError, ValueError, zlib.error) as e:
+                            error = str(e)
+                        if ended or error:
+                            break
+                    if ended or error:
+                        if conn.progress is None:  # Failed before hello
+                            conn.progress = AgentProgress(
+                                '{}:{}'.format(*conn.address[:2]), None, [])
+                            self.agents[conn.progress.name] = conn.progress
+                        if not ended:
+                            conn.progress.error = error
+                            self._report(conn.progress)
+                        sel.unregister(conn.sock)
+                        conn.sock.close()
+                        finished += 1
+        finally:
+            for key in list(sel.get_map().values()):
+                if key.data is not None:
+                    key.fileobj.close()
+            sel.close()
+
+    def _handle(self, conn, kind, body):
+        """
+        Handle a frame from conn, yielding any records in it.
+
+        :returns: True once the agent has finished.
+        """
+        if kind == HELLO:
+            self._hello(conn, body)
+            return False
+        if conn.progress is None:
+            raise IOError("Agent did not say hello")
+        progress = conn.progress
+        if kind == BATCH:
+            prefix = progress.name + ':' if self.prefix else ''
+            n = 0
+            for rec in _unpack_batch(body, prefix):
+                n += 1
+                yield rec
+            progress.received += n
+            progress.batches += 1
+            conn.sock.setblocking(True)  # A few bytes, it is never full
+            try:
+                conn.sock.sendall(_frame(ACK))
+            finally:
+                conn.sock.setblocking(False)
+            return False
+        if kind in (PROGRESS, DONE):
+            counts = json.loads(body.decode('utf-8'))
+            progress.dirs = counts['dirs']
+            progress.files = counts['files']
+            progress.done = kind == DONE
+            progress.cancelled = counts.get('cancelled', False)
+            self._report(progress)
+            return progress.done
+        if kind == ERROR:
+            raise IOError(json.loads(body.decode('utf-8'))['message'])
+        raise IOError("Unknown frame kind {}".format(kind))
+
+
+def _parse_address(text):
+    """Return the (host, port) of 'host:port'."""
+    host, _, port = text.rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise ValueError("Not a host:port address: {}".format(text))
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="records_agent.py",
+        description="Scan file servers locally and merge the results on "
+                    "one coordinator.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coordinate = commands.add_parser(
+        "coordinate", help="Collect the results of several agents into one "
+                           "report.")
+    coordinate.add_argument("-H", "--host", default="127.0.0.1",
+                            help="Address to listen on, '' for all "
+                                 "(default: %(default)s).")
+    coordinate.add_argument("-p", "--port", type=int, default=9000,
+                            help="Port to listen on (default: %(default)s).")
+    coordinate.add_argument("-n", "--agents", type=int, default=1,
+                            help="Number of agents to wait for "
+                                 "(default: %(default)s).")
+    coordinate.add_argument("-f", "--format", choices=records.REPORT_FORMATS,
+                            default="csv",
+                            help="Report format (default: %(default)s).")
+    coordinate.add_argument("-c", "--columns", default="date,path",
+                            help="Comma separated report columns "
+                                 "(default: %(default)s).")
+    coordinate.add_argument("-o", "--output", default="-", metavar="FILE",
+                            help="File to write the report to, '-' for "
+                                 "stdout (default).")
+    coordinate.add_argument("--snapshot", metavar="FILE",
+                            help="Save the merged results as a "
+                                 "records_snapshot.py snapshot instead of a "
+                                 "report.")
+    coordinate.add_argument("-t", "--timeout", type=float,
+                            help="Give up after this many seconds without "
+                                 "hearing from any agent.")
+    coordinate.add_argument("-q", "--quiet", action="store_true",
+                            help="Do not print agent progress to stderr.")
+
+    agent = commands.add_parser(
+        "agent", help="Scan local directories and send the results to a "
+                      "coordinator.")
+    agent.add_argument("coordinator", type=_parse_address,
+                       metavar="HOST:PORT", help="Address of the coordinator.")
+    agent.add_argument("roots", nargs="+", metavar="DIRECTORY",
+                       help="Directory to scan.")
+    agent.add_argument("--name",
+                       help="Name of this agent (default: the host name).")
+    agent.add_argument("-d", "--days", type=int,
+                       help="Only send files older than this many days "
+                            "(default: every file).")
+    agent.add_argument("-l", "--last", choices=("modified", "accessed"),
+                       default="modified",
+                       help="Which file time to compare "
+                            "(default: %(default)s).")
+    agent.add_argument("-b", "--blacklist", metavar="FILE",
+                       help="File of names, globs or paths to skip.")
+    agent.add_argument("--hidden", action="store_true",
+                       help="Include hidden files and directories.")
+    agent.add_argument("-j", "--workers", type=int, default=1,
+                       help="Threads listing directories concurrently "
+                            "(default: %(default)s).")
+    args = parser.parse_args(argv)
+    if args.command == "coordinate":
+        args.columns = [c.strip() for c in args.columns.split(",")
+                        if c.strip()]
+    return args
+
+
+def main(argv=None):
+    """
+    Run an agent or the coordinator from the command line.
+
+    :param argv: Optional. A list of arguments, defaults to sys.argv[1:].
+    :returns: 0 on success, 1 if an agent failed or was cancelled or nothing
+              was found, 2 on errors.
+    """
+    args = _parse_args(argv)
+    try:
+        if args.command == "agent":
+            blacklist = records.get_blacklist(args.blacklist)
+            counts = run_agent(args.coordinator, args.roots, args.name,
+                               blacklist, args.hidden, args.days,
+                               'a' if args.last == "accessed" else 'm',
+                               args.workers)
+            print("Sent {sent} of {files} files in {dirs} "
+                  "directories".format(**counts), file=sys.stderr)
+            return 0
+
+        def on_progress(progress):
+            if not args.quiet:
+                print(progress, file=sys.stderr)
+
+        with Coordinator(args.host, args.port, args.agents,
+                         on_progress=on_progress,
+                         timeout=args.timeout) as coordinator:
+            if not args.quiet:
+                print("Waiting for {} agent(s) on {}:{}".format(
+                    args.agents, *coordinator.address), file=sys.stderr)
+            merged = coordinator.iter_records()
+            if args.snapshot:
+                import records_snapshot
+                matched = records_snapshot.save_snapshot(merged,
+                                                         args.snapshot)
+            elif args.output == "-":
+                matched = records.write_report(merged, sys.stdout.buffer,
+                                               args.format,
+                                               columns=args.columns)
+            else:
+                # Opened here so agent errors are not reported as write
+                # errors
+                with open(args.output, 'wb', buffering=1 << 20) as output:
+                    matched = records.write_report(merged, output,
+                                                   args.format,
+                                                   columns=args.columns)
+            failed = [p for p in coordinator.agents.values()
+                      if p.error is not None or p.cancelled]
+    except KeyboardInterrupt:
+        print("Interrupted.", file=sys.stderr)
+        return 2
+    except (IOError, ValueError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 2
+
+    if not args.quiet:
+        print("{} files from {} agent(s), {} failed or cancelled".format(
+            matched, len(coordinator.agents), len(failed)), file=sys.stderr)
+    return 1 if failed or not matched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
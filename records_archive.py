@@ -0,0 +1,631 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:title: records_archive.py
+:author: Craig MacEachern
+
+Archive the stale files found by a records.py scan: copy, move or gzip
+each file into an archive directory, or pack them into tar or zip files,
+keeping their paths relative to the scanned directory and their times.
+
+Files are read and written by a pool of threads, a few files ahead of the
+scan. Every SYNC_EVERY files the new files and their directories are
+fsync'ed together, and only then are they added to the manifest, so the
+manifest never lists a file that a crash could lose. Moved files are
+linked or copied first, and the originals are only removed once their
+copies are in the manifest.
+
+The manifest is a JSON lines file, a header then one line per file with
+its source path, archive path, size, modified time and SHA-256 checksum.
+Give it again with resume=True to carry on after an interruption, skipping
+the files it lists. Example:
+
+    stale = records.iter_cutoff_files(records.iter_file_records(path), 365)
+    stats = ArchiveStats()
+    with open_manifest('archive.jsonl', path, '/mnt/archive', 'move') as m:
+        for entry in iter_archive(stale, path, '/mnt/archive', 'move', m,
+                                  stats=stats):
+            pass
+    print(stats.throughput())
+
+##### KNOWN BUGS/ISSUES ##########
+* A file that changes size while it is added to a tar file fails the whole
+tar file, and all of its files are reported as errors. They are archived
+again on the next run.
+* Directories emptied by moving their files are left in place.
+* Zip files can not hold dates before 1980, those are stored as 1980-01-01.
+"""
+import gzip
+import hashlib
+import json
+import os
+import stat
+import sys
+import tarfile
+import time
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import records
+
+# One archived file. path is its absolute source path, so a resumed run
+# matches it however the source was spelled. dest is the file it was
+# archived to, member its name inside dest for tar and zip, otherwise None.
+# sha256 is the hex checksum of its contents, None in a dry run.
+ArchiveEntry = namedtuple('ArchiveEntry', ['path', 'dest', 'member', 'size',
+                                           'mtime', 'sha256'])
+
+# What to do with each file.
+ACTIONS = ('copy', 'move', 'gzip', 'tar', 'zip')
+
+# Files archived between fsyncs of the archive and manifest.
+SYNC_EVERY = 1000
+
+# Most files, and bytes, in one tar or zip file.
+BATCH_FILES = 10000
+BATCH_BYTES = 1 << 30
+
+# Bytes read at a time.
+CHUNK_SIZE = 1024 * 1024
+
+MANIFEST_VERSION = 1
+
+# Suffix of a file being written, replaced once it is complete.
+_PARTIAL = '.partial'
+
+
+class ArchiveStats(object):
+    """Counts and rates of an archive run, updated as files are synced."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0  # Already in the manifest
+        self.errors = 0
+        self.start = time.perf_counter()
+
+    def elapsed(self):
+        """Return the seconds since this was created."""
+        return time.perf_counter() - self.start
+
+    def throughput(self):
+        """Return a line of the run's counts and rates so far."""
+        elapsed = max(self.elapsed(), 1e-9)
+        return ("{} files, {:.1f} MB archived, {} skipped, {} errors in "
+                "{:.1f}s: {:.0f} files/sec, {:.1f} MB/sec".format(
+                    self.files, self.bytes / 1e6, self.skipped, self.errors,
+                    elapsed, self.files / elapsed, self.bytes / elapsed / 1e6))
+
+
+class Manifest(object):
+    """
+    The manifest of an archive run, see open_manifest(). done is the set of
+    absolute source paths already archived.
+    """
+
+    def __init__(self, path, header, done, f):
+        self.path = path
+        self.header = header
+        self.done = done
+        self._file = f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, entries):
+        """Append entries, ArchiveEntries, and make sure they are on disk."""
+        for entry in entries:
+            self._file.write(json.dumps(entry._asdict()) + '\n')
+            self.done.add(entry.path)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def open_manifest(path, source, dest, action, resume=False):
+    """
+    Open the manifest file path of archiving source to dest.
+
+    :param resume: Optional. True to carry on with an existing manifest,
+                   which must be of the same source, dest and action.
+    :returns: a Manifest.
+    :raises IOError: if path exists and resume is False, or it is of a
+                     different run, or it can not be opened.
+    """
+    header = {'version': MANIFEST_VERSION, 'action': action,
+              'source': os.path.abspath(source),
+              'dest': os.path.abspath(dest)}
+    done = set()
+    if not resume:
+        if os.path.exists(path):
+            raise IOError("Manifest {} exists, resume it or remove "
+                          "it".format(path))
+        f = open(path, 'w', encoding='utf-8', errors=records._FS_ERRORS)
+        f.write(json.dumps(header) + '\n')
+        f.flush()
+        return Manifest(path, header, done, f)
+
+    try:
+        f = open(path, 'rb+')
+    except OSError as e:
+        raise IOError("Could not read manifest {}: {}".format(path, e))
+    with f:
+        try:
+            saved = json.loads(f.readline())
+        except ValueError:
+            raise IOError("Not a manifest: {}".format(path))
+        if saved != header:
+            raise IOError("Manifest {} is of a different archive run: "
+                          "{}".format(path, saved))
+        end = f.tell()
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # Cut short by a crash, it is written again
+            done.add(json.loads(line)['path'])
+            end += len(line)
+        f.truncate(end)
+    f = open(path, 'a', encoding='utf-8', errors=records._FS_ERRORS)
+    return Manifest(path, header, done, f)
+
+
+def _copy(src, out, h):
+    """Copy the open file src to out, updating the hash h."""
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    while True:
+        n = src.readinto(buf)
+        if not n:
+            break
+        h.update(view[:n])
+        out.write(view[:n])
+
+
+def _hash_file(path):
+    """Return the hex SHA-256 of the contents of path."""
+    h = hashlib.sha256()
+    with open(path, 'rb', buffering=0) as src:
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = src.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def _archive_file(action, path, rel, dest, dry_run):
+    """
+    Copy, move or gzip path to rel under dest, in a worker thread.
+
+    :returns: a list of one (entry, remove) tuple, remove is the path to
+              delete once entry is synced, or (None, (path, error)).
+    """
+    try:
+        st = os.stat(path)
+        target = os.path.join(dest, rel)
+        if action == 'gzip':
+            target += '.gz'
+        if dry_run:
+            entry = ArchiveEntry(path, target, None, st.st_size, st.st_mtime,
+                                 None)
+            return [(entry, None)]
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        if action == 'move':
+            # A hard link is a move on the same filesystem that leaves the
+            # original until the link is synced
+            try:
+                if os.path.lexists(target):
+                    os.remove(target)  # Left by an interrupted run
+                os.link(path, target)
+            except OSError:
+                pass
+            else:
+                entry = ArchiveEntry(path, target, None, st.st_size,
+                                     st.st_mtime, _hash_file(path))
+                return [(entry, path)]
+
+        h = hashlib.sha256()
+        partial = target + _PARTIAL
+        with open(path, 'rb', buffering=0) as src, \
+                open(partial, 'wb') as raw:
+            if action == 'gzip':
+                with gzip.GzipFile(os.path.basename(path), 'wb',
+                                   fileobj=raw, mtime=int(st.st_mtime)) as out:
+                    _copy(src, out, h)
+            else:
+                _copy(src, raw, h)
+        os.chmod(partial, stat.S_IMODE(st.st_mode))
+        os.utime(partial, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(partial, target)
+    except OSError as e:
+        return [(None, (path, e))]
+    entry = ArchiveEntry(path, target, None, st.st_size, st.st_mtime,
+                         h.hexdigest())
+    return [(entry, path if action == 'move' else None)]
+
+
+class _HashingReader(object):
+    """A file wrapper hashing what is read, for tarfile.addfile()."""
+
+    def __init__(self, f, h):
+        self._f = f
+        self._h = h
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._h.update(data)
+        return data
+
+
+def _archive_batch(action, items, target, dry_run):
+    """
+    Pack items, a list of (path, rel) tuples, into the tar or zip file
+    target, in a worker thread.
+
+    :returns: a list of (entry, None) or (None, (path, error)) tuples.
+    """
+    results = []
+    if dry_run:
+        for path, rel in items:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                results.append((None, (path, e)))
+                continue
+            results.append((ArchiveEntry(path, target, rel, st.st_size,
+                                         st.st_mtime, None), None))
+        return results
+
+    partial = target + _PARTIAL
+    try:
+        if action == 'tar':
+            with tarfile.open(partial, 'w') as tar:
+                for path, rel in items:
+                    h = hashlib.sha256()
+                    try:
+                        f = open(path, 'rb')
+                    except OSError as e:
+                        results.append((None, (path, e)))
+                        continue
+                    with f:
+                        info = tar.gettarinfo(arcname=rel, fileobj=f)
+                        tar.addfile(info, _HashingReader(f, h))
+                    results.append((ArchiveEntry(
+                        path, target, rel, info.size, info.mtime,
+                        h.hexdigest()), None))
+        else:
+            with zipfile.ZipFile(partial, 'w', zipfile.ZIP_DEFLATED,
+                                 strict_timestamps=False) as zf:
+                for path, rel in items:
+                    h = hashlib.sha256()
+                    try:
+                        st = os.stat(path)
+                        info = zipfile.ZipInfo.from_file(
+                            path, rel, strict_timestamps=False)
+                        f = open(path, 'rb', buffering=0)
+                    except OSError as e:
+                        results.append((None, (path, e)))
+                        continue
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    with f, zf.open(info, 'w', force_zip64=(
+                            st.st_size >= zipfile.ZIP64_LIMIT)) as out:
+                        _copy(f, out, h)
+                    results.append((ArchiveEntry(
+                        path, target, rel, st.st_size, st.st_mtime,
+                        h.hexdigest()), None))
+        os.replace(partial, target)
+    except OSError as e:  # The whole file is lost, try them all again later
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        return [(None, (path, e)) for path, rel in items]
+    return results
+
+
+def _sync(path):
+    """fsync the file or directory path, where the platform allows."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # e.g. directories on Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _next_batch_number(dest, action):
+    """Return the number of the next tar or zip file under dest."""
+    last = 0
+    prefix = 'archive-'
+    suffix = '.' + action
+    try:
+        names = os.listdir(dest)
+    except OSError:
+        return 1
+    for name in names:
+        if name.startswith(prefix) and name.endswith(suffix):
+            try:
+                last = max(last, int(name[len(prefix):-len(suffix)]))
+            except ValueError:
+                pass
+    return last + 1
+
+
+def iter_archive(files, source, dest, action='copy', manifest=None,
+                 workers=4, dry_run=False, stats=None, on_error=None,
+                 sync_every=SYNC_EVERY, batch_files=BATCH_FILES,
+                 batch_bytes=BATCH_BYTES):
+    """
+    Archive files under source to dest, yielding an ArchiveEntry for each
+    file once it is safely archived.
+
+    :param files: An iterable of FileRecords or filenames under source,
+                  e.g. from records.iter_cutoff_files().
+    :param source: The directory files were found under. Their paths under
+                   it are kept under dest.
+    :param dest: The archive directory, created if need be.
+    :param action: Optional. One of ACTIONS: 'copy', 'move', 'gzip' (copy
+                   each file to a .gz), or 'tar' or 'zip' to pack them into
+                   numbered archive-NNNNNN.tar or .zip files. Default
+                   'copy'.
+    :param manifest: Optional. A Manifest from open_manifest() to record
+                     the files in, and skip the files it already lists.
+    :param workers: Optional. Threads reading and writing files.
+    :param dry_run: Optional. True to yield the entries that would be
+                    archived, without a checksum, and change nothing.
+    :param stats: Optional. An ArchiveStats to count the run in.
+    :param on_error: Optional. A callable taking a path and an error,
+                     called for each file that could not be archived.
+    :param sync_every: Optional. Files archived between fsyncs.
+    :param batch_files: Optional. Most files in one tar or zip file.
+    :param batch_bytes: Optional. Most bytes in one tar or zip file.
+    :returns: a generator of ArchiveEntries.
+    :raises ValueError: if action is unknown or dest is inside source.
+    """
+    if action not in ACTIONS:
+        raise ValueError("Unknown action: {}".format(action))
+    source = os.path.abspath(source)
+    dest = os.path.abspath(dest)
+    if dest == source or dest.startswith(os.path.join(source, '')):
+        raise ValueError("The archive can not be inside the source")
+    if stats is None:
+        stats = ArchiveStats()
+    done = manifest.done if manifest is not None else ()
+    batched = action in ('tar', 'zip')
+    if not dry_run:
+        os.makedirs(dest, exist_ok=True)
+
+    def units():
+        """Yield the work, (function, arguments), for the thread pool."""
+        number = _next_batch_number(dest, action) if batched else 0
+        batch = []
+        size = 0
+        for item in files:
+            path = os.path.abspath(records._path(item))
+            if path in done:
+                stats.skipped += 1
+                continue
+            rel = os.path.relpath(path, source)
+            if rel == os.pardir or rel.startswith(os.pardir + os.sep) or \
+                    os.path.isabs(rel):
+                report((None, (path, ValueError("Not under the source "
+                                                "directory"))))
+                continue
+            if not batched:
+                yield _archive_file, (action, path, rel, dest, dry_run)
+                continue
+            batch.append((path, rel))
+            size += getattr(item, 'size', 0)
+            if len(batch) >= batch_files or size >= batch_bytes:
+                target = os.path.join(dest, 'archive-{:06d}.{}'.format(
+                    number, action))
+                yield _archive_batch, (action, batch, target, dry_run)
+                number += 1
+                batch = []
+                size = 0
+        if batch:
+            target = os.path.join(dest, 'archive-{:06d}.{}'.format(number,
+                                                                   action))
+            yield _archive_batch, (action, batch, target, dry_run)
+
+    unsynced = []  # (entry, path to remove once synced)
+
+    def report(result):
+        entry, error = result
+        if entry is None:
+            stats.errors += 1
+            if on_error is not None:
+                on_error(*error)
+        else:
+            unsynced.append((entry, error))
+
+    def flush(executor):
+        """Sync the files archived since the last flush, return them."""
+        entries = [entry for entry, remove in unsynced]
+        if not dry_run and entries:
+            # The files, then their directories, so the names are kept too
+            targets = sorted(set(e.dest for e in entries))
+            list(executor.map(_sync, targets))
+            list(executor.map(_sync, sorted(set(
+                os.path.dirname(t) for t in targets))))
+            if manifest is not None:
+                manifest.add(entries)
+            for entry, remove in unsynced:
+                if remove is not None:
+                    try:
+                        os.remove(remove)
+                    except OSError as e:
+                        stats.errors += 1
+                        if on_error is not None:
+                            on_error(remove, e)
+        stats.files += len(entries)
+        stats.bytes += sum(e.size for e in entries)
+        del unsynced[:]
+        return entries
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for func, args in units():
+                pending.append(executor.submit(func, *args))
+                # Keep a few files ahead of the workers, not the whole scan
+                while len(pending) > workers * 4 or \
+                        (pending and pending[0].done()):
+                    for result in pending.popleft().result():
+                        report(result)
+                    if len(unsynced) >= sync_every:
+                        yield from flush(executor)
+            while pending:
+                for result in pending.popleft().result():
+                    report(result)
+                if len(unsynced) >= sync_every:
+                    yield from flush(executor)
+            yield from flush(executor)
+        finally:
+            # Stopped early, record what was already archived anyway
+            while pending:
+                for result in pending.popleft().result():
+                    report(result)
+            flush(executor)
+
+
+def iter_manifest_lines(entries, style='txt'):
+    """
+    Yield the report lines of entries, ArchiveEntries, with a header.
+
+    :param style: Optional. Plain text with tabs ('txt') or comma separated
+                  values ('csv').
+    :returns: a generator of newline terminated strings.
+    """
+    def row(entry):
+        return (entry.path, entry.dest, entry.member or "", entry.size,
+                datetime.fromtimestamp(entry.mtime).strftime(
+                    "%Y-%m-%d %H:%M:%S"),
+                entry.sha256 or "")
+
+    return records._iter_csv_lines(("Path", "Archive", "Member", "Size",
+                                    "Modified", "SHA-256"),
+                                   map(row, entries), style)
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="records_archive.py",
+        description="Copy, move, gzip, tar or zip the files older than some "
+                    "days into an archive directory.")
+    parser.add_argument("root", metavar="DIRECTORY",
+                        help="Directory to scan.")
+    parser.add_argument("dest", metavar="ARCHIVE",
+                        help="Directory to archive the files to.")
+    parser.add_argument("-a", "--action", choices=ACTIONS, default="copy",
+                        help="What to do with each file "
+                             "(default: %(default)s).")
+    parser.add_argument("-d", "--days", type=int, default=90,
+                        help="Only archive files older than this many days "
+                             "(default: %(default)s).")
+    parser.add_argument("-l", "--last", choices=("modified", "accessed"),
+                        default="modified",
+                        help="Which file time to compare "
+                             "(default: %(default)s).")
+    parser.add_argument("-b", "--blacklist", metavar="FILE",
+                        help="File of names, globs or paths to skip.")
+    parser.add_argument("--hidden", action="store_true",
+                        help="Include hidden files and directories.")
+    parser.add_argument("-m", "--manifest", metavar="FILE",
+                        help="JSON lines file listing every archived file "
+                             "with its checksum (default: "
+                             "ARCHIVE/manifest.jsonl).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Carry on from the manifest of an interrupted "
+                             "run, skipping the files it lists.")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="Print what would be archived and change "
+                             "nothing.")
+    parser.add_argument("-f", "--format", choices=("txt", "csv"),
+                        default="txt",
+                        help="Dry run report format (default: %(default)s).")
+    parser.add_argument("-j", "--workers", type=int, default=4,
+                        help="Threads copying files (default: %(default)s).")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Do not print progress to stderr.")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.manifest is None:
+        args.manifest = os.path.join(args.dest, "manifest.jsonl")
+    return args
+
+
+def main(argv=None):
+    """
+    Archive stale files from the command line, e.g.
+
+        python records_archive.py -d 730 -a move /srv/share /mnt/archive
+
+    :param argv: Optional. A list of arguments, defaults to sys.argv[1:].
+    :returns: 0 if every file was archived, 1 if some could not be, 2 on
+              errors.
+    """
+    args = _parse_args(argv)
+    flag = 'a' if args.last == "accessed" else 'm'
+    stats = ArchiveStats()
+    last = [time.monotonic()]
+
+    def on_error(path, error):
+        print("Could not archive {}: {}".format(path, error),
+              file=sys.stderr)
+
+    manifest = None
+    try:
+        blacklist = records.get_blacklist(args.blacklist)
+        stale = records.iter_cutoff_files(
+            records.iter_file_records(args.root, blacklist, args.hidden),
+            args.days, flag)
+        if not args.dry_run:
+            os.makedirs(args.dest, exist_ok=True)
+            manifest = open_manifest(args.manifest, args.root, args.dest,
+                                     args.action, args.resume)
+        entries = iter_archive(stale, args.root, args.dest, args.action,
+                               manifest, args.workers, args.dry_run, stats,
+                               on_error)
+        if args.dry_run:
+            sys.stdout.writelines(iter_manifest_lines(entries, args.format))
+        else:
+            for _ in entries:
+                now = time.monotonic()
+                if not args.quiet and now - last[0] >= 5:
+                    last[0] = now
+                    print(stats.throughput(), file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Interrupted, continue with --resume.", file=sys.stderr)
+        return 2
+    except (IOError, ValueError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 2
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    if not args.quiet:
+        print(stats.throughput(), file=sys.stderr)
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:title: records_bench.py
+:author: Craig MacEachern
+
+A benchmark harness for records.py.
+
+Generates a reproducible synthetic directory tree, then times each stage of
+the scan pipeline on it separately: listing (get_file_paths), walking and
+stat'ing (iter_file_records into a ScanStore), filtering (get_cutoff_files)
+and report writing (write_to_file). For each stage it reports the best wall
+time of several runs and files/sec, plus the filesystem calls made per
+file, and the peak resident memory of the whole run. Results are saved as
+JSON so runs of different versions can be compared:
+
+    python records_bench.py --depth 4 --fanout 5 -o before.json
+    ... change records.py ...
+    python records_bench.py --depth 4 --fanout 5 -o after.json \\
+        --compare before.json
+
+The same --seed and tree options always generate the same tree, names,
+sizes and (relative) ages, so results are comparable between machines.
+
+##### KNOWN BUGS/ISSUES ##########
+* The tree is in the OS page cache once it has been generated, so these
+are warm cache timings. Cold cache (e.g. first scan of a network share)
+timings are usually dominated by listing and stat latency.
+* Peak memory is the high-water mark of the whole process, so it is
+reported once for the run rather than per stage. It is not available on
+Windows.
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import records
+
+try:
+    import resource  # For peak memory, not available on Windows
+except ImportError:
+    resource = None
+
+# Patterns the generated tree has hits for: files named *.tmp, files named
+# Thumbs.db, and whole directories named scratch*.
+BENCH_BLACKLIST = ('*.tmp', 'Thumbs.db', 'scratch*')
+
+# Defaults of make_tree(), also the command line defaults.
+TREE_DEFAULTS = {'depth': 3, 'fanout': 4, 'files': 100, 'hidden': 0.05,
+                 'blacklisted': 0.05, 'mean_age': 365, 'max_age': 3650,
+                 'seed': 0}
+
+# Written at the top of a generated tree, so it can be reused when the
+# options match. Hidden, so scans skip it.
+_MANIFEST = '.records_bench.json'
+
+_EXTENSIONS = ('.txt', '.doc', '.pdf', '.xls', '.jpg', '.pst', '.zip')
+
+
+def make_tree(root, depth=3, fanout=4, files=100, hidden=0.05,
+              blacklisted=0.05, mean_age=365, max_age=3650, seed=0):
+    """
+    Generate a synthetic directory tree under root.
+
+    Every directory above the given depth has fanout subdirectories and
+    every directory has files files. Files are sparse, so sizes cost no
+    disk space. Last modified ages follow an exponential distribution, and
+    last accessed times fall between the modified time and now, both set
+    with os.utime().
+
+    :param root: Directory to create the tree in. Created if missing.
+    :param depth: Optional. Levels of subdirectories below root.
+    :param fanout: Optional. Subdirectories of each directory.
+    :param files: Optional. Files in each directory.
+    :param hidden: Optional. Fraction of files and directories whose names
+                   start with '.'.
+    :param blacklisted: Optional. Fraction of files and directories whose
+                        names match BENCH_BLACKLIST.
+    :param mean_age: Optional. Mean days since files were last modified.
+    :param max_age: Optional. Most days since files were last modified.
+    :param seed: Optional. Seed of the random generator.
+    :returns: a dict of the options and counts of the tree. 'visible' is
+              the number of files a scan with BENCH_BLACKLIST and without
+              hidden files should find.
+    :raises IOError: if the tree can not be written.
+    """
+    rng = random.Random(seed)
+    now = time.time()
+    day = 24 * 60 * 60
+    counts = {'dirs': 0, 'files': 0, 'visible': 0, 'hidden': 0,
+              'blacklisted': 0, 'bytes': 0}
+
+    def name_of(kind, i, ext=''):
+        """Return an entry name, and whether a scan should skip it."""
+        r = rng.random()
+        if r < hidden:
+            counts['hidden'] += 1
+            return '.{}{}{}'.format(kind, i, ext), True
+        if r < hidden + blacklisted:
+            counts['blacklisted'] += 1
+            if kind == 'd':
+                return 'scratch{}'.format(i), True
+            return ('Thumbs.db', True) if i == 0 else \
+                ('{}{}.tmp'.format(kind, i), True)
+        return '{}{}{}'.format(kind, i, ext), False
+
+    try:
+        os.makedirs(root, exist_ok=True)
+        # (directory, level, True if a scan never reaches it)
+        stack = [(root, 0, False)]
+        while stack:
+            path, level, skipped = stack.pop()
+            counts['dirs'] += 1
+            for i in range(files):
+                name, skip = name_of('f', i, rng.choice(_EXTENSIONS))
+                size = min(int(rng.lognormvariate(10, 2)), 1 << 30)
+                age = min(rng.expovariate(1.0 / mean_age), max_age) * day
+                mtime = now - age
+                atime = mtime + rng.random() * age
+                file_path = os.path.join(path, name)
+                with open(file_path, 'wb') as f:
+                    f.truncate(size)
+                os.utime(file_path, (atime, mtime))
+                counts['files'] += 1
+                counts['bytes'] += size
+                if not (skip or skipped):
+                    counts['visible'] += 1
+            if level < depth:
+                for i in range(fanout):
+                    name, skip = name_of('d', i)
+                    sub = os.path.join(path, name)
+                    os.mkdir(sub)
+                    stack.append((sub, level + 1, skip or skipped))
+    except OSError as e:
+        raise IOError('Error generating benchmark tree: {}'.format(e))
+
+    return dict(counts, depth=depth, fanout=fanout, files_per_dir=files,
+                hidden_ratio=hidden, blacklisted_ratio=blacklisted,
+                mean_age=mean_age, max_age=max_age, seed=seed)
+
+
+def get_tree(root, **options):
+    """
+    Return the dict of make_tree() for a tree under root, generating it
+    unless root already holds a tree made with the same options.
+
+    :param root: Directory of the tree.
+    :param options: Optional. Keyword arguments of make_tree().
+    :returns: the dict of make_tree().
+    """
+    options = dict(TREE_DEFAULTS, **options)
+    manifest = os.path.join(root, _MANIFEST)
+    try:
+        with open(manifest) as f:
+            tree = json.load(f)
+        if tree['options'] == options:
+            return tree['tree']
+    except (IOError, ValueError, KeyError):
+        pass
+
+    if os.path.isdir(root) and os.listdir(root):
+        raise IOError('Refusing to generate a tree in non-empty directory '
+                      '{}'.format(root))
+    tree = make_tree(root, **options)
+    with open(manifest, 'w') as f:
+        json.dump({'options': options, 'tree': tree}, f)
+    return tree
+
+
+class _DirEntryCounter(object):
+    """A DirEntry proxy counting its stat() calls."""
+
+    __slots__ = ('_entry', '_counts', 'name', 'path')
+
+    def __init__(self, entry, counts):
+        self._entry = entry
+        self._counts = counts
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_dir(self, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self):
+        return self._entry.is_symlink()
+
+    def stat(self, follow_symlinks=True):
+        self._counts['stat'] += 1
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+
+class _ScandirCounter(object):
+    """An os.scandir() iterator proxy yielding _DirEntryCounters."""
+
+    def __init__(self, it, counts):
+        self._it = it
+        self._counts = counts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._it.close()
+
+    def __iter__(self):
+        counts = self._counts
+        for entry in self._it:
+            yield _DirEntryCounter(entry, counts)
+
+    def close(self):
+        self._it.close()
+
+
+class _OSCounter(object):
+    """
+    Stands in for the os module in records.py, counting the directory
+    listings and stats it makes, and passing everything else through.
+    """
+
+    def __init__(self):
+        self.counts = {'scandir': 0, 'stat': 0}
+
+    def __getattr__(self, name):
+        return getattr(os, name)
+
+    def scandir(self, path='.'):
+        self.counts['scandir'] += 1
+        return _ScandirCounter(os.scandir(path), self.counts)
+
+    def stat(self, *args, **kwargs):
+        self.counts['stat'] += 1
+        return os.stat(*args, **kwargs)
+
+    def lstat(self, *args, **kwargs):
+        self.counts['stat'] += 1
+        return os.lstat(*args, **kwargs)
+
+
+def count_syscalls(root, blacklist=BENCH_BLACKLIST):
+    """
+    Return a dict of the directory listings and stats made by one scan of
+    root with iter_file_records(), counted outside of any timing. A
+    records.ScanStats times the scan's phases.
+
+    On Linux each listing is at least an open, two getdents and a close
+    (more getdents for large directories) and each stat is one call, so
+    'syscalls' counts a listing as 4. File types come from the directory
+    listing, so is_dir() and is_symlink() cost no calls.
+
+    :param root: Directory to scan.
+    :param blacklist: Optional. Patterns to exclude.
+    :returns: a dict of 'scandir', 'stat', 'files' and 'syscalls' counts,
+              and the scan's 'phases'.
+    """
+    counter = _OSCounter()
+    stats = records.ScanStats()
+    records.os = counter
+    try:
+        files = sum(1 for _ in records.iter_file_records(root, blacklist,
+                                                         stats=stats))
+    finally:
+        records.os = os
+    counts = dict(counter.counts, files=files)
+    counts['syscalls'] = 4 * counts['scandir'] + counts['stat']
+    counts['phases'] = stats.phases
+    return counts
+
+
+def _peak_rss_kib():
+    """Return the peak resident memory of this process in KiB, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # Bytes on Mac
+
+
+def _time(func, repeat):
+    """
+    Call func repeat times.
+
+    :returns: a tuple of (the last result, list of wall times in seconds).
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        result = None  # Free the last result before the next run
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def run(root, days=365, flag='m', workers=1, repeat=3, out_dir=None):
+    """
+    Time each stage of the scan pipeline on the tree under root.
+
+    :param root: Directory of a tree from make_tree().
+    :param days: Optional. Threshold of the filter stage, in days.
+    :param flag: Optional. 'm' filters on last modified, 'a' on last
+                 accessed.
+    :param workers: Optional. Threads of the listing and walking stages.
+    :param repeat: Optional. Runs of each stage, the best is reported.
+    :param out_dir: Optional. Directory the report stage writes to.
+                    Defaults to a temporary directory.
+    :returns: a dict of 'stages', each a dict of 'seconds' (every run),
+              'best', 'files' and 'files_per_sec', of 'syscalls' from
+              count_syscalls(), and the run's 'peak_rss_kib'.
+    """
+    blacklist = records.Blacklist(BENCH_BLACKLIST)
+    results = {}
+    store = matches = None
+
+    def add(stage, times, files):
+        best = min(times)
+        results[stage] = {'seconds': times, 'best': best, 'files': files,
+                          'files_per_sec': files / best if best else None}
+
+    paths, times = _time(lambda: records.get_file_paths(root, blacklist,
+                                                        workers=workers),
+                         repeat)
+    add('get_file_paths', times, len(paths))
+    del paths
+
+    store, times = _time(lambda: records.ScanStore(records.iter_file_records(
+        root, blacklist, workers=workers)), repeat)
+    add('scan', times, len(store))
+
+    matches, times = _time(lambda: records.get_cutoff_files(store, days,
+                                                            flag), repeat)
+    add('get_cutoff_files', times, len(store))
+
+    tmp = tempfile.mkdtemp(prefix='records_bench_') if out_dir is None \
+        else out_dir
+    try:
+        name = os.path.join(tmp, 'bench_report')
+        _, times = _time(lambda: records.write_to_file(matches, name, 'csv',
+                                                       flag), repeat)
+        add('write_to_file', times, len(matches))
+    finally:
+        if out_dir is None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return {'stages': results, 'syscalls': count_syscalls(root, blacklist),
+            'matches': len(matches), 'peak_rss_kib': _peak_rss_kib()}
+
+
+def compare(new, old):
+    """
+    Yield lines comparing the best stage times of two benchmark results.
+
+    :param new: A result dict from main() or its JSON file.
+    :param old: An earlier result dict to compare against.
+    :returns: a generator of lines of text.
+    """
+    yield '{:<18}{:>12}{:>12}{:>10}\n'.format('Stage', 'Old (s)', 'New (s)',
+                                             'Speedup')
+    for stage, result in new['stages'].items():
+        before = old['stages'].get(stage)
+        if before is None:
+            continue
+        speedup = before['best'] / result['best'] if result['best'] else 0
+        yield '{:<18}{:>12.4f}{:>12.4f}{:>9.2f}x\n'.format(
+            stage, before['best'], result['best'], speedup)
+    if new['tree'] != old['tree']:
+        yield 'Warning: the trees differ, so the times are not comparable\n'
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='records_bench.py',
+        description='Benchmark the scan pipeline of records.py on a '
+                    'generated directory tree.')
+    parser.add_argument('--dir', help='directory of the generated tree, '
+                        'reused by later runs with the same tree options. '
+                        'Default is a temporary directory, removed after')
+    tree = parser.add_argument_group('tree options')
+    tree.add_argument('--depth', type=int, default=TREE_DEFAULTS['depth'],
+                      help='levels of subdirectories (default: %(default)s)')
+    tree.add_argument('--fanout', type=int, default=TREE_DEFAULTS['fanout'],
+                      help='subdirectories per directory '
+                           '(default: %(default)s)')
+    tree.add_argument('--files', type=int, default=TREE_DEFAULTS['files'],
+                      help='files per directory (default: %(default)s)')
+    tree.add_argument('--hidden', type=float,
+                      default=TREE_DEFAULTS['hidden'],
+                      help='fraction of hidden names (default: %(default)s)')
+    tree.add_argument('--blacklisted', type=float,
+                      default=TREE_DEFAULTS['blacklisted'],
+                      help='fraction of blacklisted names '
+                           '(default: %(default)s)')
+    tree.add_argument('--mean-age', type=float,
+                      default=TREE_DEFAULTS['mean_age'],
+                      help='mean file age in days (default: %(default)s)')
+    tree.add_argument('--max-age', type=float,
+                      default=TREE_DEFAULTS['max_age'],
+                      help='oldest file age in days (default: %(default)s)')
+    tree.add_argument('--seed', type=int, default=TREE_DEFAULTS['seed'],
+                      help='random seed (default: %(default)s)')
+    parser.add_argument('-d', '--days', type=int, default=365,
+                        help='threshold of the filter stage '
+                             '(default: %(default)s)')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='threads listing directories '
+                             '(default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs of each stage, the best is reported '
+                             '(default: %(default)s)')
+    parser.add_argument('-o', '--output',
+                        help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare with the results of an earlier run')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Run the benchmark from the command line.
+
+    :param argv: Optional. Arguments, defaults to sys.argv[1:].
+    :returns: an exit status, 0 on success.
+    """
+    args = _parse_args(argv)
+    options = {'depth': args.depth, 'fanout': args.fanout,
+               'files': args.files, 'hidden': args.hidden,
+               'blacklisted': args.blacklisted, 'mean_age': args.mean_age,
+               'max_age': args.max_age, 'seed': args.seed}
+
+    root = args.dir or tempfile.mkdtemp(prefix='records_bench_tree_')
+    try:
+        start = time.perf_counter()
+        tree = get_tree(root, **options)
+        print('Tree: {dirs} directories, {files} files ({visible} visible) '
+              'in {0:.1f}s'.format(time.perf_counter() - start, **tree),
+              file=sys.stderr)
+        result = run(root, args.days, workers=args.workers,
+                     repeat=args.repeat)
+    except IOError as e:
+        print('records_bench.py: {}'.format(e), file=sys.stderr)
+        return 2
+    finally:
+        if not args.dir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    result.update(tree=tree, days=args.days, workers=args.workers,
+                  repeat=args.repeat, python=platform.python_version(),
+                  platform=platform.platform(),
+                  date=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    if result['stages']['scan']['files'] != tree['visible']:
+        print('Warning: scan found {} files, expected {}'.format(
+            result['stages']['scan']['files'], tree['visible']),
+            file=sys.stderr)
+
+    for stage, r in result['stages'].items():
+        print('{:<18}{:>10.4f}s{:>14,.0f} files/s'.format(
+            stage, r['best'], r['files_per_sec'] or 0))
+    calls = result['syscalls']
+    print('{:.2f} syscalls per file ({} listings, {} stats), peak RSS '
+          '{} KiB'.format(calls['syscalls'] / max(calls['files'], 1),
+                          calls['scandir'], calls['stat'],
+                          result['peak_rss_kib']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            sys.stdout.writelines(compare(result, json.load(f)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
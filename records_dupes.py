@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:title: records_dupes.py
+:author: Craig MacEachern
+
+Find duplicate files among the results of a records.py scan, e.g. the
+stale files about to be archived.
+
+Files are narrowed down in three passes, so most files are never read:
+
+1. Files are grouped by size, a file with a unique size has no duplicate.
+2. Files of the same size are grouped by a hash of their first and last
+   64 KiB.
+3. Only files still sharing a group are hashed in full, in chunks, by a
+   pool of threads.
+
+Hashes can be kept in a HashCache, an SQLite database keyed by (device,
+inode, size, modified time), so a rerun does not read unchanged files
+again. Example:
+
+    stale = records.iter_cutoff_files(records.iter_file_records(path), 365)
+    with HashCache('hashes.db') as cache:
+        for group in find_duplicates(stale, cache):
+            print(group.size, group.paths)
+
+##### KNOWN BUGS/ISSUES ##########
+* Hard links to the same file are one file, so they are never reported as
+duplicates of each other, and only one of their paths is reported.
+* A file changed between being stat'ed and hashed may be hashed with the
+old modified time in the cache key. It is hashed again once its modified
+time changes again, or the cache is deleted.
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+
+import records
+
+# Files with the same size and contents. digest is the hex hash of the
+# contents, paths a sorted list of the files, one path per hard linked file.
+DuplicateGroup = namedtuple('DuplicateGroup', ['size', 'digest', 'paths'])
+
+# Bytes read from each end of a file for the partial hash.
+EDGE_SIZE = 64 * 1024
+
+# Bytes read at a time for the full hash.
+CHUNK_SIZE = 1024 * 1024
+
+# Hashes cached between commits, so a run that is killed keeps most of them.
+COMMIT_EVERY = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    partial TEXT,
+    full TEXT,
+    PRIMARY KEY (dev, inode, size, mtime)
+);
+"""
+
+
+def _new_hash():
+    """Return a new hash object, fast on 64 bit machines."""
+    return hashlib.blake2b(digest_size=20)
+
+
+def _hash_edges(path, size):
+    """
+    Return the hex hash of the first and last EDGE_SIZE bytes of path.
+    A file of up to two EDGE_SIZEs is hashed whole.
+    """
+    h = _new_hash()
+    with open(path, 'rb') as f:
+        if size <= 2 * EDGE_SIZE:
+            h.update(f.read())
+        else:
+            h.update(f.read(EDGE_SIZE))
+            f.seek(-EDGE_SIZE, os.SEEK_END)
+            h.update(f.read(EDGE_SIZE))
+    return h.hexdigest()
+
+
+def _hash_full(path, size=None, chunk_size=CHUNK_SIZE):
+    """Return the hex hash of the whole contents of path."""
+    h = _new_hash()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])  # hashlib releases the GIL for big buffers
+    return h.hexdigest()
+
+
+class HashCache(object):
+    """
+    An on-disk cache of file hashes, keyed by (device, inode, size,
+    modified time in nanoseconds), so a file is only read again once it
+    changes. Hashes are committed every commit_every puts, so a run that
+    fails or is killed part way keeps what it hashed.
+    """
+
+    def __init__(self, db_path, commit_every=COMMIT_EVERY):
+        """
+        Open, or create, the cache stored in the file db_path.
+
+        :param db_path: Path of the SQLite database file.
+        :param commit_every: Optional. Hashes cached between commits.
+        :raises IOError: if the database can not be opened.
+        """
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        try:
+            self._conn = sqlite3.connect(db_path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            raise IOError("Could not open hash cache {}: {}".format(db_path,
+                                                                    e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Save and close the cache."""
+        self._conn.commit()
+        self._conn.close()
+
+    def get(self, key):
+        """
+        Return a tuple of the (partial, full) hashes cached for key, either
+        may be None.
+
+        :param key: A tuple of (dev, inode, size, mtime_ns).
+        """
+        row = self._conn.execute("SELECT partial, full FROM hashes WHERE "
+                                 "dev = ? AND inode = ? AND size = ? AND "
+                                 "mtime = ?", key).fetchone()
+        return row if row is not None else (None, None)
+
+    def put(self, key, partial=None, full=None):
+        """
+        Cache the hashes of key, keeping any already cached that are not
+        given.
+        """
+        self._conn.execute(
+            "INSERT INTO hashes VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (dev, inode, size, mtime) DO UPDATE SET "
+            "partial = coalesce(excluded.partial, partial), "
+            "full = coalesce(excluded.full, full)",
+            tuple(key) + (partial, full))
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def __len__(self):
+        """Return the number of files cached."""
+        return self._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+
+class _File(object):
+    """One file being compared."""
+
+    __slots__ = ('key', 'path', 'size', 'partial', 'full')
+
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path
+        self.size = key[2]
+        self.partial = None
+        self.full = None
+
+
+def _hash_all(files, attr, func, cache, executor, on_error):
+    """
+    Set attribute attr ('partial' or 'full') of each _File in files to
+    func(path, size), taking it from cache where possible and otherwise
+    computing it on executor. Files that can not be read are left out.
+
+    :returns: the list of files hashed.
+    """
+    pending = []
+    done = []
+    for f in files:
+        cached = cache.get(f.key)[0 if attr == 'partial' else 1] \
+            if cache is not None else None
+        if cached is not None:
+            setattr(f, attr, cached)
+            done.append(f)
+        else:
+            pending.append((f, executor.submit(func, f.path, f.size)))
+
+    for f, future in pending:
+        try:
+            digest = future.result()
+        except OSError as e:
+            if on_error is not None:
+                on_error(f.path, e)
+            continue
+        setattr(f, attr, digest)
+        if cache is not None:
+            cache.put(f.key, **{attr: digest})
+        done.append(f)
+    return done
+
+
+def _groups(files, key):
+    """Yield the lists of files sharing a key with at least one other."""
+    groups = defaultdict(list)
+    for f in files:
+        groups[key(f)].append(f)
+    return (group for group in groups.values() if len(group) > 1)
+
+
+def find_duplicates(files, cache=None, workers=4, min_size=1,
+                    on_error=None):
+    """
+    Return the groups of duplicate files among files.
+
+    :param files: An iterable of FileRecords, e.g. from
+                  records.iter_cutoff_files(), or a records.ScanStore.
+    :param cache: Optional. A HashCache to take hashes from and save them
+                  to. Default is None, hash everything.
+    :param workers: Optional. Number of threads reading and hashing files.
+    :param min_size: Optional. Smallest file size, in bytes, to compare.
+                     Default 1 leaves out empty files.
+    :param on_error: Optional. A callable taking a path and an OSError,
+                     called for each file that can not be read.
+    :returns: a list of DuplicateGroups, the most bytes wasted first.
+    """
+    by_size = defaultdict(list)
+    for rec in files:
+        if rec.size >= min_size:
+            by_size[rec.size].append(rec.path)
+
+    # Stat the files that share a size, for the cache key and hard links
+    candidates = []
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        inodes = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                if on_error is not None:
+                    on_error(path, e)
+                continue
+            key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+            if key[:2] not in inodes:  # Skip other links to the same file
+                inodes[key[:2]] = _File(key, path)
+        if len(inodes) > 1:
+            candidates.extend(inodes.values())
+    del by_size
+
+    # Hash every candidate at once, so the threads are kept busy however
+    # the files are spread over sizes
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashed = _hash_all(candidates, 'partial', _hash_edges, cache,
+                           executor, on_error)
+        need_full = []
+        for same in _groups(hashed, attrgetter('size', 'partial')):
+            if same[0].size <= 2 * EDGE_SIZE:
+                # The partial hash already covered the whole file
+                for f in same:
+                    f.full = f.partial
+            else:
+                need_full.extend(same)
+        _hash_all(need_full, 'full', _hash_full, cache, executor, on_error)
+
+    duplicates = [DuplicateGroup(same[0].size, same[0].full,
+                                 sorted(f.path for f in same))
+                  for same in _groups(hashed, attrgetter('size', 'full'))
+                  if same[0].full is not None]
+    duplicates.sort(key=lambda g: (-g.size * (len(g.paths) - 1), g.paths))
+    return duplicates
+
+
+def iter_duplicate_lines(groups, style='txt'):
+    """
+    Yield the report lines of groups, one line per file, with a header.
+
+    :param groups: An iterable of DuplicateGroups.
+    :param style: Optional. Plain text with tabs ('txt') or comma separated
+                  values ('csv').
+    :returns: a generator of newline terminated strings.
+    """
+    return records._iter_csv_lines(
+        ("Group", "Size", "Hash", "Path"),
+        ((n, group.size, group.digest, path)
+         for n, group in enumerate(groups, 1) for path in group.paths),
+        style)
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="records_dupes.py",
+        description="Report duplicate files among the files older than "
+                    "some days.")
+    parser.add_argument("roots", nargs="+", metavar="DIRECTORY",
+                        help="Directory to scan.")
+    parser.add_argument("-d", "--days", type=int, default=90,
+                        help="Only compare files older than this many days "
+                             "(default: %(default)s).")
+    parser.add_argument("-l", "--last", choices=("modified", "accessed"),
+                        default="modified",
+                        help="Which file time to compare "
+                             "(default: %(default)s).")
+    parser.add_argument("-b", "--blacklist", metavar="FILE",
+                        help="File of names, globs or paths to skip.")
+    parser.add_argument("--hidden", action="store_true",
+                        help="Include hidden files and directories.")
+    parser.add_argument("-f", "--format", choices=("txt", "csv"),
+                        default="csv",
+                        help="Report format (default: %(default)s).")
+    parser.add_argument("--cache", metavar="FILE",
+                        help="SQLite file to keep hashes in between runs.")
+    parser.add_argument("-j", "--workers", type=int, default=4,
+                        help="Threads hashing files (default: %(default)s).")
+    parser.add_argument("--min-size", type=int, default=1,
+                        help="Smallest file size to compare, in bytes "
+                             "(default: %(default)s).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Print a duplicate files report from the command line, e.g.
+
+        python records_dupes.py -d 365 --cache hashes.db /srv/share
+
+    :param argv: Optional. A list of arguments, defaults to sys.argv[1:].
+    :returns: 0 if duplicates were found, 1 if none were, 2 on errors.
+    """
+    args = _parse_args(argv)
+    flag = 'a' if args.last == "accessed" else 'm'
+    try:
+        blacklist = records.get_blacklist(args.blacklist)
+        stale = records.ScanStore()
+        for root in args.roots:
+            stale.extend(records.iter_cutoff_files(
+                records.iter_file_records(root, blacklist, args.hidden),
+                args.days, flag))
+        cache = HashCache(args.cache) if args.cache else None
+        try:
+            groups = find_duplicates(stale, cache, args.workers,
+                                     args.min_size)
+        finally:
+            if cache is not None:
+                cache.close()
+    except IOError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 2
+
+    sys.stdout.writelines(iter_duplicate_lines(groups, args.format))
+    wasted = sum(g.size * (len(g.paths) - 1) for g in groups)
+    print("{} groups of duplicates, {} bytes in extra copies".format(
+        len(groups), wasted), file=sys.stderr)
+    return 0 if groups else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:title: records_index.py
+:author: Craig MacEachern
+
+A persistent scan index for records.py, stored in an SQLite database.
+
+The index keeps the stat data of every file and the last modified time of
+every directory it has seen. A directory's modified time changes whenever
+an entry is added, removed or renamed in it, so on later scans directories
+whose modified time is unchanged are not listed again and their files are
+not re-stat'ed. "Older than N days" queries are answered from the index
+using an SQL index on the time columns.
+
+Example:
+
+    with ScanIndex('scan_index.db') as index:
+        index.update('/srv/share', blacklist)
+        stale = list(index.older_than(90))
+
+##### KNOWN BUGS/ISSUES ##########
+* Editing a file in place does not change its directory's modified time,
+so such edits are only seen when the directory changes for another reason,
+on a full update, or with restat_files=True.
+* Reading a file does not change its directory either, so last accessed
+times in the index can be behind those on disk.
+"""
+import json
+import os
+import sqlite3
+import time
+from datetime import timedelta
+
+import records
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    path TEXT PRIMARY KEY,
+    options TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    atime REAL NOT NULL,
+    ctime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+CREATE INDEX IF NOT EXISTS files_atime ON files (atime);
+"""
+
+
+def _subtree_range(path):
+    """
+    Return a tuple of (low, high) strings bounding every path below path,
+    so a subtree can be selected with an indexed range instead of LIKE.
+    """
+    prefix = path if path.endswith(os.sep) else path + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+class ScanIndex(object):
+    """
+    An on-disk index of file stat data, updated incrementally.
+    """
+
+    def __init__(self, db_path):
+        """
+        Open, or create, the index stored in the file db_path.
+
+        :param db_path: Path of the SQLite database file.
+        :raises IOError: if the database can not be opened.
+        """
+        try:
+            self._conn = sqlite3.connect(db_path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            raise IOError("Could not open scan index {}: {}".format(db_path,
+                                                                    e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the database connection."""
+        self._conn.close()
+
+    def _delete_subtree(self, path):
+        """Remove path and everything below it from the index."""
+        low, high = _subtree_range(path)
+        self._conn.execute("DELETE FROM files WHERE dir = ? OR "
+                           "(dir >= ? AND dir < ?)", (path, low, high))
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR "
+                           "(path >= ? AND path < ?)", (path, low, high))
+
+    def _children(self, path):
+        """Return a list of the indexed subdirectories of path."""
+        return [row[0] for row in self._conn.execute(
+            "SELECT path FROM dirs WHERE parent = ?", (path,))]
+
+    def _restat(self, path):
+        """
+        Re-stat the indexed files in path without listing it.
+
+        :returns: the number of files stat'ed.
+        """
+        changed = []
+        gone = []
+        rows = self._conn.execute("SELECT path, mtime, atime FROM files "
+                                  "WHERE dir = ?", (path,)).fetchall()
+        for name, mtime, atime in rows:
+            try:
+                st = os.stat(name)
+            except OSError:
+                gone.append((name,))
+                continue
+            if st.st_mtime != mtime or st.st_atime != atime:
+                changed.append((st.st_size, st.st_mtime, st.st_atime,
+                                st.st_ctime, name))
+        self._conn.executemany("DELETE FROM files WHERE path = ?", gone)
+        self._conn.executemany("UPDATE files SET size = ?, mtime = ?, "
+                               "atime = ?, ctime = ? WHERE path = ?", changed)
+        return len(rows)
+
+    def update(self, directory='.', blacklist=None, get_hidden=False,
+               full=False, restat_files=False):
+        """
+        Bring the index up to date with the tree under directory.
+
+        Directories whose modified time has not changed since the last
+        update are not listed, only their subdirectories are checked.
+        Changed directories are listed and their files re-stat'ed.
+
+        :param directory: Optional path name of a directory. Stored as an
+                          absolute path. Defaults to current directory.
+        :param blacklist: Optional Blacklist, or list of patterns, to
+                          exclude in the search. Default is None.
+        :param get_hidden: Optional. Default is False. If True include hidden
+                           files and/or directories in the search.
+        :param full: Optional. Default is False. If True list and re-stat
+                     everything under directory again.
+        :param restat_files: Optional. Default is False. If True re-stat the
+                             files of unchanged directories too, to catch
+                             files edited in place.
+        :returns: a dict of counts of 'dirs_listed', 'dirs_skipped' and
+                  'files_stated'.
+        :raises IOError: if given directory parameter does not exist.
+        """
+        records._check_directory(directory)
+
+        top = os.path.abspath(directory)
+        blacklist = records._as_blacklist(blacklist)
+        excluded = blacklist.bind(top)
+        options = json.dumps([sorted(blacklist), bool(get_hidden)])
+        counts = {'dirs_listed': 0, 'dirs_skipped': 0, 'files_stated': 0}
+
+        with self._conn:  # One transaction, rolled back on error
+            row = self._conn.execute("SELECT options FROM roots WHERE "
+                                     "path = ?", (top,)).fetchone()
+            if full or row is None or row[0] != options:
+                # Different blacklist/hidden options index different files,
+                # so force every directory below top to be listed again
+                low, high = _subtree_range(top)
+                self._conn.execute("UPDATE dirs SET mtime = -1 WHERE "
+                                   "path = ? OR (path >= ? AND path < ?)",
+                                   (top, low, high))
+                self._conn.execute("INSERT OR REPLACE INTO roots "
+                                   "VALUES (?, ?)", (top, options))
+
+            stack = [top]
+            while stack:
+                root = stack.pop()
+                try:
+                    # Stat before listing, so a change made while we list
+                    # gives a newer time and is picked up next update
+                    mtime = os.stat(root).st_mtime
+                except OSError:  # Removed since the last update
+                    self._delete_subtree(root)
+                    continue
+
+                row = self._conn.execute("SELECT mtime FROM dirs WHERE "
+                                         "path = ?", (root,)).fetchone()
+                if row is not None and row[0] == mtime:
+                    counts['dirs_skipped'] += 1
+                    if restat_files:
+                        counts['files_stated'] += self._restat(root)
+                    stack.extend(self._children(root))
+                    continue
+
+                counts['dirs_listed'] += 1
+                files, subdirs = records._scan_directory(root, excluded,
+                                                         get_hidden, 0)
+                counts['files_stated'] += len(files)
+
+                for gone in set(self._children(root)).difference(subdirs):
+                    self._delete_subtree(gone)
+                self._conn.execute("DELETE FROM files WHERE dir = ?",
+                                   (root,))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    ((f.path, root, f.size, f.mtime, f.atime, f.ctime)
+                     for f in files))
+                self._conn.execute("INSERT OR REPLACE INTO dirs "
+                                   "VALUES (?, ?, ?)",
+                                   (root, os.path.dirname(root), mtime))
+                stack.extend(reversed(subdirs))
+
+        return counts
+
+    def older_than(self, days, flag='m', directory=None):
+        """
+        Yield the indexed FileRecords last modified (or accessed) more than
+        days ago, oldest first, without touching the filesystem.
+
+        :param days: Threshold for the number of days.
+        :param flag: Optional. Default 'm' means file attribute last
+                     modified. Also accepts 'a' for last accessed.
+        :param directory: Optional. Only return files below this directory.
+                          Default is None, every indexed file.
+        :returns: a generator of FileRecords with absolute paths.
+        """
+        column = 'atime' if flag == 'a' else 'mtime'
+        cutoff = time.time() - timedelta(days).total_seconds()
+
+        sql = ("SELECT path, size, mtime, atime, ctime FROM files "
+               "WHERE {0} < ?".format(column))
+        params = [cutoff]
+        if directory is not None:
+            sql += " AND path >= ? AND path < ?"
+            params.extend(_subtree_range(os.path.abspath(directory)))
+        sql += " ORDER BY {0}".format(column)
+
+        for row in self._conn.execute(sql, params):
+            yield records.FileRecord(*row)
+
+    def __len__(self):
+        """Return the number of indexed files."""
+        return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
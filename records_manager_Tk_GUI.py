@@ -10,8 +10,12 @@ A tkinter records management GUI application, using records.py module backend.
 """
 import argparse
 import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
 import tkinter as tk
-import tkinter.scrolledtext as tkst
 import tkinter.filedialog as tkfd
 import tkinter.messagebox as tkmb
 import tkinter.ttk as ttk
@@ -20,6 +24,391 @@ import records
 
 VERSION = "1.3.0"
 
+# How often the GUI checks on a running scan, and how often the scan
+# reports its progress, in milliseconds.
+POLL_MS = 100
+PROGRESS_MS = 250
+# How often a running scan logs its throughput, in milliseconds.
+THROUGHPUT_MS = 5000
+# Scan results kept for filtering again without a walk: at most this many
+# files in all, each scan for at most this many seconds.
+CACHE_MAX_FILES = 2000000
+CACHE_MAX_AGE = 30 * 60
+
+
+class StoreRows(object):
+    """
+    Rows of a VirtualTable read from a records.ScanStore of scan results,
+    with path, date and size columns.
+    """
+
+    columns = (("path", "Full file path", 480),
+               ("date", "Year-Month-Date", 110),
+               ("size", "Size (bytes)", 110))
+
+    def __init__(self, store, flag='m'):
+        """
+        :param store: A records.ScanStore. It may grow afterwards, see
+                      VirtualTable.refresh().
+        :param flag: Optional. Date column shows last modified ('m') or
+                     last accessed ('a') time.
+        """
+        self.store = store
+        self.times = store.atime if flag == 'a' else store.mtime
+
+    def __len__(self):
+        return len(self.store)
+
+    def row(self, i):
+        """Return the display values of row i."""
+        date = datetime.fromtimestamp(self.times[i]).strftime("%Y-%m-%d")
+        return self.store.path(i), date, self.store.size[i]
+
+    def key(self, column):
+        """Return a function of a row number giving its sort key."""
+        if column == "date":
+            return self.times.__getitem__
+        if column == "size":
+            return self.store.size.__getitem__
+        return self.store.path
+
+    def text(self, i):
+        """Return the text of row i that the filter box searches."""
+        return self.store.path(i)
+
+
+class TableRows(object):
+    """Rows of a VirtualTable from a small list of tuples."""
+
+    def __init__(self, columns, rows):
+        """
+        :param columns: A sequence of (id, heading, width) tuples.
+        :param rows: A list of tuples, one value per column.
+        """
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def row(self, i):
+        """Return the display values of row i."""
+        return self.rows[i]
+
+    def key(self, column):
+        """Return a function of a row number giving its sort key."""
+        n = [c[0] for c in self.columns].index(column)
+        return lambda i: self.rows[i][n]
+
+    def text(self, i):
+        """Return the text of row i that the filter box searches."""
+        return " ".join(str(v) for v in self.rows[i])
+
+
+class RollupRows(object):
+    """
+    Rows of a VirtualTable read from a records.DirectoryRollup, one per
+    directory with its stale files and bytes.
+    """
+
+    columns = (("path", "Directory", 480),
+               ("files", "Stale files", 110),
+               ("bytes", "Stale bytes", 110))
+
+    def __init__(self, rollup):
+        """:param rollup: A finished records.DirectoryRollup."""
+        self.rollup = rollup
+
+    def __len__(self):
+        return len(self.rollup)
+
+    def row(self, i):
+        """Return the display values of row i."""
+        return self.rollup.entry(i)
+
+    def key(self, column):
+        """Return a function of a row number giving its sort key."""
+        if column == "files":
+            return self.rollup.total_files.__getitem__
+        if column == "bytes":
+            return self.rollup.total_bytes.__getitem__
+        return self.rollup.paths.__getitem__
+
+    def text(self, i):
+        """Return the text of row i that the filter box searches."""
+        return self.rollup.paths[i]
+
+
+class RollupTree(tk.Toplevel):
+    """
+    A window showing a records.DirectoryRollup as a directory tree, the
+    heaviest subdirectories first. Subdirectories are only added when their
+    parent is opened, so large trees open instantly.
+    """
+
+    def __init__(self, rollup, master=None):
+        """
+        :param rollup: A finished records.DirectoryRollup.
+        :param master: Optional. Parent of this window.
+        """
+        tk.Toplevel.__init__(self, master)
+        self.title("Stale data by directory")
+        self.rollup = rollup
+        self._dir_ids = {}  # Treeview item of each directory id
+        self._loaded = set()
+
+        self.tree = ttk.Treeview(self, columns=("files", "bytes"), height=25)
+        self.tree.heading("#0", text="Directory")
+        self.tree.heading("files", text="Stale files")
+        self.tree.heading("bytes", text="Stale bytes")
+        self.tree.column("#0", width=420)
+        self.tree.column("files", width=110, anchor=tk.E)
+        self.tree.column("bytes", width=130, anchor=tk.E)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL,
+                                       command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.scrollbar.set)
+        self.tree.grid(column=0, row=0, sticky=tk.NSEW)
+        self.scrollbar.grid(column=1, row=0, sticky=tk.NS)
+
+        self.tree.bind("<<TreeviewOpen>>", self._on_open)
+        self._insert_children("", rollup.roots(), full_path=True)
+
+    def _insert_children(self, item, ids, full_path=False):
+        """Add directories ids under Treeview item, heaviest first."""
+        rollup = self.rollup
+        for i in sorted(ids, key=rollup.total_bytes.__getitem__,
+                        reverse=True):
+            path = rollup.paths[i]
+            name = path if full_path else os.path.basename(path)
+            child = self.tree.insert(item, tk.END, text=name,
+                                     values=(rollup.total_files[i],
+                                             rollup.total_bytes[i]))
+            self._dir_ids[child] = i
+            if rollup.children(i):
+                # Placeholder, so it can be opened before it is loaded
+                self.tree.insert(child, tk.END, text="...")
+
+    def _on_open(self, event):
+        item = self.tree.focus()
+        if item in self._loaded or item not in self._dir_ids:
+            return
+        self._loaded.add(item)
+        self.tree.delete(*self.tree.get_children(item))
+        self._insert_children(item, self.rollup.children(self._dir_ids[item]))
+
+
+class ScanCache(object):
+    """
+    The records.ScanStores of recent complete scans, keyed by root,
+    blacklist and hidden setting, so a scan with only a different days or
+    file last option is filtered in memory instead of walking the disk
+    again. Holds at most max_files files in all, dropping the least
+    recently used scans first, and forgets scans older than max_age.
+    """
+
+    def __init__(self, max_files=CACHE_MAX_FILES, max_age=CACHE_MAX_AGE):
+        """
+        :param max_files: Optional. Most files kept, over all scans.
+        :param max_age: Optional. Seconds a scan is used for.
+        """
+        self.max_files = max_files
+        self.max_age = max_age
+        self._scans = {}  # key: (store, time scanned), least recent first
+
+    @staticmethod
+    def key(root, blacklist, hidden):
+        """Return the cache key of a scan of root with these options."""
+        return os.path.abspath(root), tuple(blacklist), bool(hidden)
+
+    def get(self, key):
+        """
+        Return a tuple of the (store, time scanned) of key, or None if it
+        is not cached or too old.
+        """
+        entry = self._scans.pop(key, None)
+        if entry is None or time.time() - entry[1] > self.max_age:
+            return None
+        self._scans[key] = entry  # Now the most recently used
+        return entry
+
+    def put(self, key, store):
+        """Keep the records.ScanStore of a complete scan of key."""
+        self._scans.pop(key, None)
+        if len(store) > self.max_files:
+            return  # Would push out everything else and still not fit
+        self._scans[key] = (store, time.time())
+        total = sum(len(entry[0]) for entry in self._scans.values())
+        while total > self.max_files:
+            oldest = next(iter(self._scans))
+            total -= len(self._scans.pop(oldest)[0])
+
+    def discard(self, key):
+        """Forget the scan of key, if cached."""
+        self._scans.pop(key, None)
+
+
+class VirtualTable(ttk.Frame):
+    """
+    A table which only creates Tk items for the rows currently visible, so
+    it shows a million rows as quickly as twenty. Rows come from a source
+    object such as StoreRows, which formats a row when it scrolls into
+    view. Click a column heading to sort by it, click again to reverse.
+    The filter box shows only rows containing its text.
+    """
+
+    def __init__(self, master=None, height=20):
+        """
+        :param master: Optional. Parent of this Frame.
+        :param height: Optional. Number of rows visible at once.
+        """
+        ttk.Frame.__init__(self, master)
+        self.height = height
+        self._source = None
+        self._view = range(0)  # Row numbers of the source, in display order
+        self._top = 0  # Position in _view of the first visible row
+        self._sort = None  # (column, reverse) or None
+        self._seen = 0  # Rows of the source already in _view
+        self._filter_id = None
+
+        self.tree = ttk.Treeview(self, show="headings", height=height,
+                                 selectmode="browse")
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL,
+                                       command=self._on_scroll)
+        self.filter_lbl = ttk.Label(self, text="Filter")
+        self.filter_value = tk.StringVar()
+        self.filter_entry = ttk.Entry(self, width=50,
+                                      textvariable=self.filter_value)
+        self.count_value = tk.StringVar()
+        self.count_lbl = ttk.Label(self, textvariable=self.count_value)
+
+        self.tree.grid(column=0, row=0, columnspan=3, sticky=tk.NSEW)
+        self.scrollbar.grid(column=3, row=0, sticky=tk.NS)
+        self.filter_lbl.grid(column=0, row=1, sticky=tk.W)
+        self.filter_entry.grid(column=1, row=1, sticky=tk.W)
+        self.count_lbl.grid(column=2, row=1, sticky=tk.E)
+
+        # The Treeview only ever holds one screen of rows, so scroll it
+        # ourselves
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self._scroll_to(self._top - 3))
+        self.tree.bind("<Button-5>", lambda e: self._scroll_to(self._top + 3))
+        self.filter_value.trace_add("write", self._on_filter_changed)
+
+    def set_source(self, source):
+        """
+        Show the rows of source, resetting sort order and scroll position.
+
+        :param source: An object like StoreRows, with columns, __len__(),
+                       row(i), key(column) and text(i).
+        """
+        self._source = source
+        self._sort = None
+        ids = [c[0] for c in source.columns]
+        self.tree.configure(columns=ids, displaycolumns="#all")
+        for column, heading, width in source.columns:
+            self.tree.heading(column, text=heading,
+                              command=lambda c=column: self.sort_by(c))
+            self.tree.column(column, width=width, stretch=(column == ids[0]))
+        self._rebuild()
+
+    def clear(self):
+        """Remove all rows."""
+        self.set_source(TableRows((), []))
+
+    def refresh(self):
+        """
+        Show rows added to the end of the source since the last call,
+        filtered but not sorted, and keep the scroll position.
+        """
+        if self._source is None:
+            return
+        end = len(self._source)
+        if isinstance(self._view, range):
+            self._view = range(end)
+        else:
+            start = self._seen
+            self._view.extend(self._filtered(range(start, end)))
+        self._seen = end
+        self._draw()
+
+    def sort_by(self, column, reverse=None):
+        """
+        Sort the rows by column. By default reverse the order if already
+        sorted ascending by column.
+        """
+        if reverse is None:
+            reverse = self._sort == (column, False)
+        self._sort = (column, reverse)
+        self._rebuild()
+
+    def _filtered(self, rows):
+        """Return the row numbers in rows matching the filter box."""
+        needle = self.filter_value.get()
+        if not needle:
+            return list(rows)
+        text = self._source.text
+        return [i for i in rows if needle in text(i)]
+
+    def _rebuild(self):
+        """Filter and sort the whole source again, then draw the top."""
+        self._seen = len(self._source)
+        if self.filter_value.get() or self._sort is not None:
+            view = self._filtered(range(self._seen))
+            if self._sort is not None:
+                column, reverse = self._sort
+                view.sort(key=self._source.key(column), reverse=reverse)
+            self._view = view
+        else:
+            self._view = range(self._seen)
+        self._top = 0
+        self._draw()
+
+    def _draw(self):
+        """Replace the visible Treeview items with the rows at _top."""
+        self.tree.delete(*self.tree.get_children())
+        total = len(self._view)
+        self._top = max(0, min(self._top, total - self.height))
+        for i in self._view[self._top:self._top + self.height]:
+            self.tree.insert("", tk.END, values=self._source.row(i))
+        if total:
+            self.scrollbar.set(self._top / total,
+                               (self._top + self.height) / total)
+        else:
+            self.scrollbar.set(0, 1)
+        self.count_value.set("{} rows".format(total))
+
+    def _scroll_to(self, top):
+        self._top = top
+        self._draw()
+
+    def _on_scroll(self, *args):
+        """Scrollbar command, e.g. ('moveto', '0.5') or ('scroll', 1, ...)."""
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * len(self._view)))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self.height
+            self._scroll_to(self._top + step)
+
+    def _on_wheel(self, event):
+        # Windows reports multiples of 120 per notch, macOS single steps
+        notches = event.delta
+        if abs(notches) >= 120:
+            notches //= 120
+        self._scroll_to(self._top - 3 * notches)
+
+    def _on_filter_changed(self, *args):
+        """Filter once typing pauses, rather than on every key."""
+        if self._filter_id is not None:
+            self.after_cancel(self._filter_id)
+        self._filter_id = self.after(300, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_id = None
+        if self._source is not None:
+            self._rebuild()
+
 
 class Application(ttk.Frame):
     """
@@ -65,6 +454,17 @@ class Application(ttk.Frame):
         # searching first
         self.results = []
 
+        # A running scan's cancel flag, the queue it reports through and
+        # the matches it has reported so far
+        self._cancel = None
+        self._messages = None
+        self._found = None
+
+        # Complete scans, filtered again in memory when only days or file
+        # last change
+        self.cache = ScanCache()
+        self._cache_key = None
+
     def _create_widgets(self):
         """Create and position the ttk/Tk widgets in the Frame."""
         # ################################################################
@@ -112,6 +512,8 @@ class Application(ttk.Frame):
                                           values=("modified", "accessed"),
                                           textvariable=self.last_value,
                                           width=10, state="readonly")
+        self.last_combobox.bind("<<ComboboxSelected>>",
+                                self._on_threshold_changed)
 
         # Hidden selection
         self.hidden_lbl = ttk.Label(self, text="Include hidden")
@@ -127,16 +529,69 @@ class Application(ttk.Frame):
         # No ttk themed Spinbox, requires Tk 8.5.9+, using classic Tk one
         self.days_entry = ttk.Entry(self, width=10,
                                     textvariable=self.days_value)
+        # Filter a cached scan again straight away
+        self.days_entry.bind("<Return>", self._on_threshold_changed)
 
-        # Results area
-        self.results_text = tkst.ScrolledText(self, borderwidth=5)
+        # Threads entry, more than 1 walks directories concurrently
+        self.workers_lbl = ttk.Label(self, text="Threads")
+        self.workers_value = tk.IntVar()
+        self.workers_value.set(1)
+        self.workers_entry = ttk.Entry(self, width=10,
+                                       textvariable=self.workers_value)
+
+        # Output selection, list the stale files, only the oldest or
+        # largest of them, or an aging report
+        self.output_lbl = ttk.Label(self, text="Output")
+        self.output_value = tk.StringVar()
+        self.output_value.set("files")
+        self.output_combobox = ttk.Combobox(self,
+                                            values=("files", "aging",
+                                                    "rollup") +
+                                            records.TOP_ORDERS,
+                                            textvariable=self.output_value,
+                                            width=10, state="readonly")
+
+        # Number of files kept by the oldest and largest outputs
+        self.top_lbl = ttk.Label(self, text="Top N")
+        self.top_value = tk.IntVar()
+        self.top_value.set(1000)
+        self.top_entry = ttk.Entry(self, width=10,
+                                   textvariable=self.top_value)
+
+        # Open the directory tree of a rollup scan
+        self.tree_btn = ttk.Button(self, width=10, text="Tree",
+                                   command=self.btn_tree_clicked,
+                                   state="disabled")
+
+        # Aging report thresholds, comma separated days
+        self.aging_lbl = ttk.Label(self, text="Aging report days")
+        self.aging_value = tk.StringVar()
+        self.aging_value.set(",".join(str(d) for d in
+                                      records.AGING_THRESHOLDS))
+        self.aging_entry = ttk.Entry(self, width=50,
+                                     textvariable=self.aging_value)
+
+        # Results area, only the visible rows are ever put in Tk
+        self.results_view = VirtualTable(self)
 
         # Save results button
         self.save_file_btn = ttk.Button(self, width=10, text="Save",
                                         command=self.write_results_to_file)
-        # Start Scan button
+        # Start Scan button, filters the last scan again if it is cached
         self.scan_btn = ttk.Button(self, width=10, text="Scan",
                                    command=self.btn_go_scan)
+        # Scan from disk even if cached
+        self.rescan_btn = ttk.Button(self, width=10, text="Rescan",
+                                     command=self.btn_rescan_clicked)
+        # Cancel a running scan
+        self.cancel_btn = ttk.Button(self, width=10, text="Cancel",
+                                     command=self.btn_cancel_clicked,
+                                     state="disabled")
+
+        # Scan progress
+        self.status_value = tk.StringVar()
+        self.status_value.set("Ready")
+        self.status_lbl = ttk.Label(self, textvariable=self.status_value)
 
         # ################################################################
         #           GRID PLACEMENTS
@@ -169,8 +624,24 @@ class Application(ttk.Frame):
         self.hidden_lbl.grid(column=3, row=2)
         self.hidden_combobox.grid(column=3, row=3)
 
-        self.results_text.grid(column=0, row=7, pady=10, columnspan=4)
+        self.workers_lbl.grid(column=3, row=4)
+        self.workers_entry.grid(column=3, row=5)
+
+        self.output_lbl.grid(column=2, row=4)
+        self.output_combobox.grid(column=2, row=5)
+
+        self.top_lbl.grid(column=1, row=2)
+        self.top_entry.grid(column=1, row=3, sticky=tk.W)
 
+        self.aging_lbl.grid(column=0, row=5)
+        self.aging_entry.grid(column=0, row=6)
+        self.tree_btn.grid(column=1, row=6, sticky=tk.W)
+        self.rescan_btn.grid(column=3, row=6)
+
+        self.results_view.grid(column=0, row=7, pady=10, columnspan=4)
+
+        self.status_lbl.grid(column=0, row=8, sticky=tk.W)
+        self.cancel_btn.grid(column=1, row=8, sticky=tk.E)
         self.save_file_btn.grid(column=2, row=8, sticky=tk.E)
         self.scan_btn.grid(column=3, row=8, sticky=tk.E)
 
@@ -185,7 +656,11 @@ class Application(ttk.Frame):
                    'format': self.format_value.get(),
                    'last': self.last_value.get(),
                    'hidden': self.hidden_value.get(),
-                   'days': self.days_entry.get()
+                   'days': self.days_entry.get(),
+                   'workers': self.workers_entry.get(),
+                   'output': self.output_value.get(),
+                   'top': self.top_entry.get(),
+                   'aging_days': self.aging_value.get()
                    }
         return options
 
@@ -201,20 +676,44 @@ class Application(ttk.Frame):
         for k, v in iter(opts.items()):
             if k == "blacklist_file":  # Gotcha: this field CAN be false-y!
                 continue
-            if k == "days":  # Gotcha: make sure we can cast it to int
+            # Gotcha: make sure we can cast it
+            if k in ("days", "workers", "top"):
                 try:
                     self.options[k] = int(v)
                 except ValueError:
                     return False, k
+                if k in ("workers", "top") and self.options[k] < 1:
+                    return False, k
+            if k == "aging_days":  # Gotcha: a comma separated list of ints
+                try:
+                    self.options[k] = [int(d) for d in v.split(",")]
+                except ValueError:
+                    return False, k
             if not v:  # False-y, like empty string or 0
                 return False, k  # Return key that had the False-y state
         return True, None
 
-    def btn_go_scan(self):
+    def last_flag(self):
+        """
+        Return the records.py flag for the "File last" option, 'a' for
+        accessed and 'm' for modified.
+        """
+        return 'a' if self.options["last"] == "accessed" else 'm'
+
+    def get_hidden(self):
+        """Return True if the "Include hidden" option is set to yes."""
+        return self.options["hidden"] == "yes"
+
+    def btn_go_scan(self, rescan=False):
         """
         Uses records.py module to search and ouputs results if any to
-        the tkst widget area.
+        the results table. A cached scan of the same path, blacklist and
+        hidden option is filtered again in memory instead.
+
+        :param rescan: Optional. True to scan from disk even if cached.
         """
+        if self._cancel is not None:  # Already scanning
+            return
         self.options = self.collect_options()
 
         self.log.debug("Using options: {}".format(self.options))
@@ -241,24 +740,45 @@ class Application(ttk.Frame):
             self.log.debug("Using these blacklist values: ")
             self.log.debug(self.blacklist)
 
-            # Gather all the files using our module
-            self.all_files = records.get_file_paths(self.options["scan_path"],
-                                                    self.blacklist,
-                                                    self.options["hidden"]
-                                                    )
-            self.log.debug("Found all these files in the given path: \n")
-            self.log.debug(self.all_files)
-
-            # Filter all found files by our criteria
-            self.results = records.get_cutoff_files(self.all_files,
-                                                    self.options["days"],
-                                                    self.options["last"]
-                                                    )
-            self.log.debug("The filtered results: \n")
-            self.log.debug(self.results)
-
-            # Write results to the window
-            self.show_results()
+            self._cache_key = self.cache.key(self.options["scan_path"],
+                                             self.blacklist,
+                                             self.get_hidden())
+            if rescan:
+                self.cache.discard(self._cache_key)
+            else:
+                cached = self.cache.get(self._cache_key)
+                if cached is not None:
+                    self._filter_cached(*cached)
+                    return
+
+            # Scan in a worker thread so the window stays responsive, it
+            # reports back through a queue that _poll_scan() checks
+            self._cancel = threading.Event()
+            self._messages = queue.Queue()
+            self.results = []
+            # Show matches as they arrive, filling this store
+            self._found = records.ScanStore()
+            self.results_view.set_source(StoreRows(self._found,
+                                                   self.last_flag()))
+            self.scan_btn.state(["disabled"])
+            self.rescan_btn.state(["disabled"])
+            self.cancel_btn.state(["!disabled"])
+            self.tree_btn.state(["disabled"])
+            self.status_value.set("Scanning...")
+            self._stats = records.ScanStats()
+            self._last_throughput = time.monotonic()
+
+            worker = threading.Thread(target=self._scan_worker,
+                                      args=(dict(self.options),
+                                            self.blacklist,
+                                            self.get_hidden(),
+                                            self.last_flag(),
+                                            self._cancel,
+                                            self._messages,
+                                            self._stats),
+                                      daemon=True)
+            worker.start()
+            self.after(POLL_MS, self._poll_scan)
 
             # ##################################################
             #           MAIN WORK OF ACTUAL SEARCH DONE
@@ -271,15 +791,248 @@ class Application(ttk.Frame):
             # Tell user
             tkmb.showerror(message="One or more options incorrect.")
 
+    def btn_rescan_clicked(self):
+        """Scan from disk again, replacing any cached scan."""
+        self.btn_go_scan(rescan=True)
+
+    def _on_threshold_changed(self, event=None):
+        """
+        Filter again when days or file last change, if a scan of the path,
+        blacklist and hidden options now set is cached.
+        """
+        if self._cancel is not None:
+            return
+        options = self.collect_options()
+        try:
+            blacklist = records.get_blacklist(options["blacklist_file"])
+        except IOError:
+            return  # Reported if the user starts a scan
+        key = self.cache.key(options["scan_path"], blacklist,
+                             options["hidden"] == "yes")
+        if self.cache.get(key) is not None:
+            self.btn_go_scan()
+
+    @staticmethod
+    def _filter_results(files, options, flag):
+        """
+        Return the results of a finished scan of files, a records.ScanStore,
+        for the output option.
+        """
+        if options["output"] == "aging":
+            return records.aging_report(files, options["aging_days"], flag)
+        if options["output"] == "rollup":
+            return records.rollup_stale(files, options["days"], flag,
+                                        options["scan_path"])
+        if options["output"] in records.TOP_ORDERS:
+            return Application._top_store(records.iter_cutoff_files(
+                files, options["days"], flag), options, flag)
+        return records.get_cutoff_files(files, options["days"], flag)
+
+    @staticmethod
+    def _top_store(matches, options, flag):
+        """Return a ScanStore of the top files of matches, in order."""
+        store = records.ScanStore()
+        store.extend(records.top_files(matches, options["top"],
+                                       options["output"], flag))
+        return store
+
+    def _filter_cached(self, files, scanned):
+        """Show the results of the cached scan files, without a walk."""
+        start = time.perf_counter()
+        self.all_files = files
+        self.results = self._filter_results(files, self.options,
+                                            self.last_flag())
+        elapsed = (time.perf_counter() - start) * 1000
+        self.tree_btn.state(["disabled"])
+        self.log.info("Filtered {} cached files in {:.0f} ms".format(
+            len(files), elapsed))
+        self.status_value.set(
+            "Files: {}  Matches: {}  (cached scan from {}, Rescan to "
+            "refresh)".format(len(files), len(self.results),
+                              time.strftime("%H:%M", time.localtime(scanned))))
+        self.show_results()
+
+    @staticmethod
+    def _scan_worker(options, blacklist, hidden, flag, cancel, messages,
+                     stats=None):
+        """
+        Run a scan, in a worker thread, counting it in the records.ScanStats
+        stats if given, and putting messages on a queue:
+
+        ('progress', counts, found) every PROGRESS_MS with a dict of counts
+        of 'dirs', 'files' and 'matches', the files per second 'rate', and
+        a list of the FileRecords matched since the last message.
+        ('done', all_files, results, cancelled) when the scan ends,
+        all_files is None if the scan's records were not kept, for a top N
+        scan or one of more than CACHE_MAX_FILES files.
+        ('error', exception) if the scan fails.
+
+        This must not touch any Tk widgets.
+        """
+        counts = {'dirs': 0, 'files': 0, 'matches': 0, 'rate': 0}
+        new_found = []
+        start = time.monotonic()
+        last = [start]
+
+        def report(force=False):
+            now = time.monotonic()
+            if force or (now - last[0]) * 1000 >= PROGRESS_MS:
+                last[0] = now
+                counts['rate'] = int(counts['files'] / max(now - start, 1e-6))
+                messages.put(('progress', dict(counts), new_found[:]))
+                del new_found[:]
+
+        def on_directory(path, files):
+            counts['dirs'] += 1
+            report()
+
+        # A top N scan holds only its top files, not every record
+        kept = [None if options["output"] in records.TOP_ORDERS
+                else records.ScanStore()]
+
+        def stored(found):
+            """
+            Keep every record in kept[0] as it streams past, until there are
+            too many to cache.
+            """
+            for rec in found:
+                counts['files'] += 1
+                if kept[0] is not None:
+                    if counts['files'] > CACHE_MAX_FILES:
+                        kept[0] = None  # Can not be cached, stop holding it
+                    else:
+                        kept[0].append(rec)
+                yield rec
+                report()
+
+        try:
+            walk = stored(records.iter_file_records(options["scan_path"],
+                                                    blacklist,
+                                                    hidden,
+                                                    options["workers"],
+                                                    on_directory,
+                                                    cancel,
+                                                    stats))
+            if options["output"] == "aging":
+                # Count files and bytes past every threshold in one pass
+                results = records.aging_report(walk, options["aging_days"],
+                                               flag)
+            elif options["output"] in records.TOP_ORDERS:
+                # Only the top files are held while the scan streams past,
+                # so there are no matches to show until it ends
+                def counted(matches):
+                    for rec in matches:
+                        counts['matches'] += 1
+                        yield rec
+                results = Application._top_store(
+                    counted(records.iter_cutoff_files(walk, options["days"],
+                                                      flag)), options, flag)
+            else:
+                # Filter found files by our criteria as they arrive, either
+                # keeping them or adding them up by directory
+                if options["output"] == "rollup":
+                    results = records.DirectoryRollup(options["scan_path"])
+                    add = results.add
+                else:
+                    results = records.ScanStore()
+                    add = results.append
+                for rec in records.iter_cutoff_files(walk, options["days"],
+                                                     flag):
+                    add(rec)
+                    counts['matches'] += 1
+                    new_found.append(rec)
+                if options["output"] == "rollup":
+                    results.finish()
+            report(force=True)
+        except Exception as e:  # Hand it to the GUI thread
+            messages.put(('error', e))
+        else:
+            messages.put(('done', kept[0], results, cancel.is_set()))
+
+    def _poll_scan(self):
+        """
+        Handle the messages of the running scan, then check again in
+        POLL_MS unless the scan has ended.
+        """
+        try:
+            while True:
+                message = self._messages.get_nowait()
+                kind = message[0]
+                if kind == 'progress':
+                    counts, found = message[1:]
+                    self._log_throughput()
+                    self.status_value.set(
+                        "Dirs: {dirs}  Files: {files}  Matches: {matches}  "
+                        "Files/sec: {rate}".format(**counts))
+                    if found:  # Show new matches as they arrive
+                        self._found.extend(found)
+                        self.results_view.refresh()
+                elif kind == 'done':
+                    self.all_files, self.results, cancelled = message[1:]
+                    # Only complete scans are reused
+                    if not cancelled and self.all_files is not None:
+                        self.cache.put(self._cache_key, self.all_files)
+                    self._scan_finished()
+                    self._log_throughput(force=True)
+                    self.log.debug("The filtered results: \n")
+                    self.log.debug(self.results)
+                    if cancelled:
+                        self.log.info("Scan cancelled.")
+                        self.status_value.set("Cancelled. " +
+                                              self.status_value.get())
+                    else:
+                        self.log.info("Scan finished.")
+                    self.show_results()
+                    return
+                elif kind == 'error':
+                    self._scan_finished()
+                    self.log.error("Scan failed: {}".format(message[1]))
+                    self.status_value.set("Scan failed")
+                    tkmb.showerror(message="Scan failed: {}".format(
+                        message[1]))
+                    return
+        except queue.Empty:
+            pass
+        self.after(POLL_MS, self._poll_scan)
+
+    def _log_throughput(self, force=False):
+        """Log the running scan's throughput every THROUGHPUT_MS."""
+        now = time.monotonic()
+        if force or (now - self._last_throughput) * 1000 >= THROUGHPUT_MS:
+            self._last_throughput = now
+            self.log.info(self._stats.throughput())
+
+    def _scan_finished(self):
+        """Put the buttons back once a scan has ended."""
+        self.scan_btn.state(["!disabled"])
+        self.rescan_btn.state(["!disabled"])
+        self.cancel_btn.state(["disabled"])
+        self._cancel = None
+
+    def btn_cancel_clicked(self):
+        """Ask the running scan to stop, it keeps what it found so far."""
+        if self._cancel is not None:
+            self.log.info("Cancelling scan...")
+            self._cancel.set()
+
     def show_results(self):
-        """Write the list to the tkst widget (TkScrolledText) on the screen."""
-        self.log.debug("Writing results list to the TkScrolledText area")
+        """Show the results in the results table on the screen."""
+        self.log.debug("Showing results in the results table")
         if not self.results:
             self.log.debug("No results to write.")
+            self.results_view.clear()
+        elif self.options["output"] == "aging":
+            columns = (("days", "Older than (days)", 150),
+                       ("count", "Files", 150),
+                       ("bytes", "Bytes", 150))
+            self.results_view.set_source(TableRows(columns, self.results))
+        elif self.options["output"] == "rollup":
+            self.results_view.set_source(RollupRows(self.results))
+            self.results_view.sort_by("bytes", reverse=True)
+            self.tree_btn.state(["!disabled"])
         else:
-
-            for res in self.results:
-                self.results_text.insert(tk.INSERT, res + '\n')
+            self.results_view.set_source(StoreRows(self.results,
+                                                   self.last_flag()))
 
     def write_results_to_file(self):
         """
@@ -296,10 +1049,17 @@ class Application(ttk.Frame):
             save_loc = save_dialog.show()
 
             try:
-                records.write_to_file(self.results, save_loc,
-                                      self.options["format"],
-                                      self.options["last"]
-                                      )
+                if self.options["output"] == "aging":
+                    records.write_aging_report(self.results, save_loc,
+                                               self.options["format"])
+                elif self.options["output"] == "rollup":
+                    records.write_rollup_report(self.results, save_loc,
+                                                self.options["format"])
+                else:
+                    records.write_to_file(self.results, save_loc,
+                                          self.options["format"],
+                                          self.last_flag()
+                                          )
             except IOError:  # records.write_to_file() raises this
                 self.log.error("Could not write to file!")
                 tkmb.showinfo(message="Could not write results to "
@@ -311,6 +1071,11 @@ class Application(ttk.Frame):
                 tkmb.showinfo(message="Successfully wrote results to"
                                       " file: {}".format(save_loc))
 
+    def btn_tree_clicked(self):
+        """Open a window with the directory tree of a rollup scan."""
+        if self.results and self.options["output"] == "rollup":
+            RollupTree(self.results, self)
+
     def btn_blacklist_clicked(self):
         """
         Open a Tk file dialog to select blacklist file.
@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:title: records_query.py
+:author: Craig MacEachern
+
+A small filter language for records.py scans, e.g.
+
+    age('a') > 365 and size > 100MB and ext in {pst, iso}
+
+A query is compiled once to a Python predicate. The parts of it that only
+need a file's name are also compiled to a check made before the file is
+stat'ed, and 'path like' parts to a check that prunes whole directories,
+so a scan only pays for the data the query needs. Example:
+
+    query = Query("ext in {pst, ost} and size > 1GB")
+    for rec in iter_query('/srv/home', query):
+        print(rec.path)
+
+Fields:
+
+* size: bytes. Numbers take a unit of KB, MB, GB or TB (powers of 1024).
+* age, age('m'), age('a'), age('c'): days since last modified, accessed or
+  changed.
+* mtime, atime, ctime: compared with a date, e.g. mtime < 2015-01-01.
+* uid, or owner with a user name, e.g. owner == alice.
+* name, path and ext (the extension, without the dot, compared ignoring
+  case). Compared with ==, !=, in {...} or like 'glob'.
+
+Comparisons are combined with and, or, not and parentheses. Values that
+are not numbers or dates may be quoted, and must be if they contain
+anything but letters, digits, '_', '-' and '.'.
+
+##### KNOWN BUGS/ISSUES ##########
+* Only 'path like' globs ending in a single '*' after a literal directory,
+e.g. path like '/srv/old/*', prune directories. Other path globs are still
+checked before the stat, one file at a time.
+* Ages are counted from when the query is compiled, not from when each file
+is found, as with records.iter_cutoff_files().
+"""
+import fnmatch
+import os
+import re
+import time
+from datetime import datetime
+
+import records
+
+try:
+    import pwd  # For owner names, not available on Windows
+except ImportError:
+    pwd = None
+
+
+class QueryError(ValueError):
+    """A query that can not be parsed or compiled."""
+
+
+# Fields known from the directory listing, without a stat.
+NAME_FIELDS = ('name', 'path', 'ext')
+
+# Fields needing a stat.
+STAT_FIELDS = ('size', 'age', 'mtime', 'atime', 'ctime', 'uid', 'owner')
+
+_UNITS = {'': 1, 'b': 1, 'k': 1 << 10, 'kb': 1 << 10, 'kib': 1 << 10,
+          'm': 1 << 20, 'mb': 1 << 20, 'mib': 1 << 20,
+          'g': 1 << 30, 'gb': 1 << 30, 'gib': 1 << 30,
+          't': 1 << 40, 'tb': 1 << 40, 'tib': 1 << 40}
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<date>\d{4}-\d{2}-\d{2})(?![\w.])
+      | (?P<number>\d+(?:\.\d+)?)(?P<unit>[KkMmGgTt](?:[Ii]?[Bb])?|[Bb])?
+            (?![\w.])
+      | (?P<string>'[^']*'|"[^"]*")
+      | (?P<op>>=|<=|==|!=|=|>|<|[(){},])
+      | (?P<word>[\w.-]+)
+    )""", re.VERBOSE)
+
+_KEYWORDS = ('and', 'or', 'not', 'in', 'like')
+
+# The comparison mirrored, for "age > n" as "mtime < now - n days".
+_MIRROR = {'>': '<', '>=': '<=', '<': '>', '<=': '>=', '==': '==',
+           '!=': '!='}
+
+_TIME_COLUMNS = {'m': 'mtime', 'a': 'atime', 'c': 'ctime'}
+
+
+def _tokenize(text):
+    """Return a list of (kind, value) tokens of text."""
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if m is None or m.end() == pos:
+            raise QueryError('Can not parse query at: {!r}'.format(
+                text[pos:].strip()))
+        pos = m.end()
+        kind = m.lastgroup if m.lastgroup != 'unit' else 'number'
+        if kind == 'number':
+            unit = (m.group('unit') or '').lower()
+            value = float(m.group('number')) * _UNITS[unit]
+            tokens.append(('value', int(value) if value.is_integer()
+                           else value))
+        elif kind == 'date':
+            try:
+                day = datetime.strptime(m.group('date'), '%Y-%m-%d')
+            except ValueError:
+                raise QueryError('Not a date: {}'.format(m.group('date')))
+            tokens.append(('date', time.mktime(day.timetuple())))
+        elif kind == 'string':
+            tokens.append(('value', m.group('string')[1:-1]))
+        elif kind == 'op':
+            op = m.group('op')
+            tokens.append(('op', '==' if op == '=' else op))
+        elif m.group('word').lower() in _KEYWORDS:
+            tokens.append(('op', m.group('word').lower()))
+        else:
+            tokens.append(('word', m.group('word')))
+    return tokens
+
+
+class _Parser(object):
+    """
+    Recursive descent parser of the query language, giving a tree of
+    tuples:
+
+    ('and', [nodes]), ('or', [nodes]), ('not', node), ('const', bool),
+    ('cmp', field, argument, op, value)
+    """
+
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if (kind is not None and token[0] != kind) or \
+                (value is not None and token[1] != value):
+            raise QueryError('Expected {} but found {}'.format(
+                value or kind, token[1] if token[0] else 'the end'))
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.or_expr()
+        if self.pos != len(self.tokens):
+            raise QueryError('Unexpected {!r}'.format(self.peek()[1]))
+        return node
+
+    def or_expr(self):
+        nodes = [self.and_expr()]
+        while self.peek() == ('op', 'or'):
+            self.take()
+            nodes.append(self.and_expr())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def and_expr(self):
+        nodes = [self.not_expr()]
+        while self.peek() == ('op', 'and'):
+            self.take()
+            nodes.append(self.not_expr())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def not_expr(self):
+        if self.peek() == ('op', 'not'):
+            self.take()
+            return ('not', self.not_expr())
+        if self.peek() == ('op', '('):
+            self.take()
+            node = self.or_expr()
+            self.take('op', ')')
+            return node
+        return self.comparison()
+
+    def comparison(self):
+        field = self.take('word')[1].lower()
+        if field not in NAME_FIELDS + STAT_FIELDS:
+            raise QueryError('Unknown field: {}'.format(field))
+        argument = None
+        if field == 'age':
+            argument = 'm'
+            if self.peek() == ('op', '('):
+                self.take()
+                argument = str(self.take()[1]).lower()
+                self.take('op', ')')
+                if argument not in _TIME_COLUMNS:
+                    raise QueryError("age() takes 'm', 'a' or 'c'")
+
+        op = self.take('op')[1]
+        if op == 'not':
+            self.take('op', 'in')
+            op = 'not in'
+        if op in ('in', 'not in'):
+            return ('cmp', field, argument, op, self.value_set())
+        if op not in _MIRROR and op != 'like':
+            raise QueryError('Expected a comparison after {}'.format(field))
+        return ('cmp', field, argument, op, self.value())
+
+    def value(self):
+        kind, value = self.take()
+        if kind not in ('value', 'word', 'date'):
+            raise QueryError('Expected a value but found {}'.format(
+                repr(value) if kind else 'the end'))
+        return value
+
+    def value_set(self):
+        self.take('op', '{')
+        values = [self.value()]
+        while self.peek() == ('op', ','):
+            self.take()
+            values.append(self.value())
+        self.take('op', '}')
+        return frozenset(values)
+
+
+def _simplify(kind, nodes):
+    """Return an 'and' or 'or' node of nodes, folding constants."""
+    stop = kind == 'or'  # The constant deciding the whole node
+    kept = []
+    for node in nodes:
+        if node[0] == 'const':
+            if node[1] == stop:
+                return node
+            continue
+        kept.append(node)
+    if not kept:
+        return ('const', not stop)
+    return kept[0] if len(kept) == 1 else (kind, kept)
+
+
+def _bound(node, known, upper):
+    """
+    Return node with the comparisons that can not be decided yet replaced,
+    so the result is an upper bound (may match, upper=True) or lower bound
+    (must match) of node.
+
+    :param known: A callable taking a 'cmp' node and upper, returning the
+                  node to decide it with, or None if it can not be decided.
+    """
+    kind = node[0]
+    if kind == 'const':
+        return node
+    if kind == 'not':
+        inner = _bound(node[1], known, not upper)
+        return ('const', not inner[1]) if inner[0] == 'const' else \
+            ('not', inner)
+    if kind in ('and', 'or'):
+        return _simplify(kind, [_bound(n, known, upper) for n in node[1]])
+    decided = known(node, upper)
+    return decided if decided is not None else ('const', upper)
+
+
+def _known_by_name(node, upper):
+    """Decide comparisons of name fields, before the stat."""
+    return node if node[1] in NAME_FIELDS else None
+
+
+def _glob_prefix(pattern):
+    """
+    Return the literal start of a glob ending in a single '*', e.g.
+    '/srv/old/' of '/srv/old/*', or None for any other glob.
+    """
+    if pattern.endswith('*') and not any(c in pattern[:-1] for c in '*?['):
+        return pattern[:-1]
+    return None
+
+
+def _known_by_directory(node, upper):
+    """
+    Decide 'path like' comparisons with a literal prefix for every file
+    below a directory, for pruning.
+    """
+    _, field, _, op, value = node
+    if field == 'path' and op == 'like':
+        prefix = _glob_prefix(value)
+        if prefix is not None:
+            return ('under', upper, prefix)
+    return None
+
+
+def _ext(name):
+    """Return the extension of name, lower case without the dot."""
+    return os.path.splitext(name)[1][1:].lower()
+
+
+def _name(path):
+    """Return the last component of path."""
+    return path.rpartition(os.sep)[2]
+
+
+def _may_be_under(path, prefix):
+    """True if some file below the directory path may start with prefix."""
+    below = path + os.sep
+    return below.startswith(prefix) or prefix.startswith(below)
+
+
+def _all_under(path, prefix):
+    """True if every file below the directory path starts with prefix."""
+    return (path + os.sep).startswith(prefix)
+
+
+class Query(object):
+    """
+    A compiled query. match() tests a FileRecord, keep() a file's name
+    before it is stat'ed, and prune() a directory, so they can be given to
+    the walker.
+    """
+
+    def __init__(self, text, now=None):
+        """
+        Parse and compile the query text.
+
+        :param text: The query, e.g. "age > 365 and ext in {pst, iso}".
+        :param now: Optional. Time in seconds since the epoch ages are
+                    counted from. Defaults to now.
+        :raises QueryError: if text is not a valid query.
+        """
+        self.text = text
+        self.now = time.time() if now is None else now
+        self._consts = {}
+        tree = _Parser(text).parse()
+
+        self.needs_stat = self._needs_stat(tree)
+        self.match = self._compile('r', tree)
+        # Before the stat, skip files that can not match whatever the stat
+        names = _bound(tree, _known_by_name, True)
+        self.keep = None if names == ('const', True) else \
+            self._compile('name, path', names)
+        # Prune directories whose files all can not match
+        under = _bound(tree, _known_by_directory, True)
+        self.prune = None if under == ('const', True) else \
+            self._compile('path', ('not', under))
+
+    def __repr__(self):
+        return 'Query({!r})'.format(self.text)
+
+    def _needs_stat(self, node):
+        if node[0] in ('and', 'or'):
+            return any(self._needs_stat(n) for n in node[1])
+        if node[0] == 'not':
+            return self._needs_stat(node[1])
+        return node[0] == 'cmp' and node[1] in STAT_FIELDS
+
+    def _const(self, value):
+        """Return the name of a new constant holding value."""
+        name = '_c{}'.format(len(self._consts))
+        self._consts[name] = value
+        return name
+
+    def _compile(self, args, node):
+        """Return a function of args evaluating node."""
+        source = 'lambda {}: {}'.format(args, self._emit(node, args))
+        env = dict(self._consts, _ext=_ext, _name=_name,
+                   _may_be_under=_may_be_under, _all_under=_all_under)
+        return eval(source, env)
+
+    def _emit(self, node, args):
+        """Return Python source evaluating node, given the names args."""
+        kind = node[0]
+        if kind == 'const':
+            return repr(node[1])
+        if kind == 'not':
+            return '(not {})'.format(self._emit(node[1], args))
+        if kind in ('and', 'or'):
+            return '({})'.format(' {} '.format(kind).join(
+                self._emit(n, args) for n in node[1]))
+        if kind == 'under':
+            _, upper, prefix = node
+            return '{}(path, {})'.format(
+                '_may_be_under' if upper else '_all_under',
+                self._const(prefix))
+        return self._emit_comparison(node, args == 'r')
+
+    def _emit_comparison(self, node, on_record):
+        _, field, argument, op, value = node
+        if field in NAME_FIELDS:
+            path = 'r.path' if on_record else 'path'
+            name = '_name(r.path)' if on_record else 'name'
+            subject = {'path': path, 'name': name,
+                       'ext': '_ext({})'.format(name)}[field]
+            if field == 'ext':  # Any case, with or without the dot
+                fold = lambda v: str(v).lower().lstrip('.')
+                value = frozenset(map(fold, value)) \
+                    if isinstance(value, frozenset) else fold(value)
+            elif isinstance(value, frozenset):
+                value = frozenset(map(str, value))
+            else:
+                value = str(value)
+        else:
+            subject, value = self._stat_subject(field, argument, op, value)
+            if field == 'age':
+                op = _MIRROR.get(op, op)
+
+        if op == 'like':
+            if field not in NAME_FIELDS:
+                raise QueryError('like only works with name, path or ext')
+            regex = re.compile(fnmatch.translate(value))
+            return '({}.match({}) is not None)'.format(self._const(regex),
+                                                       subject)
+        compare = '{} {} {}'.format(subject, op, self._const(value))
+        if subject == 'r.uid':  # Files whose owner is not known never match
+            return '(r.uid is not None and {})'.format(compare)
+        return '({})'.format(compare)
+
+    def _stat_subject(self, field, argument, op, value):
+        """
+        Return the source of a stat field of record r, and value converted
+        to compare with it.
+        """
+        def number(v):
+            if isinstance(v, str):
+                raise QueryError('{} needs a number, not {!r}'.format(field,
+                                                                      v))
+            return v
+
+        def convert(v):
+            if field == 'age':
+                return self.now - number(v) * 24 * 60 * 60
+            if field == 'owner':
+                return self._uid(v)
+            return number(v)
+
+        if op == 'like':
+            raise QueryError('like only works with name, path or ext')
+        value = frozenset(map(convert, value)) \
+            if isinstance(value, frozenset) else convert(value)
+        if field == 'age':
+            return 'r.' + _TIME_COLUMNS[argument], value
+        if field == 'owner':
+            return 'r.uid', value
+        return 'r.' + field, value
+
+    @staticmethod
+    def _uid(owner):
+        """Return the uid of the user name owner."""
+        if not isinstance(owner, str):
+            return owner
+        if pwd is None:
+            raise QueryError('owner names are not available here, use uid')
+        try:
+            return pwd.getpwnam(owner).pw_uid
+        except KeyError:
+            raise QueryError('Unknown user: {}'.format(owner))
+
+    def select(self, items):
+        """
+        Return a list of the FileRecords in items that match, e.g. to
+        filter a records.ScanStore again without a scan.
+        """
+        return list(filter(self.match, items))
+
+
+def iter_query(directory, query, blacklist=None, get_hidden=False,
+               workers=1, on_directory=None, cancel=None, stats=None,
+               checkpoint=None, governor=None):
+    """
+    Return a generator of the FileRecords under directory matching query,
+    only stat'ing files whose names may match and skipping directories
+    none of whose files can. See records.iter_file_records() for the other
+    parameters.
+
+    :param query: A Query, or the text of one.
+    :raises QueryError: if query is not a valid query.
+    :raises IOError: if given directory parameter does not exist.
+    """
+    if not isinstance(query, Query):
+        query = Query(query)
+    records._check_directory(directory)
+    walk = records._iter_walk(directory, blacklist, get_hidden,
+                              workers=workers, on_directory=on_directory,
+                              cancel=cancel, stats=stats,
+                              checkpoint=checkpoint, keep=query.keep,
+                              prune=query.prune, governor=governor)
+    return filter(query.match, walk)
+
+
+def iter_query_paths(directory, query, blacklist=None, get_hidden=False,
+                     workers=1, on_directory=None, cancel=None):
+    """
+    Return a generator of the normalized filenames under directory matching
+    a query of name, path and ext only, without stat'ing any file.
+
+    :param query: A Query, or the text of one.
+    :raises QueryError: if query is not valid or needs stat data.
+    :raises IOError: if given directory parameter does not exist.
+    """
+    if not isinstance(query, Query):
+        query = Query(query)
+    if query.needs_stat:
+        raise QueryError('Query needs file stat data, use iter_query()')
+    records._check_directory(directory)
+    return records._iter_walk(directory, blacklist, get_hidden,
+                              with_stat=False, workers=workers,
+                              on_directory=on_directory, cancel=cancel,
+                              keep=query.keep, prune=query.prune)
@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:title: records_snapshot.py
+:author: Craig MacEachern
+
+Save scans as compact, immutable binary snapshots, and compare two
+snapshots to see what changed between scans.
+
+A snapshot is the columns of a records.ScanStore written as they are in
+memory, with the files sorted by path:
+
+    header   magic b'RECSNAP\\0', version, flags, file count n and the time
+             the scan was taken, 32 bytes
+    offsets  n + 1 unsigned 64 bit offsets of each path in the path table
+    size     n signed 64 bit sizes
+    mtime    n 64 bit float last modified times
+    atime    n 64 bit float last accessed times
+    ctime    n 64 bit float changed times
+    uid      n signed 64 bit owner ids, -1 where not known
+    paths    the paths, encoded like the filesystem does, back to back
+
+Every number is little endian and every column is 8 byte aligned, so a
+Snapshot reads the file with mmap and only the pages used are loaded. A
+snapshot of a million files is about 48 MB plus the paths, and opens
+instantly, compared to parsing a text report of the same scan.
+
+diff_snapshots() merge-joins two snapshots on their sorted paths, streaming
+files that were added, deleted, modified, or crossed the staleness cutoff
+since the older snapshot. Example:
+
+    save_snapshot(records.iter_file_records('/srv/share'), 'monday.snap')
+    ...
+    with Snapshot('monday.snap') as old, Snapshot('friday.snap') as new:
+        for change in diff_snapshots(old, new, days=365):
+            print(change.change, change.path)
+"""
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import namedtuple
+
+import records
+
+# One difference between two snapshots. change is one of 'added',
+# 'deleted', 'modified' or 'crossed' (became older than the cutoff), old
+# and new are the file's FileRecords in each snapshot, None if not in it.
+SnapshotChange = namedtuple('SnapshotChange', ['change', 'path', 'old',
+                                               'new'])
+
+MAGIC = b'RECSNAP\0'
+VERSION = 1
+
+# magic, version, flags, count, taken
+_HEADER = struct.Struct('<8sIIqd')
+
+# Columns after the offsets, in file order, with their array typecodes.
+_COLUMNS = (('size', 'q'), ('mtime', 'd'), ('atime', 'd'), ('ctime', 'd'),
+            ('uid', 'q'))
+
+_LITTLE = sys.byteorder == 'little'
+
+
+def _little_endian(column):
+    """Return the array column in little endian byte order."""
+    if _LITTLE:
+        return column
+    column = array(column.typecode, column)
+    column.byteswap()
+    return column
+
+
+def save_snapshot(files, name, taken=None):
+    """
+    Write files to a new snapshot file name, sorted by path.
+
+    :param files: An iterable of FileRecords, e.g. from
+                  records.iter_file_records(), or a records.ScanStore.
+    :param name: Name of the snapshot file. It is written to a temporary
+                 file first, so a reader never sees half a snapshot.
+    :param taken: Optional. Time in seconds since the epoch the scan
+                  started. Defaults to now.
+    :returns: the number of files written.
+    :raises IOError: if writing the file fails.
+    """
+    if taken is None:
+        taken = time.time()
+    store = files if isinstance(files, records.ScanStore) else \
+        records.ScanStore(files)
+
+    # Sort by the encoded path, the order diff_snapshots() merges in
+    paths = store._paths
+    offsets = store._offsets
+    order = sorted(range(len(store)),
+                   key=lambda i: paths[offsets[i]:offsets[i + 1]])
+    store = store.take(order)
+
+    temp = name + '.tmp'
+    try:
+        with open(temp, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, 0, len(store), taken))
+            _little_endian(store._offsets).tofile(f)
+            for column, _ in _COLUMNS:
+                _little_endian(getattr(store, column)).tofile(f)
+            f.write(store._paths)
+        os.replace(temp, name)
+    except IOError:
+        raise IOError('Error writing snapshot: {}'.format(name))
+    return len(store)
+
+
+class Snapshot(object):
+    """
+    A snapshot file opened with mmap. Like a records.ScanStore it can be
+    indexed and iterated as FileRecords, and has older_than(), so it can be
+    passed to records.get_cutoff_files() or records.write_report().
+    """
+
+    def __init__(self, name):
+        """
+        Open the snapshot file name.
+
+        :raises IOError: if the file can not be read or is not a snapshot.
+        """
+        self.name = name
+        self._views = []
+        try:
+            with open(name, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError) as e:
+            raise IOError('Error reading snapshot {}: {}'.format(name, e))
+
+        try:
+            magic, version, _, count, self.taken = \
+                _HEADER.unpack_from(self._map)
+        except struct.error:
+            magic = version = count = None
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise IOError('Not a snapshot, or an unknown version: '
+                          '{}'.format(name))
+
+        pos = _HEADER.size
+        self._offsets = self._column(pos, count + 1, 'Q')
+        pos += 8 * (count + 1)
+        for column, typecode in _COLUMNS:
+            setattr(self, column, self._column(pos, count, typecode))
+            pos += 8 * count
+        self._paths_at = pos
+        if len(self._map) < pos + (self._offsets[count] if count else 0):
+            self.close()
+            raise IOError('Snapshot is truncated: {}'.format(name))
+
+    def _column(self, pos, count, typecode):
+        """Return a sequence of count numbers at pos, of array typecode."""
+        if not _LITTLE:  # Copy and swap, rather than map
+            column = array(typecode, self._map[pos:pos + 8 * count])
+            column.byteswap()
+            return column
+        view = memoryview(self._map)[pos:pos + 8 * count].cast(typecode)
+        self._views.append(view)
+        return view
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap the file. Records already read stay usable."""
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._map.close()
+
+    def __len__(self):
+        return len(self.size)
+
+    def __repr__(self):
+        return '<Snapshot {!r} of {} files>'.format(self.name, len(self))
+
+    def path_bytes(self, i):
+        """Return the encoded path of the i'th file."""
+        at = self._paths_at
+        return self._map[at + self._offsets[i]:at + self._offsets[i + 1]]
+
+    def path(self, i):
+        """Return the path of the i'th file."""
+        return self.path_bytes(i).decode(records._FS_ENCODING,
+                                         records._FS_ERRORS)
+
+    def __getitem__(self, i):
+        """Return the i'th file as a FileRecord."""
+        if i < 0:
+            i += len(self)
+        uid = self.uid[i]
+        return records.FileRecord(self.path(i), self.size[i], self.mtime[i],
+                                  self.atime[i], self.ctime[i],
+                                  None if uid == -1 else uid)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, path):
+        """
+        Return the index of the file path, by binary search, or -1.
+
+        :param path: The path, spelled as it was scanned.
+        """
+        key = path.encode(records._FS_ENCODING, records._FS_ERRORS)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.path_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self.path_bytes(lo) == key else -1
+
+    def older_than(self, cutoff, flag='m'):
+        """
+        Return the indexes of the files older than cutoff, like
+        records.ScanStore.older_than().
+        """
+        column = self.atime if flag == 'a' else self.mtime
+        return [i for i, t in enumerate(column) if t < cutoff]
+
+    def take(self, indexes):
+        """Return a records.ScanStore of the files at indexes."""
+        return records.ScanStore(self[i] for i in indexes)
+
+
+def diff_snapshots(old, new, days=None, flag='m'):
+    """
+    Yield the changes between two snapshots, in path order, reading both
+    once, side by side.
+
+    :param old: The earlier Snapshot.
+    :param new: The later Snapshot.
+    :param days: Optional. If given, also yield 'crossed' for files that
+                 were not older than days when old was taken, but are when
+                 new was taken, and not modified in between.
+    :param flag: Optional. Default 'm' means last modified times, also
+                 accepts 'a' for last accessed, for the cutoff.
+    :returns: a generator of SnapshotChanges.
+    """
+    n, m = len(old), len(new)
+    old_times = old.atime if flag == 'a' else old.mtime
+    new_times = new.atime if flag == 'a' else new.mtime
+    if days is not None:
+        seconds = days * 24 * 60 * 60
+        old_cutoff = old.taken - seconds
+        new_cutoff = new.taken - seconds
+
+    i = j = 0
+    a = old.path_bytes(0) if n else None
+    b = new.path_bytes(0) if m else None
+    while i < n and j < m:
+        if a == b:
+            if old.size[i] != new.size[j] or old.mtime[i] != new.mtime[j]:
+                yield SnapshotChange('modified', new.path(j), old[i], new[j])
+            elif (days is not None and new_times[j] < new_cutoff and
+                  old_times[i] >= old_cutoff):
+                yield SnapshotChange('crossed', new.path(j), old[i], new[j])
+            i += 1
+            j += 1
+            a = old.path_bytes(i) if i < n else None
+            b = new.path_bytes(j) if j < m else None
+        elif a < b:
+            yield SnapshotChange('deleted', old.path(i), old[i], None)
+            i += 1
+            a = old.path_bytes(i) if i < n else None
+        else:
+            yield SnapshotChange('added', new.path(j), None, new[j])
+            j += 1
+            b = new.path_bytes(j) if j < m else None
+    for i in range(i, n):
+        yield SnapshotChange('deleted', old.path(i), old[i], None)
+    for j in range(j, m):
+        yield SnapshotChange('added', new.path(j), None, new[j])
+
+
+def iter_diff_lines(changes, style='txt', flag='m'):
+    """
+    Yield the lines of a snapshot diff report, header first.
+
+    :param changes: An iterable of SnapshotChanges.
+    :param style: Optional. Tab separated ('txt') or comma separated
+                  values ('csv').
+    :param flag: Optional. Report last modified ('m') or accessed ('a')
+                 dates.
+    :returns: a generator of newline terminated strings.
+    """
+    def date(rec):
+        return records._date_string(rec, flag) if rec is not None else ''
+
+    def size(rec):
+        return rec.size if rec is not None else ''
+
+    return records._iter_csv_lines(
+        ("Change", "Path", "Old size", "New size", "Old date", "New date"),
+        ((c.change, c.path, size(c.old), size(c.new), date(c.old),
+          date(c.new)) for c in changes),
+        style)
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="records_snapshot.py",
+        description="Save scans as binary snapshots and compare them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    save = commands.add_parser("save", help="Scan directories into a new "
+                                            "snapshot.")
+    save.add_argument("roots", nargs="+", metavar="DIR",
+                      help="Directory to scan.")
+    save.add_argument("-o", "--output", required=True, metavar="FILE",
+                      help="Snapshot file to write.")
+    save.add_argument("-b", "--blacklist", metavar="FILE",
+                      help="File of names, globs or paths to skip.")
+    save.add_argument("--hidden", action="store_true",
+                      help="Include hidden files and directories.")
+    save.add_argument("-j", "--workers", type=int, default=1,
+                      help="Threads listing directories "
+                           "(default: %(default)s).")
+
+    for name, text in (("diff", "Report the changes between two "
+                                "snapshots."),
+                       ("stale", "Report the files in a snapshot older "
+                                 "than some days.")):
+        command = commands.add_parser(name, help=text)
+        if name == "diff":
+            command.add_argument("old", help="The earlier snapshot.")
+            command.add_argument("new", help="The later snapshot.")
+        else:
+            command.add_argument("snapshot", help="The snapshot.")
+        command.add_argument("-d", "--days", type=int,
+                             default=None if name == "diff" else 90,
+                             help="Cutoff in days{}.".format(
+                                 ", also report files that crossed it"
+                                 if name == "diff" else
+                                 " (default: %(default)s)"))
+        command.add_argument("-l", "--last",
+                             choices=("modified", "accessed"),
+                             default="modified",
+                             help="Which file time to compare "
+                                  "(default: %(default)s).")
+        command.add_argument("-f", "--format", choices=("txt", "csv"),
+                             default="csv",
+                             help="Report format (default: %(default)s).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Save, compare or report on snapshots from the command line, e.g.
+
+        python records_snapshot.py save -o today.snap /srv/share
+        python records_snapshot.py diff -d 365 yesterday.snap today.snap
+
+    Reports are written to stdout.
+
+    :param argv: Optional. A list of arguments, defaults to sys.argv[1:].
+    :returns: 0 on success, 1 if a report is empty, 2 on errors.
+    """
+    args = _parse_args(argv)
+    flag = 'a' if getattr(args, 'last', None) == "accessed" else 'm'
+    try:
+        if args.command == "save":
+            taken = time.time()
+            blacklist = records.get_blacklist(args.blacklist)
+            store = records.ScanStore()
+            for root in args.roots:
+                store.extend(records.iter_file_records(
+                    root, blacklist, args.hidden, args.workers))
+            count = save_snapshot(store, args.output, taken)
+            print("Saved {} files to {}".format(count, args.output),
+                  file=sys.stderr)
+            return 0
+
+        if args.command == "diff":
+            with Snapshot(args.old) as old, Snapshot(args.new) as new:
+                count = 0
+                lines = iter_diff_lines(diff_snapshots(old, new, args.days,
+                                                       flag),
+                                        args.format, flag)
+                for line in lines:
+                    sys.stdout.write(line)
+                    count += 1
+            return 0 if count > 1 else 1
+
+        with Snapshot(args.snapshot) as snapshot:
+            stale = snapshot.take(snapshot.older_than(
+                records._cutoff_time(args.days), flag))
+            matched = records.write_report(stale, sys.stdout.buffer,
+                                           args.format, flag)
+        return 0 if matched else 1
+    except IOError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
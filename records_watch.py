@@ -0,0 +1,552 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:title: records_watch.py
+:author: Craig MacEachern
+
+Keep the stale files of a directory tree current without rescanning it,
+using Linux inotify through ctypes.
+
+After one initial scan every directory of the tree is watched, and files
+that are created, modified, moved or deleted are re-stat'ed or dropped as
+the events arrive. The files are kept in time order, so "older than N
+days" queries are answered from memory at once. Example:
+
+    with StaleWatcher('/srv/project') as watcher:
+        stop = threading.Event()
+        threading.Thread(target=watcher.run, args=(stop,)).start()
+        ...
+        stale = watcher.older_than(365)
+
+If the kernel's event queue overflows, events have been lost, so the
+directories whose modified time changed are listed again and the files of
+the others are re-stat'ed.
+
+##### KNOWN BUGS/ISSUES ##########
+* Linux only. Each directory uses one inotify watch, and the number of
+watches per user is limited by /proc/sys/fs/inotify/max_user_watches.
+* A directory moved within the tree is treated as deleted and then created,
+so its files are stat'ed again.
+* Last accessed times are only followed when watching with flag='a', as
+reads generate a lot of events.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+
+import records
+
+# inotify event masks, from <sys/inotify.h>
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+               IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+               IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+# struct inotify_event {int wd; uint32_t mask, cookie, len; char name[];}
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """
+    A minimal wrapper of the Linux inotify system calls.
+    """
+
+    def __init__(self):
+        """
+        :raises IOError: if inotify is not available.
+        """
+        if not sys.platform.startswith('linux'):
+            raise IOError('inotify is only available on Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise IOError('Could not start inotify: {}'.format(
+                os.strerror(ctypes.get_errno())))
+
+    def add_watch(self, path, mask):
+        """
+        Watch the directory path for the events in mask.
+
+        :returns: the watch descriptor.
+        :raises OSError: if path can not be watched, with errno ENOSPC when
+                         the limit of watches is reached.
+        """
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        """Stop watching watch descriptor wd, if it still exists."""
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """
+        Return a list of (wd, mask, cookie, name) events, waiting up to
+        timeout seconds for the first. name is '' for events of the watched
+        directory itself.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        """Close the inotify file descriptor, removing every watch."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class TimeIndex(object):
+    """
+    (time, path) pairs kept in sorted order, in blocks of a few thousand,
+    so adding and removing one costs a binary search and a short list
+    insert, and the pairs older than a time are found with one search.
+    """
+
+    _LOAD = 1000  # Blocks are split once they reach twice this
+
+    def __init__(self):
+        self._blocks = []
+        self._maxes = []  # Last pair of each block
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, item):
+        """Add the (time, path) pair item."""
+        self._len += 1
+        if not self._blocks:
+            self._blocks.append([item])
+            self._maxes.append(item)
+            return
+        i = min(bisect_left(self._maxes, item), len(self._blocks) - 1)
+        block = self._blocks[i]
+        insort(block, item)
+        self._maxes[i] = block[-1]
+        if len(block) >= 2 * self._LOAD:
+            half = self._LOAD
+            self._blocks[i:i + 1] = [block[:half], block[half:]]
+            self._maxes[i:i + 1] = [block[half - 1], block[-1]]
+
+    def remove(self, item):
+        """
+        Remove the (time, path) pair item.
+
+        :raises ValueError: if item is not in the index.
+        """
+        i = bisect_left(self._maxes, item)
+        if i < len(self._blocks):
+            block = self._blocks[i]
+            j = bisect_left(block, item)
+            if j < len(block) and block[j] == item:
+                del block[j]
+                self._len -= 1
+                if block:
+                    self._maxes[i] = block[-1]
+                else:
+                    del self._blocks[i]
+                    del self._maxes[i]
+                return
+        raise ValueError('{!r} not in index'.format(item))
+
+    def older_than(self, cutoff):
+        """Yield the pairs with a time before cutoff, oldest first."""
+        for block in self._blocks:
+            if block[-1][0] < cutoff:
+                yield from block
+            else:
+                yield from block[:bisect_left(block, (cutoff,))]
+                return
+
+    def count_older_than(self, cutoff):
+        """Return the number of pairs with a time before cutoff."""
+        count = 0
+        for block in self._blocks:
+            if block[-1][0] < cutoff:
+                count += len(block)
+            else:
+                return count + bisect_left(block, (cutoff,))
+        return count
+
+
+class StaleWatcher(object):
+    """
+    The files under a directory, kept current with inotify and indexed by
+    last modified (or accessed) time.
+    """
+
+    def __init__(self, directory, blacklist=None, get_hidden=False,
+                 flag='m'):
+        """
+        Scan directory and start watching it.
+
+        :param directory: Path name of the directory to watch.
+        :param blacklist: Optional Blacklist, or list of patterns, to
+                          exclude. Default is None.
+        :param get_hidden: Optional. Default is False. If True include
+                           hidden files and directories.
+        :param flag: Optional. Default 'm' indexes files by last modified
+                     time. Also accepts 'a' for last accessed.
+        :raises IOError: if directory does not exist, inotify is not
+                         available or the tree has more directories than
+                         inotify watches are allowed.
+        """
+        records._check_directory(directory)
+        self.top = os.path.abspath(directory)
+        self.flag = flag
+        self.get_hidden = get_hidden
+        self._excluded = records._as_blacklist(blacklist).bind(self.top)
+        self._mask = _WATCH_MASK | (IN_ACCESS if flag == 'a' else 0)
+
+        self._files = {}  # Path to FileRecord
+        self._dir_files = {}  # Directory to set of its file paths
+        self._dir_mtime = {}  # Directory to modified time when listed
+        self._wds = {}  # Watch descriptor to directory
+        self._dir_wds = {}  # Directory to watch descriptor
+        self._times = TimeIndex()
+        self._lock = threading.Lock()  # Queries come from other threads
+        self.overflows = 0
+
+        self._inotify = Inotify()
+        try:
+            self._add_tree(self.top)
+        except Exception:
+            self._inotify.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop watching."""
+        self._inotify.close()
+
+    def __len__(self):
+        """Return the number of files indexed."""
+        return len(self._files)
+
+    def _skip(self, name, path):
+        """Return True if the entry name at path is not indexed."""
+        names, other = self._excluded
+        return ((not self.get_hidden and name.startswith('.')) or
+                name in names or
+                (other is not None and other(name, path)))
+
+    def _put(self, record):
+        """Index record, replacing any older record of its path."""
+        old = self._files.get(record.path)
+        if old is not None:
+            self._times.remove((records._timestamp(old, self.flag),
+                                old.path))
+        self._files[record.path] = record
+        self._times.add((records._timestamp(record, self.flag),
+                         record.path))
+
+    def _drop(self, path):
+        """Remove the file path from the index, if it is there."""
+        old = self._files.pop(path, None)
+        if old is not None:
+            self._times.remove((records._timestamp(old, self.flag), path))
+            self._dir_files.get(os.path.dirname(path), set()).discard(path)
+
+    def _stat(self, path):
+        """Re-stat the file path, dropping it if it is gone."""
+        try:
+            st = os.stat(path)  # Follows symlinks, like the scan
+        except OSError:
+            self._drop(path)
+            return
+        if stat.S_ISDIR(st.st_mode):
+            return
+        self._dir_files.setdefault(os.path.dirname(path), set()).add(path)
+        self._put(records.FileRecord(path, st.st_size, st.st_mtime,
+                                     st.st_atime, st.st_ctime, st.st_uid))
+
+    def _list(self, root):
+        """
+        List the directory root again, indexing its files.
+
+        :returns: the list of its subdirectories.
+        """
+        try:
+            self._dir_mtime[root] = os.stat(root).st_mtime
+        except OSError:
+            return []
+        files, subdirs = records._scan_directory(root, self._excluded,
+                                                 self.get_hidden, 0)
+        found = set()
+        for rec in files:
+            found.add(rec.path)
+            self._put(rec)
+        for path in self._dir_files.get(root, set()).difference(found):
+            self._drop(path)
+        self._dir_files[root] = found
+        return subdirs
+
+    def _add_tree(self, top):
+        """Watch and index the directory top and everything below it."""
+        stack = [top]
+        while stack:
+            root = stack.pop()
+            if root in self._dir_wds:
+                continue
+            try:
+                # Watch before listing, so nothing created meanwhile is lost
+                wd = self._inotify.add_watch(root, self._mask)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise IOError('Out of inotify watches, raise '
+                                  '/proc/sys/fs/inotify/max_user_watches')
+                continue  # Gone, or not allowed, like the scan skips it
+            self._wds[wd] = root
+            self._dir_wds[root] = wd
+            stack.extend(self._list(root))
+
+    def _remove_tree(self, top):
+        """Stop watching top and everything below it, and drop its files."""
+        prefix = top + os.sep
+        for root in [d for d in self._dir_wds
+                     if d == top or d.startswith(prefix)]:
+            wd = self._dir_wds.pop(root)
+            self._wds.pop(wd, None)
+            self._inotify.rm_watch(wd)
+            self._dir_mtime.pop(root, None)
+            for path in self._dir_files.pop(root, ()):
+                old = self._files.pop(path, None)
+                if old is not None:
+                    self._times.remove((records._timestamp(old, self.flag),
+                                        path))
+
+    def rescan(self):
+        """
+        Bring the index up to date after events were lost: list again the
+        directories whose modified time changed, and re-stat the files of
+        the others.
+        """
+        with self._lock:
+            for root in list(self._dir_wds):
+                if root not in self._dir_wds:  # Removed meanwhile
+                    continue
+                try:
+                    mtime = os.stat(root).st_mtime
+                except OSError:
+                    self._remove_tree(root)
+                    continue
+                if mtime == self._dir_mtime.get(root):
+                    for path in list(self._dir_files.get(root, ())):
+                        self._stat(path)
+                    continue
+                subdirs = set(self._list(root))
+                for sub in subdirs.difference(self._dir_wds):
+                    self._add_tree(sub)
+                for sub in [d for d in self._dir_wds
+                            if d != root and os.path.dirname(d) == root and
+                            d not in subdirs]:
+                    self._remove_tree(sub)
+
+    def process_events(self, timeout=None):
+        """
+        Apply the pending inotify events to the index, waiting up to
+        timeout seconds for some to arrive.
+
+        :returns: the number of events read.
+        """
+        events = self._inotify.read(timeout)
+        if not events:
+            return 0
+
+        dirty = set()  # Files to stat once, however many events they had
+        overflow = False
+        with self._lock:
+            for wd, mask, cookie, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                root = self._wds.get(wd)
+                if root is None:
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    if not name:
+                        self._remove_tree(root)
+                    continue
+                path = os.path.join(root, name)
+                if self._skip(name, path):
+                    continue
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._add_tree(path)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._remove_tree(path)
+                    continue
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    dirty.discard(path)
+                    self._drop(path)
+                else:
+                    dirty.add(path)
+                if mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM |
+                           IN_MOVED_TO):
+                    # Keep rescan() from listing this directory again
+                    try:
+                        self._dir_mtime[root] = os.stat(root).st_mtime
+                    except OSError:
+                        pass
+            for path in dirty:
+                self._stat(path)
+
+        if overflow:
+            self.overflows += 1
+            self.rescan()
+        return len(events)
+
+    def run(self, stop, interval=0.5):
+        """
+        Process events until the threading.Event stop is set, e.g. in a
+        thread of its own.
+
+        :param stop: A threading.Event ending the loop.
+        :param interval: Optional. Seconds between checks of stop.
+        """
+        while not stop.is_set():
+            self.process_events(interval)
+
+    def older_than(self, days):
+        """
+        Return a list of the FileRecords last modified (or accessed) more
+        than days ago, oldest first.
+
+        :param days: Threshold for the number of days.
+        """
+        cutoff = records._cutoff_time(days)
+        with self._lock:
+            return [self._files[path]
+                    for _, path in self._times.older_than(cutoff)]
+
+    def count_older_than(self, days):
+        """Return the number of files older than days."""
+        cutoff = records._cutoff_time(days)
+        with self._lock:
+            return self._times.count_older_than(cutoff)
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="records_watch.py",
+        description="Watch a directory tree and keep a report of the files "
+                    "older than some days current.")
+    parser.add_argument("directory", help="Directory to watch.")
+    parser.add_argument("-d", "--days", type=int, default=90,
+                        help="Report files older than this many days "
+                             "(default: %(default)s).")
+    parser.add_argument("-l", "--last", choices=("modified", "accessed"),
+                        default="modified",
+                        help="Which file time to compare "
+                             "(default: %(default)s).")
+    parser.add_argument("-b", "--blacklist", metavar="FILE",
+                        help="File of names, globs or paths to skip.")
+    parser.add_argument("--hidden", action="store_true",
+                        help="Include hidden files and directories.")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="Rewrite this report (csv) whenever the "
+                             "number of stale files changes.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Watch a directory from the command line, printing the number of stale
+    files whenever it changes, until Ctrl-C, e.g.
+
+        python records_watch.py -d 365 -o stale.csv /srv/project
+
+    :param argv: Optional. A list of arguments, defaults to sys.argv[1:].
+    :returns: 0 when stopped with Ctrl-C, 2 on errors.
+    """
+    args = _parse_args(argv)
+    flag = 'a' if args.last == "accessed" else 'm'
+    try:
+        start = time.perf_counter()
+        watcher = StaleWatcher(args.directory,
+                               records.get_blacklist(args.blacklist),
+                               args.hidden, flag)
+    except IOError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 2
+    print("Watching {} files in {} directories, scanned in {:.1f}s".format(
+        len(watcher), len(watcher._dir_wds), time.perf_counter() - start),
+        file=sys.stderr)
+
+    last = None
+    try:
+        with watcher:
+            while True:
+                count = watcher.count_older_than(args.days)
+                if count != last:
+                    last = count
+                    print("{} {} files older than {} days".format(
+                        time.strftime('%H:%M:%S'), count, args.days))
+                    if args.output:
+                        records.write_report(watcher.older_than(args.days),
+                                             args.output, 'csv', flag)
+                # Also picks up files ageing past the cutoff while idle
+                watcher.process_events(1.0)
+    except KeyboardInterrupt:
+        return 0
+    except IOError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import records
+from records_agent import Coordinator, run_agent
+
+
+class AgentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.trees = {}
+        for name, count in (('one', 7), ('two', 12)):
+            root = os.path.join(self.tmp, name)
+            os.makedirs(os.path.join(root, 'sub'))
+            paths = []
+            for i in range(count):
+                path = os.path.join(root, 'sub' if i % 2 else '',
+                                    'f{}.txt'.format(i))
+                with open(path, 'w') as f:
+                    f.write('x' * i)
+                paths.append(path)
+            self.trees[name] = (root, paths)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def gather(self, cancel=None, **options):
+        """
+        Run an agent for each tree against one coordinator, returning the
+        merged records, the coordinator's AgentProgress by name and what
+        each run_agent() returned.
+        """
+        returned = {}
+        with Coordinator(agents=len(self.trees), timeout=10) as coordinator:
+            threads = []
+            for name, (root, _) in self.trees.items():
+                def agent(name=name, root=root):
+                    returned[name] = run_agent(coordinator.address, [root],
+                                               name, cancel=cancel,
+                                               **options)
+                threads.append(threading.Thread(target=agent, daemon=True))
+            for t in threads:
+                t.start()
+            merged = list(coordinator.iter_records())
+            for t in threads:
+                t.join(10)
+            return merged, coordinator.agents, returned
+
+    def expected(self):
+        return {'{}:{}'.format(name, path)
+                for name, (_, paths) in self.trees.items() for path in paths}
+
+    def check(self, merged, agents):
+        self.assertEqual(len(merged), len(self.expected()))
+        self.assertEqual({rec.path for rec in merged}, self.expected())
+        for rec in merged:
+            name, path = rec.path.split(':', 1)
+            self.assertIsInstance(rec, records.FileRecord)
+            self.assertEqual(rec.size, os.path.getsize(path))
+        self.assertEqual(sorted(agents), sorted(self.trees))
+        for name, progress in agents.items():
+            self.assertTrue(progress.done, name)
+            self.assertFalse(progress.cancelled, name)
+            self.assertIsNone(progress.error, name)
+            self.assertEqual(progress.received,
+                             len(self.trees[name][1]))
+
+    def test_merges_every_agent(self):
+        merged, agents, returned = self.gather()
+        self.check(merged, agents)
+        self.assertEqual(returned['two']['sent'], 12)
+        self.assertFalse(returned['two']['cancelled'])
+
+    def test_small_window(self):
+        # One batch of two records in flight at a time, so the agents wait
+        # on every acknowledgement
+        merged, agents, _ = self.gather(batch_size=2, window=1)
+        self.check(merged, agents)
+        self.assertEqual(agents['two'].batches, 6)
+
+    def test_cancelled_scan_is_not_done(self):
+        cancel = threading.Event()
+        cancel.set()
+        _, agents, returned = self.gather(cancel)
+        for name, progress in agents.items():
+            self.assertTrue(progress.cancelled, name)
+            self.assertIn('cancelled', str(progress))
+            self.assertTrue(returned[name]['cancelled'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import records
+import records_archive
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp)
+        os.makedirs(os.path.join('src', 'sub'))
+        for name in ('a.txt', 'b.txt', os.path.join('sub', 'c.txt'),
+                     '..backup'):
+            with open(os.path.join('src', name), 'w') as f:
+                f.write(name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def archive(self, source, resume):
+        """Copy the files under source, returning the entries and stats."""
+        stats = records_archive.ArchiveStats()
+        with records_archive.open_manifest('manifest.jsonl', source, 'dest',
+                                           'copy', resume) as m:
+            found = records.iter_file_records(source, None, True)
+            entries = list(records_archive.iter_archive(
+                found, source, 'dest', 'copy', m, stats=stats))
+        return entries, stats
+
+    def test_resume_with_absolute_source(self):
+        first, _ = self.archive('src', False)
+        self.assertEqual(len(first), 4)
+        for entry in first:
+            self.assertTrue(os.path.isabs(entry.path))
+
+        os.remove(os.path.join('dest', 'a.txt'))
+        second, stats = self.archive(os.path.join(self.tmp, 'src'), True)
+        self.assertEqual(second, [])
+        self.assertEqual(stats.skipped, 4)
+        self.assertFalse(os.path.exists(os.path.join('dest', 'a.txt')))
+
+    def test_dotted_names_are_under_the_source(self):
+        errors = []
+        entries = list(records_archive.iter_archive(
+            records.iter_file_records('src', None, True), 'src', 'dest',
+            on_error=lambda path, error: errors.append(path)))
+        self.assertEqual(errors, [])
+        self.assertEqual(len(entries), 4)
+        self.assertTrue(os.path.exists(os.path.join('dest', '..backup')))
+
+    def test_outside_the_source_is_refused(self):
+        errors = []
+        entries = list(records_archive.iter_archive(
+            [os.path.join('src', 'a.txt')], os.path.join('src', 'sub'),
+            'dest', on_error=lambda path, error: errors.append(path)))
+        self.assertEqual(entries, [])
+        self.assertEqual(len(errors), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import records
+import records_bench
+
+
+class _ListingCounter(records_bench._OSCounter):
+    """Counts stats, and remembers the directories listed."""
+
+    def __init__(self):
+        super().__init__()
+        self.listed = []
+
+    def scandir(self, path='.'):
+        self.listed.append(path)
+        return super().scandir(path)
+
+
+class BlacklistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.top = os.path.join(self.tmp, 'top')
+        for name in ('keep.txt', 'notes.bak', os.path.join('backup', 'a'),
+                     os.path.join('docs', 'backup'), os.path.join('docs', 'b'),
+                     os.path.join('archive', '2010', 'c'),
+                     os.path.join('archive', '2011', 'd'),
+                     os.path.join('snapshot-1', 'e'),
+                     os.path.join('tmp', 'f'), os.path.join('docs', 'tmp',
+                                                            'g')):
+            path = os.path.join(self.top, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def scan(self, patterns, top=None):
+        """Return the paths found under top, relative to it."""
+        top = self.top if top is None else top
+        return sorted(os.path.relpath(p, top) for p in records.get_file_paths(
+            top, records.Blacklist(patterns)))
+
+    def test_exact_name(self):
+        # A file and a directory of that name, anywhere in the tree
+        found = self.scan(['backup'])
+        self.assertNotIn(os.path.join('backup', 'a'), found)
+        self.assertNotIn(os.path.join('docs', 'backup'), found)
+        self.assertIn(os.path.join('docs', 'b'), found)
+        self.assertEqual(len(found), 8)
+
+    def test_globs(self):
+        found = self.scan(['*.bak', 'snapshot-*'])
+        self.assertNotIn('notes.bak', found)
+        self.assertNotIn(os.path.join('snapshot-1', 'e'), found)
+        self.assertIn('keep.txt', found)
+        self.assertEqual(len(found), 8)
+
+        # With a separator, matched against the full path
+        found = self.scan(['*' + os.sep + 'docs' + os.sep + 'tmp'])
+        self.assertNotIn(os.path.join('docs', 'tmp', 'g'), found)
+        self.assertIn(os.path.join('tmp', 'f'), found)
+
+    def test_anchored_path(self):
+        found = self.scan([os.path.join('archive', '2010'), 'tmp/'])
+        self.assertNotIn(os.path.join('archive', '2010', 'c'), found)
+        self.assertIn(os.path.join('archive', '2011', 'd'), found)
+        self.assertNotIn(os.path.join('tmp', 'f'), found)
+        # Only the one directory, not a tmp further down
+        self.assertIn(os.path.join('docs', 'tmp', 'g'), found)
+
+        found = self.scan([os.path.join(self.top, 'archive', '2011')])
+        self.assertNotIn(os.path.join('archive', '2011', 'd'), found)
+        self.assertIn(os.path.join('archive', '2010', 'c'), found)
+
+    def test_anchored_below_another_root(self):
+        # Anchored at the scan start, not at the current directory
+        archive = os.path.join(self.top, 'archive')
+        found = self.scan(['2010'], archive)
+        self.assertEqual(found, [os.path.join('2011', 'd')])
+        found = self.scan([os.path.join('archive', '2010')], archive)
+        self.assertEqual(len(found), 2)
+
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        try:
+            found = self.scan([os.path.join('archive', '2010')], 'top')
+        finally:
+            os.chdir(cwd)
+        self.assertNotIn(os.path.join('archive', '2010', 'c'), found)
+        self.assertEqual(len(found), 9)
+
+        # An absolute pattern outside the scan is ignored
+        found = self.scan([os.path.join(self.top, 'docs')], archive)
+        self.assertEqual(len(found), 2)
+
+    def test_pruned_directory_is_not_listed(self):
+        counter = _ListingCounter()
+        records.os = counter
+        try:
+            found = list(records.iter_file_records(
+                self.top, records.Blacklist(['archive', 'backup'])))
+        finally:
+            records.os = os
+        self.assertEqual(len(found), 6)
+        self.assertEqual(counter.counts['stat'], 6)
+        for path in counter.listed:
+            self.assertNotIn('archive', path)
+            self.assertNotIn('backup', path)
+
+    def test_comments_and_blank_lines(self):
+        blacklist = records.Blacklist(['# a comment', '', '  ', ' tmp '])
+        self.assertEqual(list(blacklist), ['tmp'])
+
+
+if __name__ == '__main__':
+    unittest.main()
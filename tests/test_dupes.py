@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import records
+import records_dupes
+from records_dupes import EDGE_SIZE, HashCache, find_duplicates
+
+
+class FindDuplicatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tree = os.path.join(self.tmp, 'tree')
+        os.makedirs(self.tree)
+        big = b'a' * EDGE_SIZE + b'middle' * 1000 + b'z' * EDGE_SIZE
+        other_middle = big.replace(b'middle', b'MIDDLE', 1)
+        self.write('small1', b'same small')
+        self.write('small2', b'same small')
+        self.write('small3', b'diff small')  # Same size, other contents
+        self.write('big1', big)
+        self.write('big2', big)
+        self.write('big3', other_middle)  # Same size and edges
+        self.write('unique', b'no other file is this long')
+        self.write('empty1', b'')
+        self.write('empty2', b'')
+        os.link(os.path.join(self.tree, 'big1'),
+                os.path.join(self.tree, 'big1.link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, data):
+        with open(os.path.join(self.tree, name), 'wb') as f:
+            f.write(data)
+
+    def paths(self, *names):
+        return [os.path.join(self.tree, n) for n in names]
+
+    def find(self, cache=None):
+        return find_duplicates(records.iter_file_records(self.tree), cache)
+
+    def test_groups(self):
+        groups = self.find()
+        self.assertEqual(len(groups), 2)
+        big, small = groups  # The most bytes wasted first
+        self.assertEqual(small.paths, self.paths('small1', 'small2'))
+        self.assertEqual(small.size, 10)
+        # One path of the hard linked pair, and not big3
+        self.assertEqual(len(big.paths), 2)
+        self.assertIn(big.paths[0], self.paths('big1', 'big1.link'))
+        self.assertEqual(big.paths[1], self.paths('big2')[0])
+        self.assertEqual(big.digest,
+                         records_dupes._hash_full(self.paths('big2')[0]))
+
+    def test_only_same_edges_are_hashed_in_full(self):
+        with mock.patch.object(records_dupes, '_hash_full',
+                               wraps=records_dupes._hash_full) as full:
+            self.find()
+        hashed = sorted(os.path.basename(c[0][0]) for c in full.call_args_list)
+        self.assertEqual(len(hashed), 3)
+        self.assertEqual(hashed[1:], ['big2', 'big3'])
+
+    def test_cache_is_reused(self):
+        db = os.path.join(self.tmp, 'hashes.db')
+        with HashCache(db) as cache:
+            first = self.find(cache)
+            self.assertEqual(len(cache), 6)
+        with HashCache(db) as cache, \
+                mock.patch.object(records_dupes, '_hash_edges') as edges, \
+                mock.patch.object(records_dupes, '_hash_full') as full:
+            second = self.find(cache)
+        self.assertFalse(edges.called)
+        self.assertFalse(full.called)
+        self.assertEqual(first, second)
+
+    def test_changed_file_is_hashed_again(self):
+        db = os.path.join(self.tmp, 'hashes.db')
+        with HashCache(db) as cache:
+            self.find(cache)
+        self.write('small2', b'diff small')  # Now a copy of small3
+        with HashCache(db) as cache:
+            groups = self.find(cache)
+        self.assertEqual(groups[1].paths, self.paths('small2', 'small3'))
+
+
+class HashCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, 'hashes.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_commits_before_close(self):
+        cache = HashCache(self.db, commit_every=10)
+        try:
+            for i in range(25):
+                cache.put((1, i, 100, 0), partial='p{}'.format(i))
+            # Another connection sees what was committed, as a later run
+            # would after this one was killed
+            with HashCache(self.db) as other:
+                self.assertEqual(len(other), 20)
+                self.assertEqual(other.get((1, 3, 100, 0)), ('p3', None))
+        finally:
+            cache.close()
+        with HashCache(self.db) as other:
+            self.assertEqual(len(other), 25)
+
+if __name__ == '__main__':
+    unittest.main()
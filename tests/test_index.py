@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import records
+from records_index import ScanIndex
+
+
+class ScanIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tree = os.path.join(self.tmp, 'tree')
+        os.makedirs(os.path.join(self.tree, 'sub'))
+        old = time.time() - 100 * 86400
+        for name in ('old.txt', os.path.join('sub', 'older.txt')):
+            path = os.path.join(self.tree, name)
+            with open(path, 'w') as f:
+                f.write('data')
+            os.utime(path, (old, old))
+        with open(os.path.join(self.tree, 'new.txt'), 'w') as f:
+            f.write('data')
+        self.db = os.path.join(self.tmp, 'index.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_older_than_reads_records(self):
+        with ScanIndex(self.db) as index:
+            index.update(self.tree)
+            self.assertEqual(len(index), 3)
+            found = list(index.older_than(90))
+
+        self.assertEqual(sorted(os.path.basename(f.path) for f in found),
+                         ['old.txt', 'older.txt'])
+        for f in found:
+            self.assertIsInstance(f, records.FileRecord)
+            self.assertEqual(f.size, 4)
+            self.assertIsNone(f.uid)
+
+    def test_older_than_directory(self):
+        with ScanIndex(self.db) as index:
+            index.update(self.tree)
+            found = list(index.older_than(
+                90, directory=os.path.join(self.tree, 'sub')))
+        self.assertEqual([os.path.basename(f.path) for f in found],
+                         ['older.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
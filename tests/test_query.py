@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import records
+from records_query import Query, QueryError, _Parser, iter_query
+
+NOW = time.mktime((2020, 6, 1, 0, 0, 0, 0, 0, -1))
+DAY = 24 * 60 * 60
+
+
+def _record(path, size=0, days=0):
+    t = NOW - days * DAY
+    return records.FileRecord(path, size, t, t, t)
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_and_binds_tighter_than_or(self):
+        tree = _Parser("name == a or name == b and size > 1").parse()
+        self.assertEqual(tree[0], 'or')
+        self.assertEqual(tree[1][0], ('cmp', 'name', None, '==', 'a'))
+        self.assertEqual(tree[1][1][0], 'and')
+
+    def test_parentheses(self):
+        tree = _Parser("(name == a or name == b) and size > 1").parse()
+        self.assertEqual(tree[0], 'and')
+        self.assertEqual(tree[1][0][0], 'or')
+
+        q = Query("(ext == pst or ext == iso) and size > 1KB", NOW)
+        self.assertTrue(q.match(_record('/x/a.pst', 2048)))
+        self.assertFalse(q.match(_record('/x/a.pst', 10)))
+        self.assertFalse(q.match(_record('/x/a.doc', 2048)))
+        q = Query("ext == pst or ext == iso and size > 1KB", NOW)
+        self.assertTrue(q.match(_record('/x/a.pst', 10)))
+        self.assertFalse(q.match(_record('/x/a.iso', 10)))
+
+    def test_not(self):
+        q = Query("not (ext in {tmp, bak}) and not size > 10", NOW)
+        self.assertTrue(q.match(_record('/x/a.doc', 5)))
+        self.assertFalse(q.match(_record('/x/a.BAK', 5)))
+        self.assertFalse(q.match(_record('/x/a.doc', 50)))
+        q = Query("ext not in {tmp}", NOW)
+        self.assertFalse(q.match(_record('/x/a.tmp')))
+
+    def test_size_units(self):
+        for text, size in (("size > 1KB", 1 << 10), ("size > 2mb", 2 << 20),
+                           ("size > 1.5G", 3 << 29), ("size > 1TiB", 1 << 40),
+                           ("size > 10b", 10), ("size > 10", 10)):
+            q = Query(text, NOW)
+            self.assertFalse(q.match(_record('/x/f', size)), text)
+            self.assertTrue(q.match(_record('/x/f', size + 1)), text)
+
+    def test_ages_and_dates(self):
+        q = Query("age > 365", NOW)
+        self.assertTrue(q.match(_record('/x/f', days=366)))
+        self.assertFalse(q.match(_record('/x/f', days=364)))
+        rec = records.FileRecord('/x/f', 0, NOW, NOW - 400 * DAY, NOW)
+        self.assertTrue(Query("age('a') > 365", NOW).match(rec))
+        self.assertFalse(Query("age('m') > 365", NOW).match(rec))
+        self.assertTrue(Query("mtime > 2020-05-01", NOW).match(rec))
+        self.assertFalse(Query("atime > 2020-05-01", NOW).match(rec))
+
+    def test_strings(self):
+        q = Query("name == 'a b.txt' or name like \"*.pst\"", NOW)
+        self.assertTrue(q.match(_record('/x/a b.txt')))
+        self.assertTrue(q.match(_record('/x/mail.pst')))
+        self.assertFalse(q.match(_record('/x/a.txt')))
+        q = Query("ext in {.PST, iso}", NOW)
+        self.assertTrue(q.match(_record('/x/A.pst')))
+
+    def test_syntax_errors(self):
+        for text in ("", "size >", "size > > 1", "(size > 1", "size > 1)",
+                     "colour == red", "age('x') > 1", "size like '*'",
+                     "size > abc", "name == a and", "mtime > 2020-13-01",
+                     "size ! 1", "ext in {pst"):
+            with self.assertRaises(QueryError, msg=text):
+                Query(text, NOW)
+        self.assertTrue(issubclass(QueryError, ValueError))
+
+
+class PruneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = os.path.realpath(tempfile.mkdtemp())
+        old = time.time() - 400 * DAY
+        for i, name in enumerate(('keep/a.pst', 'keep/b.doc',
+                                  'keep/deep/c.pst', 'keep/deep/d.iso',
+                                  'skip/e.pst', 'skip/deep/f.pst',
+                                  'skipped.pst', 'other/g.pst')):
+            path = os.path.join(self.tmp, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.truncate(i * 1000)
+            if i % 2:
+                os.utime(path, (old, old))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def brute_force(self, query):
+        return sorted(r.path for r in records.iter_file_records(self.tmp)
+                      if query.match(r))
+
+    def listed(self, query):
+        dirs = []
+        found = sorted(r.path for r in iter_query(
+            self.tmp, query,
+            on_directory=lambda path, files: dirs.append(path)))
+        return found, dirs
+
+    def test_pruned_directories_have_no_matches(self):
+        keep = os.path.join(self.tmp, 'keep', '')
+        query = Query("path like '{}*' and ext == pst".format(keep))
+        self.assertIsNotNone(query.prune)
+        found, dirs = self.listed(query)
+        self.assertEqual(found, self.brute_force(query))
+        self.assertEqual(len(found), 2)
+        for path in ('skip', os.path.join('skip', 'deep'), 'other'):
+            self.assertNotIn(os.path.join(self.tmp, path), dirs)
+        for path in dirs:
+            if query.prune(path):
+                self.assertFalse([f for f in found
+                                  if f.startswith(path + os.sep)])
+
+    def test_not_path_like(self):
+        skip = os.path.join(self.tmp, 'skip', '')
+        query = Query("not path like '{}*' and size > 2000".format(skip))
+        found, dirs = self.listed(query)
+        self.assertEqual(found, self.brute_force(query))
+        self.assertNotIn(os.path.join(self.tmp, 'skip'), dirs)
+        self.assertIn(os.path.join(self.tmp, 'keep', 'deep'), dirs)
+
+    def test_matches_brute_force(self):
+        keep = os.path.join(self.tmp, 'keep', '')
+        for text in ("ext in {pst, iso} and age > 365",
+                     "name like '*.pst' or size >= 5000",
+                     "not (path like '{}*') or ext == doc".format(keep),
+                     "path like '{}*' or age < 1".format(keep),
+                     "(path like '{0}*' and ext == iso) or "
+                     "not path like '{0}*'".format(keep)):
+            query = Query(text)
+            found, _ = self.listed(query)
+            self.assertEqual(found, self.brute_force(query), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
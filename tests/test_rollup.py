@@ -0,0 +1,27 @@
+import os
+import unittest
+
+import records
+
+
+def _record(path, size):
+    return records.FileRecord(path, size, 0, 0, 0)
+
+
+class DirectoryRollupTest(unittest.TestCase):
+
+    def test_stops_at_root(self):
+        root = os.path.join(os.sep, 'srv', 'share')
+        rollup = records.DirectoryRollup(root + os.sep)
+        rollup.add(_record(os.path.join(root, 'a'), 1))
+        rollup.add(_record(os.path.join(root, 'sub', 'b'), 2))
+        rollup.finish()
+
+        self.assertEqual([rollup.paths[i] for i in rollup.roots()], [root])
+        self.assertEqual(rollup.top(10), [
+            records.RollupEntry(root, 2, 3),
+            records.RollupEntry(os.path.join(root, 'sub'), 1, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
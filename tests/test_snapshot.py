@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import records
+from records_snapshot import Snapshot, diff_snapshots, save_snapshot
+
+DAY = 24 * 60 * 60
+
+
+def _record(path, size=0, mtime=0.0):
+    return records.FileRecord(path, size, mtime, mtime, mtime)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tree = os.path.join(self.tmp, 'tree')
+        # Names that sort next to each other, byte-wise and not
+        for name in ('a', 'a b', 'a.b', 'a0', 'ab', os.path.join('a-', 'x'),
+                     os.path.join('d', 'a'), os.path.join('d', 'b')):
+            self.write(name, 'old')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, text):
+        path = os.path.join(self.tree, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def save(self, name):
+        snap = os.path.join(self.tmp, name)
+        save_snapshot(records.iter_file_records(self.tree), snap)
+        return Snapshot(snap)
+
+    def diff(self, old, new, **options):
+        changes = {}
+        for c in diff_snapshots(old, new, **options):
+            rel = os.path.relpath(c.path, self.tree)
+            changes.setdefault(c.change, set()).add(rel)
+        return changes
+
+    def test_round_trip(self):
+        with self.save('one') as one:
+            self.assertEqual(len(one), 8)
+            self.assertEqual(sorted(r.path for r in one),
+                             sorted(r.path for r in
+                                    records.iter_file_records(self.tree)))
+            self.assertEqual(one.find(os.path.join(self.tree, 'a.b')),
+                             [r.path for r in one].index(
+                                 os.path.join(self.tree, 'a.b')))
+            self.assertEqual(one.find(os.path.join(self.tree, 'zz')), -1)
+
+    def test_diff_after_changes(self):
+        before = self.save('before')
+        os.remove(os.path.join(self.tree, 'a b'))
+        os.remove(os.path.join(self.tree, 'd', 'b'))
+        self.write('a.b', 'changed')
+        self.write('a.a', 'new')
+        self.write(os.path.join('d', 'c'), 'new')
+        self.write('zz', 'new')
+        with before, self.save('after') as after:
+            self.assertEqual(self.diff(before, after), {
+                'added': {'a.a', os.path.join('d', 'c'), 'zz'},
+                'deleted': {'a b', os.path.join('d', 'b')},
+                'modified': {'a.b'}})
+            self.assertEqual(self.diff(after, after), {})
+
+    def test_empty_snapshots(self):
+        empty = os.path.join(self.tmp, 'empty')
+        self.assertEqual(save_snapshot([], empty), 0)
+        with Snapshot(empty) as a, Snapshot(empty) as b, \
+                self.save('full') as full:
+            self.assertEqual(len(a), 0)
+            self.assertEqual(list(a), [])
+            self.assertEqual(a.find('a'), -1)
+            self.assertEqual(list(diff_snapshots(a, b)), [])
+            self.assertEqual(set(self.diff(a, full)), {'added'})
+            self.assertEqual(len(self.diff(a, full)['added']), 8)
+            self.assertEqual(len(self.diff(full, a)['deleted']), 8)
+
+    def test_adjacent_paths_and_crossed(self):
+        now = time.time()
+        old = os.path.join(self.tmp, 'old')
+        new = os.path.join(self.tmp, 'new')
+        save_snapshot([_record('a', 1, now - 10 * DAY),
+                       _record('a/b', 1, now - 100 * DAY),
+                       _record('a.b', 1, now),
+                       _record('a b', 1, now - 100 * DAY)], old, now)
+        save_snapshot([_record('a b', 1, now - 100 * DAY),
+                       _record('a', 1, now - 10 * DAY),
+                       _record('a.c', 1, now),
+                       _record('a/b', 2, now - 100 * DAY)], new,
+                      now + 30 * DAY)
+        with Snapshot(old) as a, Snapshot(new) as b:
+            self.assertEqual([r.path for r in b], ['a', 'a b', 'a.c', 'a/b'])
+            changes = [(c.change, c.path)
+                       for c in diff_snapshots(a, b, days=30)]
+        self.assertEqual(changes, [('crossed', 'a'), ('deleted', 'a.b'),
+                                   ('added', 'a.c'), ('modified', 'a/b')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import records
+
+
+def _fake_scan(fail=None, delay=0.001):
+    """
+    Return a scan callable for a made up tree, ten directories wide and
+    three deep, with one file in each directory. Listing fail raises.
+    """
+    def scan(root):
+        time.sleep(delay)
+        if root == fail:
+            raise OSError("cannot list " + root)
+        depth = root.count('/')
+        subdirs = ([root + '/' + str(n) for n in range(10)]
+                   if depth < 3 else [])
+        return [root + '/file'], subdirs
+    return scan
+
+
+class ParallelWalkTest(unittest.TestCase):
+
+    def run_walk(self, scan, workers):
+        """Run _parallel_walk in a thread, failing if it does not finish."""
+        outcome = {}
+
+        def target():
+            try:
+                outcome['files'] = records._parallel_walk('r', scan, workers)
+            except Exception as e:
+                outcome['error'] = e
+
+        t = threading.Thread(target=target, daemon=True)
+        t.start()
+        t.join(10)
+        self.assertFalse(t.is_alive(), "walk did not finish")
+        return outcome
+
+    def test_walks_every_directory(self):
+        outcome = self.run_walk(_fake_scan(), 4)
+        self.assertEqual(len(outcome['files']), 1 + 10 + 100 + 1000)
+
+    def test_scan_error_is_raised(self):
+        for fail in ('r', 'r/3', 'r/5/7', 'r/9/9/9'):
+            outcome = self.run_walk(_fake_scan(fail), 4)
+            self.assertIsInstance(outcome.get('error'), OSError, fail)
+
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tree = os.path.join(self.tmp, 'tree')
+        for a in range(4):
+            for b in range(3):
+                sub = os.path.join(self.tree, 'd{}'.format(a),
+                                   'e{}'.format(b))
+                os.makedirs(sub)
+                for name in ('f0', 'f1'):
+                    with open(os.path.join(sub, name), 'w') as f:
+                        f.write(name)
+            with open(os.path.join(self.tree, 'g{}'.format(a)), 'w') as f:
+                f.write('g')
+        self.checkpoint = os.path.join(self.tmp, 'scan.checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def interrupted(self, stop, interval):
+        """
+        Walk the tree, stopping after stop files, then resume it from the
+        checkpoint, returning every file yielded after the resume.
+        """
+        with records.ScanCheckpoint(self.checkpoint, ['opts'],
+                                    interval=interval) as checkpoint:
+            walk = records.iter_file_records(self.tree,
+                                             checkpoint=checkpoint)
+            first = [next(walk) for _ in range(stop)]
+            walk.close()
+        self.assertEqual(len(first), stop)
+        with records.ScanCheckpoint(self.checkpoint, ['opts'],
+                                    resume=True) as checkpoint:
+            return list(records.iter_file_records(self.tree,
+                                                  checkpoint=checkpoint))
+
+    def test_resume_yields_the_full_scan(self):
+        full = sorted(records.iter_file_records(self.tree))
+        self.assertEqual(len(full), 28)
+        for interval in (0, 3600):
+            for stop in (1, 5, 13, 27):
+                resumed = self.interrupted(stop, interval)
+                self.assertEqual(len(resumed), len(set(resumed)),
+                                 (stop, interval))
+                self.assertEqual(sorted(resumed), full, (stop, interval))
+
+    def test_other_options_refused(self):
+        with records.ScanCheckpoint(self.checkpoint, ['opts']) as checkpoint:
+            checkpoint.start(self.tree)
+            checkpoint.save(self.tree, [])
+        with self.assertRaises(IOError):
+            records.ScanCheckpoint(self.checkpoint, ['other'], resume=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from records_watch import StaleWatcher, TimeIndex
+
+DAY = 24 * 60 * 60
+
+
+class TimeIndexTest(unittest.TestCase):
+
+    def check(self, index, expected):
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual(list(index.older_than(float('inf'))),
+                         sorted(expected))
+        for cutoff in (-1, 0, 3, 50, 99.5, 1000):
+            older = sorted(p for p in expected if p[0] < cutoff)
+            self.assertEqual(list(index.older_than(cutoff)), older)
+            self.assertEqual(index.count_older_than(cutoff), len(older))
+
+    def test_add_remove_older_than(self):
+        rng = random.Random(1)
+        index = TimeIndex()
+        index._LOAD = 4  # Split blocks often
+        expected = set()
+        for n in range(500):
+            item = (rng.randrange(100), 'f{}'.format(n))
+            index.add(item)
+            expected.add(item)
+        self.check(index, expected)
+        self.assertGreater(len(index._blocks), 10)
+
+        for item in rng.sample(sorted(expected), 400):
+            index.remove(item)
+            expected.discard(item)
+        self.check(index, expected)
+
+        # An update is a remove of the old pair and an add of the new one
+        item = min(expected)
+        index.remove(item)
+        index.add((item[0] + 1000, item[1]))
+        expected.remove(item)
+        expected.add((item[0] + 1000, item[1]))
+        self.check(index, expected)
+
+        for item in list(expected):
+            index.remove(item)
+        self.check(index, set())
+
+    def test_same_time_ordered_by_path(self):
+        index = TimeIndex()
+        for path in ('b', 'c', 'a'):
+            index.add((5, path))
+        self.assertEqual(list(index.older_than(6)),
+                         [(5, 'a'), (5, 'b'), (5, 'c')])
+
+    def test_remove_missing(self):
+        index = TimeIndex()
+        with self.assertRaises(ValueError):
+            index.remove((1, 'a'))
+        index.add((1, 'a'))
+        with self.assertRaises(ValueError):
+            index.remove((2, 'a'))
+
+
+@unittest.skipIf(not sys.platform.startswith('linux'), 'needs inotify')
+class StaleWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.old = time.time() - 100 * DAY
+        self.write('old.txt')
+        self.watcher = StaleWatcher(self.tmp)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.tmp)
+
+    def write(self, name):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            f.write(name)
+        os.utime(path, (self.old, self.old))
+        return path
+
+    def stale(self):
+        return sorted(os.path.relpath(r.path, self.tmp)
+                      for r in self.watcher.older_than(90))
+
+    def wait_for(self, expected):
+        """Process events until the stale files are expected."""
+        deadline = time.monotonic() + 5
+        while self.stale() != expected and time.monotonic() < deadline:
+            self.watcher.process_events(0.1)
+        self.assertEqual(self.stale(), expected)
+
+    def test_create_delete_mkdir(self):
+        self.assertEqual(self.stale(), ['old.txt'])
+
+        self.write('new.txt')
+        self.wait_for(['new.txt', 'old.txt'])
+
+        os.remove(os.path.join(self.tmp, 'old.txt'))
+        self.wait_for(['new.txt'])
+
+        os.mkdir(os.path.join(self.tmp, 'sub'))
+        self.write(os.path.join('sub', 'inner.txt'))
+        self.wait_for(['new.txt', os.path.join('sub', 'inner.txt')])
+
+        shutil.rmtree(os.path.join(self.tmp, 'sub'))
+        self.wait_for(['new.txt'])
+        self.assertEqual(len(self.watcher), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()